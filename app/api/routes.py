@@ -1,91 +1,768 @@
-from flask import Blueprint, request, jsonify
+from flask import Blueprint, Response, current_app, request, jsonify, stream_with_context
+from app.models.aggregation import FlowAggregator
+from app.models.alerts import AlertSuppressor
+from app.models.incremental import IncrementalLearner
+from app.models.registry import ModelRegistry, RegistryError, RegistryWatcher
+from app.models.shadow import ShadowScorer
 from app.models.threat_detector import ThreatDetector
+from app.models.training import TrainingJobManager
+from app.models.training_data import (CONTENT_TYPES, SUBSAMPLE_METHODS, TrainingFile,
+                                      UploadTooLarge, format_for_path, open_matrix,
+                                      resolve_server_path, spool_upload, validate_matrix)
+from app.utils.analysis_log import AnalysisLogger
+from app.utils.coalescer import RequestCoalescer
+from app.utils.data_processor import NetworkDataProcessor
+from app.utils.flow_records import as_records, is_flow_array, unpack_ipv4
+from app.utils.history_store import HistoryStore, to_epoch
+from app.utils.metrics import stage_timer
+from app.utils.profiling import MODES as PROFILE_MODES, profiler
+from app.utils.serialization import encode_response
+import hmac
+import json
 import logging
+import os
 
 api_bp = Blueprint('api', __name__)
-threat_detector = ThreatDetector()
+
+model_registry = None
+if os.getenv('MODEL_REGISTRY_DIR'):
+    model_registry = ModelRegistry(os.getenv('MODEL_REGISTRY_DIR'),
+                                   keep=int(os.getenv('MODEL_REGISTRY_KEEP', '10')))
+
+def load_initial_detector():
+    """Build the detector workers start with: the registry's current version, else MODEL_PATH"""
+    detector = ThreatDetector()
+    model_path = os.getenv('MODEL_PATH')
+    require_trained = os.getenv('REQUIRE_TRAINED_MODEL', 'false').lower() == 'true'
+    
+    current = model_registry.current_version() if model_registry is not None else None
+    if current is not None:
+        try:
+            detector = model_registry.load(current)
+        except RegistryError as e:
+            logging.error(f"Could not preload registry version {current}: {e}")
+    if not detector.is_trained and model_path and not detector.load_model(model_path):
+        logging.error(f"Could not preload model from {model_path}")
+    
+    if require_trained and not detector.is_trained:
+        # Refuse to boot rather than silently serve rule-based results
+        raise RuntimeError('REQUIRE_TRAINED_MODEL is set but no trained model could be loaded')
+    return detector
+
+threat_detector = load_initial_detector()
+
+def _publish_detector(detector):
+    """Swap in a newly trained detector with a single reference assignment"""
+    global threat_detector
+    threat_detector = detector
+
+def _serve_detector(detector):
+    """Publish a fully trained or loaded detector and restart incremental learning from it"""
+    # Rebase first, so a refresh of the previous detector still in flight is dropped
+    # instead of being published over this one
+    if incremental_learner is not None:
+        incremental_learner.rebase(detector)
+    _publish_detector(detector)
+
+def _publish_trained_detector(detector):
+    """Serve a newly trained detector, recording it as the registry's next version"""
+    if model_registry is not None:
+        try:
+            version = model_registry.publish(detector, metadata={'source': 'train'}, activate=True)
+            if registry_watcher is not None:
+                registry_watcher.served_version = version
+        except Exception as e:
+            logging.error(f"Registering trained model failed: {e}")
+    _serve_detector(detector)
+
+# Job states are shared through TRAINING_JOBS_DIR and trained models through the
+# registry, so every gunicorn worker can report a job and serve its model. Without
+# TRAINING_JOBS_DIR jobs are only known to the worker that started them
+training_manager = TrainingJobManager(
+    on_complete=_publish_trained_detector,
+    max_workers=int(os.getenv('TRAINING_WORKERS', '1')),
+    state_dir=os.getenv('TRAINING_JOBS_DIR') or None
+)
+
+incremental_learner = None
+if os.getenv('INCREMENTAL_LEARNING', 'false').lower() == 'true':
+    incremental_learner = IncrementalLearner(
+        threat_detector,
+        on_update=_publish_detector,
+        reservoir_size=int(os.getenv('INCREMENTAL_RESERVOIR_SIZE', '10000')),
+        max_age=float(os.getenv('INCREMENTAL_MAX_AGE_SECONDS', '3600')),
+        refresh_every=int(os.getenv('INCREMENTAL_REFRESH_EVERY', '5000')),
+        refresh_interval=float(os.getenv('INCREMENTAL_REFRESH_INTERVAL_SECONDS', '900')),
+        refresh_fraction=float(os.getenv('INCREMENTAL_REFRESH_FRACTION', '0.2'))
+    )
+
+def _observe_traffic(records, results):
+    """Feed scored traffic to the incremental learner, if enabled"""
+    if incremental_learner is None:
+        return
+    try:
+        incremental_learner.observe(records, results)
+    except Exception as e:
+        logging.error(f"Incremental learning error: {e}")
+
+shadow_scorer = None
+
+def _set_shadow(detector, version, sample_rate):
+    """Replace the shadow candidate (None stops shadow scoring)"""
+    global shadow_scorer
+    previous = shadow_scorer
+    shadow_scorer = None if detector is None else ShadowScorer(
+        detector, version, sample_rate,
+        max_queue=int(os.getenv('SHADOW_QUEUE_SIZE', '1000'))
+    ).start()
+    if previous is not None:
+        previous.stop()
+
+def _shadow_traffic(records, results):
+    """Offer scored traffic to the shadow candidate, if one is running"""
+    scorer = shadow_scorer
+    if scorer is None:
+        return
+    try:
+        scorer.offer(records, results)
+    except Exception as e:
+        logging.error(f"Shadow scoring error: {e}")
+
+registry_watcher = None
+if model_registry is not None:
+    registry_watcher = RegistryWatcher(
+        model_registry, on_activate=_serve_detector, on_shadow=_set_shadow,
+        poll_interval=float(os.getenv('MODEL_REGISTRY_POLL_SECONDS', '5')),
+        served_version=threat_detector.registry_version
+    )
+
+@api_bp.before_app_request
+def _start_registry_watcher():
+    # Started from the first request in each worker, not at import in the preloading master
+    if registry_watcher is not None:
+        registry_watcher.start()
+
+# 'auto' aggregates only while the detector reads the aggregates: as features,
+# or through rule thresholds while rules decide (untrained or pre-filtering)
+FLOW_AGGREGATION = os.getenv('FLOW_AGGREGATION', 'auto').lower()
+flow_aggregator = None
+if FLOW_AGGREGATION in ('auto', 'true'):
+    flow_aggregator = FlowAggregator(
+        window=float(os.getenv('FLOW_WINDOW_SECONDS', '60')),
+        buckets=int(os.getenv('FLOW_WINDOW_BUCKETS', '6'))
+    )
+
+def _aggregation_needed(detector):
+    if FLOW_AGGREGATION == 'true' or detector.feature_extractor.aggregates:
+        return True
+    if detector.is_trained and not detector.rule_prefilter:
+        return False
+    return bool(detector.rules.current().record_fields)
+
+def _flow_batch(records, detector):
+    """Records packed into a compact flow array; the dicts when an endpoint is not IPv4"""
+    if not records:
+        return records
+    aggregates = flow_aggregator is not None and _aggregation_needed(detector)
+    flows = NetworkDataProcessor.process_network_batch(records, aggregates=aggregates,
+                                                       ipv4_only=True)
+    return records if flows is None else flows
+
+def _aggregate_flows(records, detector):
+    """Copies of records with per-source sliding-window aggregates, if ``detector`` reads them"""
+    if flow_aggregator is None or not _aggregation_needed(detector):
+        return records
+    try:
+        with stage_timer('aggregation'):
+            return flow_aggregator.enrich(records)
+    except Exception as e:
+        logging.error(f"Flow aggregation error: {e}")
+        return records
+
+_history_store = None
+
+def get_history_store():
+    """Threat history store, opened on first use in each process; None without HISTORY_DB_PATH"""
+    global _history_store
+    path = os.getenv('HISTORY_DB_PATH')
+    if _history_store is None and path:
+        _history_store = HistoryStore(
+            path,
+            retention_days=float(os.getenv('HISTORY_RETENTION_DAYS', '30'))
+        )
+    return _history_store
+
+def _record_detections(records, results):
+    """Queue flagged results for the threat history without blocking the response"""
+    store = get_history_store()
+    if store is None:
+        return
+    # Suppressed alerts are folded into their incident rather than stored one by one
+    entries = [
+        {
+            'threat_level': result.get('threat_level', 'low'),
+            'source_ip': record.get('source_ip'),
+            'destination_ip': record.get('destination_ip'),
+            'destination_port': record.get('port'),
+            'protocol': record.get('protocol'),
+            'confidence': result.get('confidence')
+        }
+        for record, result in zip(as_records(records), results)
+        if result.get('is_threat') and not result.get('suppressed')
+    ]
+    if entries:
+        try:
+            store.record(entries)
+        except Exception as e:
+            logging.error(f"Threat history error: {e}")
+
+def _score_records(records, score):
+    """Score, learn from, rate limit and record records; ``score`` maps records to results
+    
+    Flows from sources the alert suppressor has confirmed as high threats skip
+    ``score``, and only freshly scored flows reach the learner and the shadow.
+    """
+    if alert_suppressor is None:
+        results = score(records)
+        _observe_traffic(records, results)
+        _shadow_traffic(records, results)
+    else:
+        results = alert_suppressor.lookup(records)
+        pending = [index for index, result in enumerate(results) if result is None]
+        if pending:
+            if len(pending) == len(records):
+                scored_records = records
+            elif is_flow_array(records):
+                scored_records = records[pending]
+            else:
+                scored_records = [records[index] for index in pending]
+            scored = score(scored_records)
+            for index, result in zip(pending, scored):
+                results[index] = result
+            _observe_traffic(scored_records, scored)
+            _shadow_traffic(scored_records, scored)
+        results = alert_suppressor.process(records, results)
+    _record_detections(records, results)
+    return results
+
+def _analyze_records(records, compact=False):
+    """Aggregate, score, learn from and record a batch with the current detector
+    
+    With ``compact`` the records are packed into a flow array first (see
+    ``_flow_batch``); coalesced single requests stay dicts.
+    """
+    detector = threat_detector
+    if compact:
+        records = _flow_batch(records, detector)
+    return _score_records(_aggregate_flows(records, detector), detector.predict_batch)
+
+analyze_coalescer = None
+if os.getenv('ANALYZE_COALESCING', 'false').lower() == 'true':
+    analyze_coalescer = RequestCoalescer(
+        _analyze_records,
+        max_batch=int(os.getenv('COALESCE_MAX_BATCH', '64')),
+        max_delay=float(os.getenv('COALESCE_MAX_DELAY_MS', '2')) / 1000.0
+    )
+
+analysis_logger = AnalysisLogger(
+    benign_sample_rate=float(os.getenv('ANALYSIS_LOG_BENIGN_SAMPLE_RATE', '0.01')),
+    max_queue=int(os.getenv('ANALYSIS_LOG_QUEUE_SIZE', '10000'))
+)
+analysis_logger.start()
+
+alert_suppressor = None
+if os.getenv('ALERT_SUPPRESSION', 'false').lower() == 'true':
+    alert_suppressor = AlertSuppressor(
+        rate=float(os.getenv('ALERT_RATE_PER_SECOND', '1')),
+        burst=int(os.getenv('ALERT_BURST', '5')),
+        window=float(os.getenv('ALERT_WINDOW_SECONDS', '60')),
+        max_incidents=int(os.getenv('ALERT_MAX_INCIDENTS', '100000')),
+        short_circuit_after=int(os.getenv('ALERT_SHORT_CIRCUIT_AFTER', '0')) or None,
+        short_circuit_levels=[level.strip() for level in
+                              os.getenv('ALERT_SHORT_CIRCUIT_LEVELS', 'high').split(',')
+                              if level.strip()],
+        on_close=analysis_logger.log_incident
+    )
+
+REQUIRED_FIELDS = ['packet_size', 'port', 'protocol']
+# 'full' wraps the result and echoes the input; 'lean' returns the result fields only
+ANALYZE_RESPONSE_MODE = os.getenv('ANALYZE_RESPONSE_MODE', 'full').lower()
+MAX_BATCH_SIZE = int(os.getenv('MAX_BATCH_SIZE', '10000'))
+STREAM_CHUNK_SIZE = int(os.getenv('STREAM_CHUNK_SIZE', '1000'))
+STREAM_MAX_LINE_BYTES = int(os.getenv('STREAM_MAX_LINE_BYTES', '65536'))
+# Training uploads are spooled to disk; MAX_CONTENT_LENGTH, when set, lowers the limit
+TRAINING_MAX_UPLOAD_BYTES = int(os.getenv('TRAINING_MAX_UPLOAD_BYTES', str(2 * 1024 ** 3)))
 
 @api_bp.route('/analyze', methods=['POST'])
 def analyze_traffic():
     """Analyze network traffic for threats"""
     try:
-        data = request.get_json()
+        with stage_timer('parse'):
+            data = request.get_json()
         
         if not data:
             return jsonify({'error': 'No data provided'}), 400
         
         # Validate required fields
-        required_fields = ['packet_size', 'port', 'protocol']
-        if not all(field in data for field in required_fields):
+        with stage_timer('validate'):
+            valid = all(field in data for field in REQUIRED_FIELDS)
+        if not valid:
             return jsonify({'error': 'Missing required fields'}), 400
         
-        # Analyze for threats
-        result = threat_detector.predict_threat(data)
+        # Analyze for threats, batched with concurrent requests when coalescing
+        if analyze_coalescer is not None:
+            result = analyze_coalescer.submit(data)
+        else:
+            detector = threat_detector
+            result = _score_records(_aggregate_flows([data], detector),
+                                    lambda records: [detector.predict_threat(records[0])])[0]
         
-        # Log the analysis
-        logging.info(f"Threat analysis: {result}")
+        analysis_logger.log_result(data, result)
         
-        return jsonify({
-            'success': True,
-            'analysis': result,
-            'input_data': data
-        }), 200
+        lean = request.args.get('mode', ANALYZE_RESPONSE_MODE).lower() == 'lean'
+        with stage_timer('serialization'):
+            if lean:
+                return encode_response(result, request)
+            return encode_response({
+                'success': True,
+                'analysis': result,
+                'input_data': data
+            }, request)
         
     except Exception as e:
         logging.error(f"Analysis error: {e}")
         return jsonify({'error': 'Analysis failed'}), 500
 
+@api_bp.route('/analyze/batch', methods=['POST'])
+def analyze_traffic_batch():
+    """Analyze a batch of network traffic records in a single scoring pass"""
+    try:
+        with stage_timer('parse'):
+            data = request.get_json()
+        records = data.get('records') if isinstance(data, dict) else data
+        
+        if not records or not isinstance(records, list):
+            return jsonify({'error': 'No records provided'}), 400
+        
+        if len(records) > MAX_BATCH_SIZE:
+            return jsonify({'error': f'Batch too large (max {MAX_BATCH_SIZE} records)'}), 413
+        
+        with stage_timer('validate'):
+            invalid = [index for index, record in enumerate(records)
+                       if not isinstance(record, dict)
+                       or not all(field in record for field in REQUIRED_FIELDS)]
+        if invalid:
+            return jsonify({'error': 'Missing required fields',
+                            'invalid_records': invalid[:100]}), 400
+        
+        results = _analyze_records(records, compact=True)
+        threat_count = sum(1 for result in results if result.get('is_threat'))
+        
+        analysis_logger.log_batch('batch', records, results)
+        
+        with stage_timer('serialization'):
+            return encode_response({
+                'success': True,
+                'results': results,
+                'count': len(results),
+                'threat_count': threat_count
+            }, request)
+        
+    except Exception as e:
+        logging.error(f"Batch analysis error: {e}")
+        return jsonify({'error': 'Analysis failed'}), 500
+
+@api_bp.route('/analyze/stream', methods=['POST'])
+def analyze_traffic_stream():
+    """Analyze newline-delimited JSON records, streaming NDJSON results back"""
+    chunk_size = min(request.args.get('chunk_size', STREAM_CHUNK_SIZE, type=int), MAX_BATCH_SIZE)
+    if chunk_size < 1:
+        return jsonify({'error': 'chunk_size must be positive'}), 400
+    threats_only = request.args.get('threats_only', 'false').lower() == 'true'
+    
+    # Pin the detector so a model swap mid-stream cannot mix versions
+    detector = threat_detector
+    return Response(
+        stream_with_context(_stream_analysis(detector, request.stream, chunk_size, threats_only)),
+        mimetype='application/x-ndjson'
+    )
+
+def _stream_analysis(detector, stream, chunk_size, threats_only):
+    """Score records from an NDJSON stream in fixed-size chunks"""
+    processed = threats = errors = 0
+    
+    for chunk in _iter_record_chunks(stream, chunk_size):
+        indexes, records = [], []
+        for index, record, error in chunk:
+            if error:
+                errors += 1
+                yield json.dumps({'index': index, 'error': error}) + '\n'
+            else:
+                indexes.append(index)
+                records.append(record)
+        
+        records = _aggregate_flows(_flow_batch(records, detector), detector)
+        try:
+            results = _score_records(records, detector.predict_batch)
+        except Exception as e:
+            logging.error(f"Stream analysis error: {e}")
+            results = [{'error': 'Prediction failed', 'is_threat': False} for _ in indexes]
+        
+        if is_flow_array(records):
+            # process_network_log's default for a missing address is 0.0.0.0
+            sources = unpack_ipv4(records['source_ip'], '0.0.0.0')
+            destinations = unpack_ipv4(records['destination_ip'], '0.0.0.0')
+            ports = records['port'].tolist()
+        else:
+            sources = [record['source_ip'] for record in records]
+            destinations = [record['destination_ip'] for record in records]
+            ports = [record['port'] for record in records]
+        
+        lines = []
+        for position, (index, result) in enumerate(zip(indexes, results)):
+            processed += 1
+            if result.get('is_threat'):
+                threats += 1
+            elif threats_only:
+                continue
+            lines.append(json.dumps({
+                'index': index,
+                'source_ip': sources[position],
+                'destination_ip': destinations[position],
+                'port': ports[position],
+                'analysis': result
+            }))
+        if lines:
+            yield '\n'.join(lines) + '\n'
+    
+    logging.info(f"Stream threat analysis: {processed} records, {threats} threats, {errors} errors")
+    summary = {'processed': processed, 'threats': threats, 'errors': errors}
+    yield json.dumps({'summary': summary}) + '\n'
+
+def _iter_lines(stream, max_length):
+    """Lines of an NDJSON stream, or None for a line over max_length bytes
+    
+    Lines are read with a bounded readline, so one line without a newline
+    cannot buffer the whole body in memory; the rest of a long line is
+    skipped in bounded pieces.
+    """
+    while True:
+        line = stream.readline(max_length + 1)
+        if not line:
+            return
+        if len(line) > max_length and not line.endswith(b'\n'):
+            while line and not line.endswith(b'\n'):
+                line = stream.readline(max_length + 1)
+            yield None
+        else:
+            yield line
+
+def _iter_record_chunks(stream, chunk_size):
+    """Yield lists of (index, normalized record, error) of at most chunk_size entries"""
+    chunk = []
+    index = 0
+    for line in _iter_lines(stream, STREAM_MAX_LINE_BYTES):
+        if line is None:
+            chunk.append((index, None, 'Line too long'))
+        else:
+            line = line.strip()
+            if not line:
+                continue
+            
+            try:
+                data = json.loads(line)
+                if (not isinstance(data, dict)
+                        or not all(field in data for field in REQUIRED_FIELDS)):
+                    raise ValueError('Missing required fields')
+                chunk.append((index, NetworkDataProcessor.process_network_log(data), None))
+            except (ValueError, TypeError, AttributeError) as e:
+                # AttributeError: a non-string protocol
+                chunk.append((index, None, str(e) or 'Invalid record'))
+        
+        index += 1
+        if len(chunk) >= chunk_size:
+            yield chunk
+            chunk = []
+    
+    if chunk:
+        yield chunk
+
+def _training_options(values):
+    """Subsampling and forest options from a JSON body or query string"""
+    options = {}
+    if values.get('subsample') is not None:
+        options['subsample'] = int(values['subsample'])
+        if options['subsample'] < 1:
+            raise ValueError('subsample must be positive')
+    method = values.get('subsample_method', 'reservoir')
+    if method not in SUBSAMPLE_METHODS:
+        raise ValueError(f"subsample_method must be one of {', '.join(SUBSAMPLE_METHODS)}")
+    options['subsample_method'] = method
+    if values.get('max_samples') is not None:
+        max_samples = str(values['max_samples'])
+        options['max_samples'] = max_samples if max_samples == 'auto' else (
+            float(max_samples) if '.' in max_samples else int(max_samples))
+    if values.get('n_jobs') is not None:
+        options['n_jobs'] = int(values['n_jobs'])
+    return options
+
+def _training_source():
+    """Training data and options from a JSON body, a binary upload or a server-side path"""
+    content_type = request.mimetype
+    if content_type in CONTENT_TYPES:
+        options = _training_options(request.args)
+        max_bytes = min(TRAINING_MAX_UPLOAD_BYTES,
+                        current_app.config.get('MAX_CONTENT_LENGTH') or TRAINING_MAX_UPLOAD_BYTES)
+        if request.content_length is not None and request.content_length > max_bytes:
+            raise UploadTooLarge(f"Training upload exceeds {max_bytes} bytes")
+        source = spool_upload(request.stream, CONTENT_TYPES[content_type],
+                              directory=os.getenv('TRAINING_UPLOAD_DIR'), max_bytes=max_bytes)
+    else:
+        data = request.get_json(silent=True)
+        if not data or not ('training_data' in data or 'path' in data):
+            raise ValueError('No training data provided')
+        options = _training_options(data)
+        if 'training_data' in data:
+            return data['training_data'], options
+        path = resolve_server_path(data['path'], os.getenv('TRAINING_DATA_DIR'))
+        source = TrainingFile(path, format_for_path(path))
+    
+    if source.format == 'npy':
+        # Header check only: shape and dtype are known without reading rows
+        try:
+            validate_matrix(open_matrix(source.path), threat_detector.feature_extractor.n_features,
+                            check_finite=False)
+        except Exception:
+            source.cleanup()
+            raise
+    return source, options
+
 @api_bp.route('/train', methods=['POST'])
 def train_model():
-    """Train the threat detection model"""
+    """Start a background training run for the threat detection model"""
     try:
-        data = request.get_json()
+        try:
+            training_data, options = _training_source()
+        except PermissionError as e:
+            return jsonify({'error': str(e)}), 403
+        except FileNotFoundError as e:
+            return jsonify({'error': str(e)}), 404
+        except UploadTooLarge as e:
+            return jsonify({'error': str(e)}), 413
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
         
-        if not data or 'training_data' not in data:
-            return jsonify({'error': 'No training data provided'}), 400
+        job = training_manager.submit(training_data, options)
         
-        success = threat_detector.train(data['training_data'])
+        if request.args.get('wait', 'false').lower() == 'true':
+            timeout = request.args.get('timeout', 300, type=float)
+            job = training_manager.wait(job.job_id, timeout=timeout)
+            if job.status == 'completed':
+                return jsonify({'success': True, 'message': 'Model trained successfully',
+                                'job': job.to_dict()}), 200
+            if job.status == 'failed':
+                return jsonify({'error': 'Training failed', 'job': job.to_dict()}), 500
         
-        if success:
-            return jsonify({'success': True, 'message': 'Model trained successfully'}), 200
-        else:
-            return jsonify({'error': 'Training failed'}), 500
+        return jsonify({
+            'success': True,
+            'job_id': job.job_id,
+            'status': job.status,
+            'status_url': f'/api/train/{job.job_id}'
+        }), 202
             
     except Exception as e:
         logging.error(f"Training error: {e}")
         return jsonify({'error': 'Training failed'}), 500
 
+@api_bp.route('/train/<job_id>', methods=['GET'])
+def get_training_job(job_id):
+    """Get status and progress of a training run"""
+    job = training_manager.get(job_id)
+    if job is None:
+        return jsonify({'error': 'Unknown training job'}), 404
+    return jsonify({'success': True, 'job': job.to_dict()}), 200
+
+def _registry_unavailable():
+    return jsonify({'error': 'Model registry is disabled'}), 404
+
+def _switch_response(version):
+    """Wake the watcher to load a version, optionally waiting until it serves"""
+    registry_watcher.refresh()
+    if request.args.get('wait', 'false').lower() == 'true':
+        timeout = request.args.get('timeout', 30, type=float)
+        if not registry_watcher.wait_for(version, timeout=timeout):
+            return jsonify({'error': f'Model version {version} is not serving yet',
+                            'detail': registry_watcher.last_error}), 503
+        return jsonify({'success': True, 'version': version, 'status': 'serving'}), 200
+    return jsonify({'success': True, 'version': version, 'status': 'loading'}), 202
+
+@api_bp.route('/models', methods=['GET'])
+def list_models():
+    """List registry versions with the current, previous and shadow pointers"""
+    if model_registry is None:
+        return _registry_unavailable()
+    description = model_registry.describe()
+    description['serving'] = threat_detector.registry_version
+    return jsonify({'success': True, **description}), 200
+
+@api_bp.route('/models/<version>/activate', methods=['POST'])
+def activate_model(version):
+    """Switch serving to a registry version; it loads in the background"""
+    if model_registry is None:
+        return _registry_unavailable()
+    try:
+        model_registry.activate(version)
+    except RegistryError as e:
+        return jsonify({'error': str(e)}), 404
+    return _switch_response(version)
+
+@api_bp.route('/models/rollback', methods=['POST'])
+def rollback_model():
+    """Switch serving back to the previously active version"""
+    if model_registry is None:
+        return _registry_unavailable()
+    try:
+        version = model_registry.rollback()
+    except RegistryError as e:
+        return jsonify({'error': str(e)}), 409
+    return _switch_response(version)
+
+@api_bp.route('/models/shadow', methods=['GET', 'PUT', 'DELETE'])
+def shadow_model():
+    """Show, start or stop shadow scoring of a candidate version"""
+    if model_registry is None:
+        return _registry_unavailable()
+    
+    if request.method == 'PUT':
+        data = request.get_json(silent=True) or {}
+        if 'version' not in data:
+            return jsonify({'error': 'No version provided'}), 400
+        try:
+            model_registry.set_shadow(data['version'], float(data.get('sample_rate', 0.1)))
+        except (RegistryError, TypeError, ValueError) as e:
+            return jsonify({'error': str(e)}), 400
+        registry_watcher.refresh()
+    elif request.method == 'DELETE':
+        model_registry.set_shadow(None)
+        registry_watcher.refresh()
+    
+    return jsonify({
+        'success': True,
+        'shadow': model_registry.state()['shadow'],
+        'stats': shadow_scorer.stats() if shadow_scorer is not None else None
+    }), 200
+
+@api_bp.route('/alerts/incidents', methods=['GET'])
+def list_incidents():
+    """Open incidents of collapsed alerts, largest first"""
+    if alert_suppressor is None:
+        return jsonify({'error': 'Alert suppression is disabled'}), 404
+    limit = min(request.args.get('limit', 100, type=int), 10000)
+    return jsonify({
+        'success': True,
+        'incidents': alert_suppressor.incidents(limit),
+        'stats': alert_suppressor.stats()
+    }), 200
+
+def _admin_denied():
+    """An error response unless the request carries ADMIN_TOKEN; None when allowed"""
+    token = os.getenv('ADMIN_TOKEN')
+    if not token:
+        return jsonify({'error': 'Admin endpoints are disabled (set ADMIN_TOKEN)'}), 404
+    supplied = request.headers.get('X-Admin-Token', '')
+    if not hmac.compare_digest(supplied.encode(), token.encode()):
+        return jsonify({'error': 'Admin token required'}), 403
+    return None
+
+def _profile_response(session):
+    summary = session.summary() if session is not None else None
+    return jsonify({'success': True, 'session': summary}), 200
+
+@api_bp.route('/admin/profile', methods=['GET', 'POST', 'DELETE'])
+def profile_requests():
+    """Show, start or stop (and write out) a request profiling session.
+
+    Sessions are per worker process, so profile with GUNICORN_WORKERS=1.
+    """
+    denied = _admin_denied()
+    if denied is not None:
+        return denied
+    
+    if request.method == 'POST':
+        data = request.get_json(silent=True) or {}
+        mode = data.get('mode', 'sampling')
+        if mode not in PROFILE_MODES:
+            return jsonify({'error': f"mode must be one of {', '.join(PROFILE_MODES)}"}), 400
+        try:
+            duration = data.get('duration', 30 if data.get('requests') is None else None)
+            session = profiler.start(
+                mode=mode,
+                duration=None if duration is None else float(duration),
+                max_requests=None if data.get('requests') is None else int(data['requests']),
+                sample_rate=float(data.get('sample_rate', 1.0)),
+                interval=float(data.get('interval_ms', 5)) / 1000.0
+            )
+        except RuntimeError as e:
+            return jsonify({'error': str(e)}), 409
+        except (TypeError, ValueError) as e:
+            return jsonify({'error': str(e)}), 400
+        return jsonify({'success': True, 'session': session.summary()}), 202
+    
+    if request.method == 'DELETE':
+        session = profiler.stop()
+        if session is None:
+            return jsonify({'error': 'No profiling session is running'}), 409
+        return _profile_response(session)
+    
+    return _profile_response(profiler.session or profiler.last_session)
+
 @api_bp.route('/status', methods=['GET'])
 def get_status():
     """Get system status"""
     return jsonify({
         'status': 'operational',
         'model_trained': threat_detector.is_trained,
+        'incremental_learning': incremental_learner.stats() if incremental_learner else None,
+        'flow_aggregation': flow_aggregator.stats() if flow_aggregator else None,
+        'prediction_cache': (threat_detector.cache.stats()
+                             if threat_detector.cache is not None else None),
+        'model_version': threat_detector.registry_version,
+        'shadow': shadow_scorer.stats() if shadow_scorer is not None else None,
+        'alert_suppression': alert_suppressor.stats() if alert_suppressor is not None else None,
         'version': '1.0.0'
     }), 200
 
 @api_bp.route('/threats/history', methods=['GET'])
 def get_threat_history():
-    """Get threat detection history (mock data for demo)"""
-    mock_history = [
-        {
-            'timestamp': '2024-01-01T10:00:00Z',
-            'threat_level': 'high',
-            'source_ip': '192.168.1.100',
-            'destination_port': 1433,
-            'action_taken': 'blocked'
-        },
-        {
-            'timestamp': '2024-01-01T10:15:00Z',
-            'threat_level': 'medium',
-            'source_ip': '10.0.0.50',
-            'destination_port': 3389,
-            'action_taken': 'monitored'
+    """Get threat detection history with time-range filters and cursor pagination"""
+    store = get_history_store()
+    if store is None:
+        return jsonify({'error': 'Threat history is disabled'}), 404
+    
+    try:
+        filters = {
+            'start': to_epoch(request.args.get('start')),
+            'end': to_epoch(request.args.get('end')),
+            'threat_level': request.args.get('threat_level'),
+            'source_ip': request.args.get('source_ip'),
+            'destination_port': request.args.get('destination_port', type=int)
         }
-    ]
+        limit = min(max(request.args.get('limit', 100, type=int), 1), 1000)
+        cursor = request.args.get('cursor', type=int)
+    except ValueError:
+        return jsonify({'error': 'Invalid filter value'}), 400
+    # Counting scans every matching row, so only the first page counts by default
+    default_counts = 'true' if cursor is None else 'false'
+    with_counts = request.args.get('counts', default_counts).lower() == 'true'
     
-    return jsonify({
+    threats, next_cursor = store.query(cursor=cursor, limit=limit, **filters)
+    response = {
         'success': True,
-        'threats': mock_history,
-        'total_count': len(mock_history)
-    }), 200
+        'threats': threats,
+        'next_cursor': next_cursor
+    }
+    if with_counts:
+        counts = store.counts(**filters)
+        response.update(counts=counts, total_count=sum(counts.values()))
+    
+    return jsonify(response), 200
@@ -1,9 +1,11 @@
-from flask import Flask, request, jsonify
+from flask import Flask, Response, request, jsonify
 from flask_cors import CORS
 import logging
 import os
 from app.api.routes import api_bp
 from app.models.threat_detector import ThreatDetector
+from app.utils import metrics as service_metrics
+from app.utils.profiling import profiler
 
 def create_app():
     app = Flask(__name__)
@@ -16,6 +18,10 @@ def create_app():
     # Setup logging
     logging.basicConfig(level=logging.INFO)
     
+    # Request instrumentation
+    service_metrics.init_app(app)
+    profiler.init_app(app)
+    
     # Register blueprints
     app.register_blueprint(api_bp, url_prefix='/api')
     
@@ -27,13 +33,8 @@ def create_app():
     # Metrics endpoint for monitoring
     @app.route('/metrics')
     def metrics():
-        # Simple metrics - in production, use proper metrics library
-        return jsonify({
-            'requests_total': 1000,
-            'threats_detected': 42,
-            'false_positives': 3,
-            'uptime_seconds': 86400
-        }), 200
+        payload, content_type = service_metrics.generate_metrics()
+        return Response(payload, status=200, content_type=content_type)
     
     return app
 
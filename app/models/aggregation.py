@@ -0,0 +1,352 @@
+"""Sliding-window per-source traffic aggregates in constant memory.
+
+Clients report each flow on its own, so a scan or flood spread across many
+small requests is invisible to per-record features. ``FlowAggregator`` keeps
+windowed statistics per source IP and per (source IP, port) in fixed-size
+sketches:
+
+* connection counts, byte volume and total duration live in count-min
+  sketches (depth x width counters; estimates never undercount),
+* distinct destination ports per source live in small linear-counting
+  bitmaps indexed like a count-min row, so collisions only inflate them.
+
+The window is split into time buckets arranged as a ring. Running totals are
+kept for the additive sketches, so a query reads ``depth`` counters per flow.
+When a bucket expires, its counters are subtracted and cleared. Memory
+depends only on the sketch dimensions, so spoofed-source floods cannot grow
+it. Updates and queries are vectorized over a batch, and each flow of a
+batch sees the window as of itself: the flows before the batch plus the ones
+up to and including it, never flows that come later in the same batch.
+
+Flows are placed in buckets by their own ``timestamp`` (epoch seconds or
+ISO-8601, naive values read as UTC), so replaying or backfilling traffic
+spreads it over the windows it happened in. Flows without one use the
+current time. Timestamps ahead of the clock are clamped to it, and flows
+older than the newest bucket are counted in that bucket.
+
+State is per process. Under gunicorn every worker aggregates only the flows
+it serves, so a scan spread evenly over N workers shows about 1/N of its
+connection rate and distinct ports in each of them. Set thresholds on these
+aggregates with the worker count in mind, or route each source to one worker
+(for example by hashing the client address at the load balancer).
+"""
+import threading
+import time
+from datetime import datetime, timezone
+
+import numpy as np
+import pandas as pd
+
+from app.models.features import AGGREGATE_COLUMNS, FEATURE_SOURCES
+from app.utils.flow_records import epoch_seconds, is_flow_array, pack_ipv4
+from app.utils.ip_intel import parse_address
+
+_DEFAULTS = dict(FEATURE_SOURCES)
+# Odd multipliers for multiply-shift hashing, one per sketch row
+_MULTIPLIERS = np.array([0x9E3779B97F4A7C15, 0xC2B2AE3D27D4EB4F, 0x165667B19E3779F9,
+                         0xD6E8FEB86659FD93, 0xFF51AFD7ED558CCD, 0xC4CEB9FE1A85EC53,
+                         0x94D049BB133111EB, 0xBF58476D1CE4E5B9], dtype=np.uint64)
+# Batches up to this size skip DataFrame construction
+SMALL_BATCH = 32
+
+
+class FlowAggregator:
+    """Per-source sliding-window statistics over count-min and bitmap sketches"""
+
+    def __init__(self, window=60.0, buckets=6, width=2 ** 15, depth=4, bitmap_width=2 ** 12,
+                 bitmap_bits=256):
+        if width & (width - 1) or bitmap_width & (bitmap_width - 1):
+            raise ValueError('Sketch widths must be powers of two')
+        if depth > len(_MULTIPLIERS):
+            raise ValueError(f"depth must be at most {len(_MULTIPLIERS)}")
+        if bitmap_bits % 64:
+            raise ValueError('bitmap_bits must be a multiple of 64')
+        self.window = float(window)
+        self.buckets = buckets
+        self.bucket_seconds = self.window / buckets
+        self.depth = depth
+        self.bitmap_bits = bitmap_bits
+        self._shift = np.uint64(64 - width.bit_length() + 1)
+        self._bitmap_shift = np.uint64(64 - bitmap_width.bit_length() + 1)
+        self._multipliers = _MULTIPLIERS[:depth]
+        self._rows = np.arange(depth)[:, None]
+        self._bitmap_words = bitmap_bits // 64
+        self._metric_offsets = [(metric * depth + self._rows) * width for metric in range(4)]
+        self._bitmap_row_offsets = self._rows * bitmap_width * self._bitmap_words
+
+        # Per-bucket counters: (bucket, metric, row, column) with metrics
+        # connections, bytes and duration per source, then connections per
+        # (source, port); float32 keeps counts exact to 16M per bucket
+        self._counters = np.zeros((buckets, 4, depth, width), dtype=np.float32)
+        self._totals = np.zeros((4, depth, width), dtype=np.float64)
+        self._port_bitmaps = np.zeros((buckets, depth, bitmap_width, bitmap_bits // 64),
+                                      dtype=np.uint64)
+        self._epoch = None
+        self._lock = threading.Lock()
+        self.flows = 0
+
+    @property
+    def nbytes(self):
+        return self._counters.nbytes + self._totals.nbytes + self._port_bitmaps.nbytes
+
+    def observe(self, records, now=None):
+        """Add a batch of flows and return the window aggregates for each, as arrays
+
+        ``now`` is the clock: the time of flows without a timestamp and the
+        latest time a flow may claim (defaults to ``time.time()``).
+        """
+        clock = time.time() if now is None else now
+        sources, ports, sizes, durations, timestamps = self._columns(records, clock)
+        keys, present = _source_keys(sources)
+        aggregates = {name: np.zeros(len(keys)) for name in AGGREGATE_COLUMNS}
+        # Flows without a source address are neither counted nor scored
+        if not present.any():
+            return aggregates
+        if not present.all():
+            keys, ports, sizes, durations, timestamps = (
+                keys[present], ports[present], sizes[present], durations[present],
+                timestamps[present])
+
+        # Late flows join the newest bucket, so the batch only moves the window
+        # forward: one run of flows per bucket it reaches
+        times = np.maximum.accumulate(np.minimum(timestamps, clock))
+        epochs = times // self.bucket_seconds
+        starts = np.flatnonzero(np.diff(epochs, prepend=np.nan) != 0)
+        values = {name: [] for name in AGGREGATE_COLUMNS}
+        for start, end in zip(starts, np.append(starts[1:], len(keys))):
+            run = slice(start, end)
+            for name, column in self._observe_run(keys[run], ports[run], sizes[run],
+                                                  durations[run], times[start]):
+                values[name].append(column)
+        for name, columns in values.items():
+            aggregates[name][present] = np.concatenate(columns)
+        return aggregates
+
+    def _observe_run(self, keys, ports, sizes, durations, now):
+        """Add flows that share one bucket; (name, values) per aggregate"""
+        n_rows = len(keys)
+        source_hash = pd.util.hash_array(keys)
+        # Linear counting needs random-looking bits, so ports get a full mixing hash
+        port_hash = pd.util.hash_array(ports.astype(np.uint64))
+        pair_hash = pd.util.hash_array(source_hash ^ port_hash)
+        columns = self._index(source_hash, self._shift)
+        pair_columns = self._index(pair_hash, self._shift)
+        bitmap_columns = self._index(source_hash, self._bitmap_shift)
+        # Top bits of the port hash pick one bit of the bitmap
+        bit = (port_hash >> np.uint64(64 - (self.bitmap_bits - 1).bit_length())).astype(np.int64)
+        bitmap_cells = (bitmap_columns * self._bitmap_words + (bit >> 6)) + self._bitmap_row_offsets
+        masks = np.left_shift(np.uint64(1), (bit & 63).astype(np.uint64))
+
+        # One flat index over (metric, row, column) so each run is a single
+        # scatter-add into the bucket and one into the running totals
+        cells = np.concatenate([columns + offsets for offsets in self._metric_offsets[:3]] +
+                               [pair_columns + self._metric_offsets[3]]).ravel()
+        values = np.concatenate([np.broadcast_to(weights, (self.depth, n_rows)) for weights in
+                                 (np.ones(n_rows), sizes, durations, np.ones(n_rows))]).ravel()
+
+        with self._lock:
+            slot = self._advance(now)
+            # Each flow sees the window before the run plus the run up to itself
+            seen = self._totals.reshape(-1)[cells] + _running_sums(cells, values)
+            bitmaps = np.bitwise_or.reduce(self._port_bitmaps[:, self._rows, bitmap_columns],
+                                           axis=0)
+            np.add.at(self._counters[slot].reshape(-1), cells, values)
+            np.add.at(self._totals.reshape(-1), cells, values)
+            np.bitwise_or.at(self._port_bitmaps[slot].reshape(-1), bitmap_cells.ravel(),
+                             np.tile(masks, self.depth))
+            self.flows += n_rows
+
+        seen = seen.reshape(4, self.depth, n_rows).min(axis=1)
+        connections, volume, duration, pair_connections = seen
+        return (('source_connection_rate', connections / self.window),
+                ('source_distinct_ports', self._distinct(bitmaps, bitmap_cells, bit, masks)),
+                ('source_byte_rate', volume / self.window),
+                ('source_mean_duration', duration / np.maximum(connections, 1)),
+                ('source_port_connection_rate', pair_connections / self.window))
+
+    def enrich(self, records, now=None):
+        """Copies of the records (dicts or a flow array) with the window aggregates added
+
+        The caller's records are left untouched, so request bodies echoed
+        back to clients never gain ``source_*`` fields.
+        """
+        aggregates = self.observe(records, now)
+        if is_flow_array(records):
+            enriched = records.copy()
+            for name, values in aggregates.items():
+                if name in enriched.dtype.names:
+                    enriched[name] = values
+            return enriched
+        enriched = [dict(record) for record in records]
+        for name, values in aggregates.items():
+            for record, value in zip(enriched, values.tolist()):
+                record[name] = value
+        return enriched
+
+    def stats(self):
+        return {
+            'flows': self.flows,
+            'window_seconds': self.window,
+            'memory_bytes': self.nbytes
+        }
+
+    def _index(self, hashes, shift):
+        return ((hashes[None, :] * self._multipliers[:, None]) >> shift).astype(np.int64)
+
+    def _advance(self, now):
+        """Expire buckets that fell out of the window; returns the current slot"""
+        epoch = int(now // self.bucket_seconds)
+        if self._epoch is None:
+            self._epoch = epoch
+        steps = epoch - self._epoch
+        if steps >= self.buckets:
+            self._counters[:] = 0
+            self._totals[:] = 0
+            self._port_bitmaps[:] = 0
+        elif steps > 0:
+            for expired in range(self._epoch + 1, epoch + 1):
+                slot = expired % self.buckets
+                self._totals -= self._counters[slot]
+                self._counters[slot] = 0
+                self._port_bitmaps[slot] = 0
+        # Late flows (steps < 0) are counted in the current bucket
+        self._epoch = max(self._epoch, epoch)
+        return self._epoch % self.buckets
+
+    def _distinct(self, bitmaps, bitmap_cells, bit, masks):
+        """Linear-counting estimate per flow from the window's (depth, n, words) bitmaps
+        plus the port bits of the batch up to that flow; min over rows.
+
+        Estimates saturate near bits * ln(bits), about 1400 ports at 256 bits.
+        """
+        set_bits = np.unpackbits(bitmaps.view(np.uint8), axis=-1).sum(axis=-1, dtype=np.int64)
+        words = np.take_along_axis(bitmaps, (bit >> 6)[None, :, None], axis=-1)[..., 0]
+        # A port bit adds to a bitmap at its first flow in the batch, unless the
+        # window already has it
+        _, first = np.unique((bitmap_cells * 64 + (bit & 63)).ravel(), return_index=True)
+        new_bits = np.zeros(bitmap_cells.size)
+        new_bits[first] = 1
+        new_bits *= ((words & masks) == 0).ravel()
+        bitmaps_of_flows = (bitmap_cells - (bit >> 6)).ravel()
+        set_bits = set_bits + _running_sums(bitmaps_of_flows, new_bits).reshape(set_bits.shape)
+
+        zeros = np.maximum(self.bitmap_bits - set_bits, 1)
+        estimates = self.bitmap_bits * np.log(self.bitmap_bits / zeros)
+        return estimates.min(axis=0)
+
+    @staticmethod
+    def _columns(records, clock):
+        if is_flow_array(records):
+            return (records['source_ip'], records['port'].astype(np.int64),
+                    records['packet_size'].astype(np.float64),
+                    records['duration'].astype(np.float64),
+                    records['timestamp'].astype(np.float64))
+        if isinstance(records, pd.DataFrame):
+            frame = records
+        elif len(records) <= SMALL_BATCH:
+            return _record_columns(records, clock)
+        else:
+            frame = pd.DataFrame.from_records(records)
+        n_rows = len(frame)
+
+        def numeric(field):
+            if field not in frame:
+                return np.full(n_rows, float(_DEFAULTS[field]))
+            values = pd.to_numeric(frame[field], errors='coerce')
+            return values.fillna(_DEFAULTS[field]).to_numpy(dtype=np.float64)
+
+        if 'source_ip' in frame:
+            sources = frame['source_ip'].to_numpy(dtype=object)
+        else:
+            sources = np.full(n_rows, None)
+        if 'timestamp' in frame:
+            timestamps = epoch_seconds(frame['timestamp'].to_numpy(dtype=object), clock)
+        else:
+            timestamps = np.full(n_rows, float(clock))
+        ports = np.clip(numeric('port'), 0, 65535).astype(np.int64)
+        return sources, ports, numeric('packet_size'), numeric('duration'), timestamps
+
+
+def _source_keys(sources):
+    """(uint64 sketch key, present) per source address.
+
+    IPv4 addresses are keyed by their packed value, whether they arrive packed
+    in a flow array or as strings, so both share sketch cells. IPv6 addresses
+    are keyed by a hash of the string with the top bit set, which keeps them
+    apart from every IPv4 value. 0.0.0.0, the default ``process_network_log``
+    fills in, and unparseable addresses count as missing on both paths.
+    """
+    if sources.dtype.kind in 'ui':
+        keys = sources.astype(np.uint64)
+        return keys, keys != 0
+    keys = pack_ipv4(sources).astype(np.uint64)
+    present = keys != 0
+    unpacked = np.flatnonzero(~present & pd.notna(sources))
+    if len(unpacked):
+        codes, uniques = pd.factorize(sources[unpacked])
+        ipv6 = np.array([_is_ipv6(address) for address in uniques], dtype=bool)[codes]
+        if ipv6.any():
+            rows = unpacked[ipv6]
+            strings = sources[rows].astype(str).astype(object)
+            keys[rows] = pd.util.hash_array(strings) | np.uint64(1 << 63)
+            present[rows] = True
+    return keys, present
+
+
+def _is_ipv6(address):
+    parsed = parse_address(address)
+    return parsed is not None and parsed[0] == 6 and parsed[1] != 0
+
+
+def _running_sums(keys, values):
+    """Running total of ``values`` per key, in input order and including each entry"""
+    order = np.argsort(keys, kind='stable')
+    sorted_keys, sorted_values = keys[order], values[order]
+    totals = np.cumsum(sorted_values)
+    first = np.empty(len(keys), dtype=bool)
+    first[0] = True
+    np.not_equal(sorted_keys[1:], sorted_keys[:-1], out=first[1:])
+    starts = np.flatnonzero(first)
+    # Subtract what earlier keys added before each key's first entry
+    lengths = np.diff(starts, append=len(keys))
+    totals -= np.repeat(totals[starts] - sorted_values[starts], lengths)
+    sums = np.empty_like(totals)
+    sums[order] = totals
+    return sums
+
+
+def _record_columns(records, clock):
+    """Column extraction for a handful of dicts, where building a DataFrame dominates"""
+    def numeric(field):
+        default = _DEFAULTS[field]
+        try:
+            values = np.array([record.get(field, default) for record in records], dtype=np.float64)
+        except (TypeError, ValueError):
+            values = pd.to_numeric(pd.Series([record.get(field) for record in records]),
+                                   errors='coerce').to_numpy(dtype=np.float64)
+        return np.where(np.isnan(values), default, values)
+
+    sources = np.empty(len(records), dtype=object)
+    sources[:] = [record.get('source_ip') for record in records]
+    timestamps = np.array([_epoch_seconds(record.get('timestamp'), clock) for record in records],
+                          dtype=np.float64)
+    ports = np.clip(numeric('port'), 0, 65535).astype(np.int64)
+    return sources, ports, numeric('packet_size'), numeric('duration'), timestamps
+
+
+def _epoch_seconds(value, default):
+    """Scalar ``epoch_seconds`` for the small-batch path, without pandas"""
+    if isinstance(value, str):
+        try:
+            value = float(value)
+        except ValueError:
+            try:
+                parsed = datetime.fromisoformat(value.strip().replace('Z', '+00:00'))
+            except ValueError:
+                return default
+            if parsed.tzinfo is None:
+                parsed = parsed.replace(tzinfo=timezone.utc)
+            return parsed.timestamp()
+    if isinstance(value, (int, float)) and not isinstance(value, bool) and value == value:
+        return float(value)
+    return default
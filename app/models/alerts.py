@@ -0,0 +1,226 @@
+"""Per-source alert deduplication and rate limiting.
+
+During an attack one source produces a flagged flow per request, and a full
+result, log line, history row and recommendation for each of them floods
+everything downstream. ``AlertSuppressor`` sits after scoring and folds
+threats into incidents keyed by (source IP, threat level):
+
+* each incident has a token bucket (``burst`` alerts, refilled at ``rate``
+  per second). While it holds tokens a threat is returned in full with an
+  ``incident`` summary attached. Once it runs dry the threat collapses to a
+  compact ``suppressed`` result carrying the incident id and count,
+* an incident closes when its source has been quiet for ``window`` seconds
+  or when it is ``window`` seconds old, and its aggregated record goes to
+  ``on_close``. A source that keeps attacking therefore reports one incident
+  per window rather than one alert per flow,
+* incidents live in an insertion-ordered map, moved to the end on every hit,
+  so idle incidents are expired from the front. At ``max_incidents`` the
+  least recently seen incident is closed early, so spoofed-source floods
+  cannot grow memory,
+* with ``short_circuit_after`` set, a source that already has that many
+  alerts at one of ``short_circuit_levels`` (``high`` by default) in its open
+  incident is not scored again until the incident closes. ``lookup``
+  answers those flows from the incident's last scored verdict.
+"""
+import itertools
+import threading
+import time
+from collections import OrderedDict
+
+from app.utils.flow_records import as_records
+from app.utils.metrics import ALERT_EVENTS
+
+
+class Incident:
+    """Aggregated alerts of one (source IP, threat level) pair within a window"""
+
+    __slots__ = ('incident_id', 'source_ip', 'threat_level', 'first_seen', 'last_seen', 'count',
+                 'suppressed', 'short_circuited', 'tokens', 'refilled', 'verdict')
+
+    def __init__(self, incident_id, source_ip, threat_level, now, burst):
+        self.incident_id = incident_id
+        self.source_ip = source_ip
+        self.threat_level = threat_level
+        self.first_seen = now
+        self.last_seen = now
+        self.count = 0
+        self.suppressed = 0
+        self.short_circuited = 0
+        self.tokens = float(burst)
+        self.refilled = now
+        self.verdict = None
+
+    def take_token(self, now, rate, burst):
+        self.tokens = min(float(burst), self.tokens + (now - self.refilled) * rate)
+        self.refilled = now
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return True
+        return False
+
+    def summary(self):
+        return {'id': self.incident_id, 'count': self.count, 'suppressed': self.suppressed,
+                'first_seen': self.first_seen, 'last_seen': self.last_seen}
+
+    def to_dict(self):
+        return {
+            'incident_id': self.incident_id,
+            'source_ip': self.source_ip,
+            'threat_level': self.threat_level,
+            'first_seen': self.first_seen,
+            'last_seen': self.last_seen,
+            'count': self.count,
+            'suppressed': self.suppressed,
+            'short_circuited': self.short_circuited
+        }
+
+
+class AlertSuppressor:
+    """Collapse repeated threats per (source IP, threat level) into rate-limited incidents"""
+
+    def __init__(self, rate=1.0, burst=5, window=60.0, max_incidents=100000,
+                 short_circuit_after=None, short_circuit_levels=('high',), on_close=None):
+        if rate < 0 or burst < 1:
+            raise ValueError('rate must be non-negative and burst at least 1')
+        self.rate = rate
+        self.burst = burst
+        self.window = float(window)
+        self.max_incidents = max_incidents
+        self.short_circuit_after = short_circuit_after
+        self.short_circuit_levels = tuple(short_circuit_levels)
+        self.on_close = on_close
+        self._incidents = OrderedDict()
+        self._ids = itertools.count(1)
+        self._lock = threading.Lock()
+        self.emitted = 0
+        self.suppressed = 0
+        self.short_circuited = 0
+        self.evicted = 0
+
+    def lookup(self, records, now=None):
+        """Verdicts for flows from confirmed threat sources, None for flows to score"""
+        results = [None] * len(records)
+        if not self.short_circuit_after:
+            return results
+        now = time.time() if now is None else now
+        hits = 0
+        with self._lock:
+            if not self._incidents:
+                return results
+            closed = self._expire(now)
+            for index, record in enumerate(as_records(records)):
+                incident = self._confirmed(record.get('source_ip'), now)
+                if incident is None:
+                    continue
+                incident.short_circuited += 1
+                results[index] = dict(incident.verdict, short_circuit=True)
+                hits += 1
+            self.short_circuited += hits
+        self._close(closed)
+        if hits:
+            ALERT_EVENTS.labels(outcome='short_circuit').inc(hits)
+        return results
+
+    def process(self, records, results, now=None):
+        """Results with threats rate limited per incident; benign results pass unchanged"""
+        now = time.time() if now is None else now
+        output = list(results)
+        emitted = suppressed = 0
+        with self._lock:
+            closed = self._expire(now)
+            for index, (record, result) in enumerate(zip(as_records(records), results)):
+                source_ip = record.get('source_ip')
+                if not result.get('is_threat') or source_ip is None:
+                    continue
+                level = result.get('threat_level')
+                incident = self._incident(source_ip, level, now, closed)
+                incident.count += 1
+                incident.last_seen = now
+                if not result.get('short_circuit'):
+                    incident.verdict = result
+                if incident.take_token(now, self.rate, self.burst):
+                    output[index] = dict(result, incident=incident.summary())
+                    emitted += 1
+                else:
+                    incident.suppressed += 1
+                    output[index] = {'is_threat': True, 'threat_level': level, 'suppressed': True,
+                                     'incident_id': incident.incident_id, 'count': incident.count}
+                    suppressed += 1
+            self.emitted += emitted
+            self.suppressed += suppressed
+        self._close(closed)
+        if emitted:
+            ALERT_EVENTS.labels(outcome='emitted').inc(emitted)
+        if suppressed:
+            ALERT_EVENTS.labels(outcome='suppressed').inc(suppressed)
+        return output
+
+    def incidents(self, limit=100):
+        """Open incidents, largest first"""
+        with self._lock:
+            incidents = [incident.to_dict() for incident in self._incidents.values()]
+        return sorted(incidents, key=lambda incident: incident['count'], reverse=True)[:limit]
+
+    def flush(self):
+        """Close every open incident, handing each to ``on_close``"""
+        with self._lock:
+            closed = list(self._incidents.values())
+            self._incidents.clear()
+        self._close(closed)
+
+    def stats(self):
+        with self._lock:
+            return {
+                'open_incidents': len(self._incidents),
+                'emitted': self.emitted,
+                'suppressed': self.suppressed,
+                'short_circuited': self.short_circuited,
+                'evicted': self.evicted,
+                'rate': self.rate,
+                'burst': self.burst,
+                'window_seconds': self.window
+            }
+
+    def _confirmed(self, source_ip, now):
+        """The open incident that confirms a source as a threat, if any"""
+        for level in self.short_circuit_levels:
+            incident = self._incidents.get((source_ip, level))
+            if (incident is not None and incident.verdict is not None
+                    and incident.count >= self.short_circuit_after
+                    and now - incident.first_seen < self.window):
+                return incident
+        return None
+
+    def _incident(self, source_ip, level, now, closed):
+        """The open incident for a key, starting a new one when the last is a window old"""
+        key = (source_ip, level)
+        incident = self._incidents.get(key)
+        if incident is not None and now - incident.first_seen >= self.window:
+            closed.append(self._incidents.pop(key))
+            incident = None
+        if incident is None:
+            if len(self._incidents) >= self.max_incidents:
+                closed.append(self._incidents.popitem(last=False)[1])
+                self.evicted += 1
+            incident = Incident(next(self._ids), source_ip, level, now, self.burst)
+            self._incidents[key] = incident
+        else:
+            self._incidents.move_to_end(key)
+        return incident
+
+    def _expire(self, now):
+        """Pop incidents idle for a whole window; the least recently seen are at the front"""
+        closed = []
+        while self._incidents:
+            incident = next(iter(self._incidents.values()))
+            if now - incident.last_seen < self.window:
+                break
+            closed.append(self._incidents.popitem(last=False)[1])
+        return closed
+
+    def _close(self, incidents):
+        # Called outside the lock so a slow callback never stalls scoring
+        if self.on_close is None:
+            return
+        for incident in incidents:
+            self.on_close(incident.to_dict())
@@ -0,0 +1,243 @@
+"""Flat-array model artifacts that can be memory-mapped read-only.
+
+An artifact is a directory holding one ``.npy`` file per array plus a
+``header.json`` with the format version, model metadata and a SHA-256 digest
+for every array file. All trees of the forest are concatenated into shared
+node arrays, so loading is a handful of ``np.load(mmap_mode='r')`` calls and
+every worker process maps the same page-cache pages.
+
+The scaler-folded traversal layout that ``CompiledForest`` scores with is
+stored as well (``layout_*`` arrays). Loading maps it like the node arrays,
+so scoring a loaded forest reads the shared pages instead of building a
+private copy of the layout in every worker. Artifacts without it still load
+and compile the layout on first use.
+"""
+import hashlib
+import json
+import os
+import shutil
+import time
+
+import numpy as np
+
+from app.models.compiled_forest import CompiledForest, compile_layout, pack_forest
+
+ARTIFACT_FORMAT = 'threat-detector-forest'
+ARTIFACT_VERSION = 1
+HEADER_FILE = 'header.json'
+
+ARRAY_DTYPES = {
+    'node_feature': np.int32,
+    'node_threshold': np.float64,
+    'node_left': np.int32,
+    'node_right': np.int32,
+    'node_value': np.float64,
+    'tree_roots': np.int32,
+    'scaler_mean': np.float64,
+    'scaler_scale': np.float64
+}
+
+# Optional: the traversal layout compiled with the stored scaler folded in
+LAYOUT_DTYPES = {
+    'layout_children': np.int32,
+    'layout_split_feature': np.int32,
+    'layout_threshold': np.float64
+}
+
+
+class ArtifactError(Exception):
+    """Raised when an artifact is missing, corrupt or of an unknown version"""
+
+
+class PackedForest:
+    """IsolationForest scorer backed by flat (optionally memory-mapped) node arrays"""
+
+    def __init__(self, arrays, max_samples, offset, n_features, contamination=None, layout=None):
+        self.node_feature = arrays['node_feature']
+        self.node_threshold = arrays['node_threshold']
+        self.node_left = arrays['node_left']
+        self.node_right = arrays['node_right']
+        self.node_value = arrays['node_value']
+        self.tree_roots = arrays['tree_roots']
+        self.max_samples_ = max_samples
+        self.offset_ = offset
+        self.n_features_in_ = n_features
+        # The forest's contamination setting; None for artifacts that predate it
+        self.contamination = contamination
+        # compile_layout output plus the scaler it was folded with, if stored
+        self.layout = layout
+        self._engine = None
+
+    @classmethod
+    def from_model(cls, model):
+        return cls(pack_forest(model), int(model.max_samples_), float(model.offset_),
+                   int(model.n_features_in_), contamination=model.contamination)
+
+    @property
+    def n_trees(self):
+        return len(self.tree_roots)
+
+    def layout_for(self, scaler):
+        """The stored traversal layout if it was folded with this scaler, else None"""
+        if self.layout is None:
+            return None
+        if not (np.array_equal(self.layout['scaler_mean'], scaler.mean_)
+                and np.array_equal(self.layout['scaler_scale'], scaler.scale_)):
+            return None
+        return self.layout
+
+    def _get_engine(self):
+        # Scores scaled inputs; only built when the forest is used without a
+        # scaler-folded engine, e.g. by a detector with compiled scoring off
+        if self._engine is None:
+            arrays = {name: getattr(self, name) for name in
+                      ('node_feature', 'node_threshold', 'node_left', 'node_right',
+                       'node_value', 'tree_roots')}
+            self._engine = CompiledForest(arrays, self.max_samples_, self.offset_,
+                                          self.n_features_in_)
+        return self._engine
+
+    def score_samples(self, X):
+        return self._get_engine().score_samples(X)
+
+    def decision_function(self, X):
+        return self._get_engine().decision_function(X)
+
+    def predict(self, X):
+        return np.where(self.decision_function(X) < 0, -1, 1)
+
+
+def save_artifact(path, scaler, model, metadata=None):
+    """Write a fitted scaler/model pair as a flat-array artifact directory"""
+    packed = model if isinstance(model, PackedForest) else PackedForest.from_model(model)
+    arrays = {
+        'node_feature': packed.node_feature,
+        'node_threshold': packed.node_threshold,
+        'node_left': packed.node_left,
+        'node_right': packed.node_right,
+        'node_value': packed.node_value,
+        'tree_roots': packed.tree_roots,
+        'scaler_mean': scaler.mean_,
+        'scaler_scale': scaler.scale_
+    }
+    layout = packed.layout_for(scaler) or compile_layout(arrays, scaler.mean_, scaler.scale_)
+    arrays.update({
+        'layout_children': layout['children'],
+        'layout_split_feature': layout['split_feature'],
+        'layout_threshold': layout['threshold']
+    })
+
+    tmp_path = f"{path.rstrip(os.sep)}.tmp-{os.getpid()}"
+    shutil.rmtree(tmp_path, ignore_errors=True)
+    os.makedirs(tmp_path)
+
+    entries = {}
+    for name, dtype in {**ARRAY_DTYPES, **LAYOUT_DTYPES}.items():
+        filename = f'{name}.npy'
+        array = np.ascontiguousarray(arrays[name], dtype=dtype)
+        np.save(os.path.join(tmp_path, filename), array, allow_pickle=False)
+        entries[name] = {
+            'file': filename,
+            'dtype': np.dtype(dtype).str,
+            'shape': list(array.shape),
+            'sha256': _file_digest(os.path.join(tmp_path, filename))
+        }
+
+    header = {
+        'format': ARTIFACT_FORMAT,
+        'version': ARTIFACT_VERSION,
+        'model_id': hashlib.sha256(
+            ''.join(entry['sha256'] for entry in entries.values()).encode()
+        ).hexdigest()[:16],
+        'created_at': time.time(),
+        'n_features': packed.n_features_in_,
+        'n_trees': packed.n_trees,
+        'max_samples': packed.max_samples_,
+        'offset': packed.offset_,
+        'contamination': packed.contamination,
+        'layout_max_depth': int(layout['max_depth']),
+        'scaler_samples_seen': int(np.max(getattr(scaler, 'n_samples_seen_', 0))),
+        'metadata': metadata or {},
+        'arrays': entries
+    }
+    with open(os.path.join(tmp_path, HEADER_FILE), 'w') as handle:
+        json.dump(header, handle, indent=2)
+
+    _replace_directory(tmp_path, path)
+    return header
+
+
+def load_artifact(path, mmap=True, verify=True):
+    """Load an artifact, returning (header, scaler mean, scaler scale, PackedForest)"""
+    header = read_header(path)
+    arrays = {}
+    for name, dtype in ARRAY_DTYPES.items():
+        entry = header['arrays'].get(name)
+        if entry is None:
+            raise ArtifactError(f"Artifact is missing array '{name}'")
+        arrays[name] = _load_array(path, entry, dtype, mmap, verify)
+
+    layout = None
+    if all(name in header['arrays'] for name in LAYOUT_DTYPES) and 'layout_max_depth' in header:
+        stored = {name: _load_array(path, header['arrays'][name], dtype, mmap, verify)
+                  for name, dtype in LAYOUT_DTYPES.items()}
+        layout = {
+            'children': stored['layout_children'],
+            'split_feature': stored['layout_split_feature'],
+            'threshold': stored['layout_threshold'],
+            'max_depth': header['layout_max_depth'],
+            'scaler_mean': arrays['scaler_mean'],
+            'scaler_scale': arrays['scaler_scale']
+        }
+
+    forest = PackedForest(arrays, header['max_samples'], header['offset'], header['n_features'],
+                          contamination=header.get('contamination'), layout=layout)
+    return header, arrays['scaler_mean'], arrays['scaler_scale'], forest
+
+
+def _load_array(path, entry, dtype, mmap, verify):
+    filepath = os.path.join(path, entry['file'])
+    if verify and _file_digest(filepath) != entry['sha256']:
+        raise ArtifactError(f"Checksum mismatch for '{entry['file']}'")
+    array = np.load(filepath, mmap_mode='r' if mmap else None, allow_pickle=False)
+    if array.dtype != np.dtype(dtype) or list(array.shape) != entry['shape']:
+        raise ArtifactError(f"Unexpected dtype or shape for '{entry['file']}'")
+    return array
+
+
+def read_header(path):
+    """Read and validate an artifact header"""
+    try:
+        with open(os.path.join(path, HEADER_FILE)) as handle:
+            header = json.load(handle)
+    except (OSError, ValueError) as e:
+        raise ArtifactError(f"Cannot read artifact header: {e}") from e
+
+    if header.get('format') != ARTIFACT_FORMAT:
+        raise ArtifactError(f"Unknown artifact format: {header.get('format')}")
+    if header.get('version') != ARTIFACT_VERSION:
+        raise ArtifactError(f"Unsupported artifact version: {header.get('version')}")
+    return header
+
+
+def is_artifact(path):
+    return os.path.isfile(os.path.join(path, HEADER_FILE))
+
+
+def _file_digest(filepath):
+    digest = hashlib.sha256()
+    with open(filepath, 'rb') as handle:
+        for block in iter(lambda: handle.read(1 << 20), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def _replace_directory(source, target):
+    """Move a finished artifact into place, replacing any previous one"""
+    backup = None
+    if os.path.exists(target):
+        backup = f"{target.rstrip(os.sep)}.old-{os.getpid()}"
+        os.rename(target, backup)
+    os.rename(source, target)
+    if backup:
+        shutil.rmtree(backup, ignore_errors=True)
@@ -0,0 +1,215 @@
+"""Offline scoring of archived flow logs with a saved model.
+
+Input files (CSV, JSONL or Parquet, optionally gzipped for the text formats)
+are read in fixed-size chunks and fanned out to a process pool. Each worker
+loads the model once in its initializer; artifact directories are
+memory-mapped, so all workers share the same page-cache pages. At most
+``max_pending`` chunks are in flight, which bounds memory by chunk size times
+worker count however large the input is.
+
+Results are appended to a single CSV or JSONL file in input order. After
+every chunk the output is flushed and a checkpoint records the input file and
+raw row it reached and the output's byte length. An interrupted run resumes
+by truncating the output to that length and reading on from that row:
+finished files are not opened, CSV rows are skipped by the parser without
+building frames, JSONL lines are skipped unparsed, and Parquet skips whole
+row groups.
+
+Flows are scored one chunk at a time with no FlowAggregator in front, so the
+window aggregates (``source_distinct_ports``, ``source_connection_rate``,
+...) are zero offline and rules built on them, such as ``port_scan`` and
+``connection_flood``, never match. Offline verdicts cover the per-flow model
+score and per-flow rules only.
+"""
+import gzip
+import io
+import itertools
+import json
+import logging
+import os
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+import pandas as pd
+
+from app.models.threat_detector import ThreatDetector
+from app.utils.data_processor import NetworkDataProcessor
+
+INPUT_FORMATS = {'.csv': 'csv', '.jsonl': 'jsonl', '.ndjson': 'jsonl', '.parquet': 'parquet'}
+OUTPUT_FORMATS = {'.csv': 'csv', '.jsonl': 'jsonl', '.ndjson': 'jsonl'}
+FLOW_COLUMNS = ['timestamp', 'source_ip', 'destination_ip', 'port', 'protocol']
+RESULT_COLUMNS = ['is_threat', 'confidence', 'threat_level']
+
+# Model loaded once per pool worker by the executor initializer
+_detector = None
+
+
+def _init_worker(model_path):
+    global _detector
+    detector = ThreatDetector(cache=False)
+    if not detector.load_model(model_path):
+        raise RuntimeError(f"Could not load model from {model_path}")
+    _detector = detector
+
+
+def score_chunk(frame):
+    """Normalize and score one chunk of raw log rows (runs in a pool worker)"""
+    flows = NetworkDataProcessor.process_network_frame(frame)
+    results = _detector.predict_batch(flows)
+    if results and 'error' in results[0]:
+        raise RuntimeError('Scoring failed; see worker log')
+    scored = flows[FLOW_COLUMNS].reset_index(drop=True)
+    for column in RESULT_COLUMNS:
+        scored[column] = [result[column] for result in results]
+    return scored
+
+
+def file_format(path, formats):
+    name = path[:-3] if path.endswith('.gz') else path
+    extension = os.path.splitext(name)[1].lower()
+    if extension not in formats:
+        raise ValueError(f"Unsupported file type for {path}; expected one of {sorted(formats)}")
+    return formats[extension]
+
+
+def read_chunks(path, chunk_size, skip_rows=0):
+    """Yield DataFrames of at most ``chunk_size`` raw rows from one input file,
+    starting after its first ``skip_rows`` rows
+    """
+    kind = file_format(path, INPUT_FORMATS)
+    if kind == 'csv':
+        skip = range(1, skip_rows + 1) if skip_rows else None
+        with pd.read_csv(path, chunksize=chunk_size, skiprows=skip) as reader:
+            yield from reader
+    elif kind == 'jsonl':
+        opener = gzip.open if path.endswith('.gz') else open
+        with opener(path, 'rt') as handle:
+            # Blank lines hold no record, so only non-blank ones count as rows
+            lines = (line for line in handle if line.strip())
+            remaining = itertools.islice(lines, skip_rows, None)
+            for block in iter(lambda: list(itertools.islice(remaining, chunk_size)), []):
+                yield pd.read_json(io.StringIO(''.join(block)), lines=True, dtype=False,
+                                   convert_dates=False)
+    else:
+        try:
+            import pyarrow.parquet as pq
+        except ImportError as error:
+            raise ImportError('Parquet input requires pyarrow') from error
+        parquet = pq.ParquetFile(path)
+        first_group = 0
+        while (first_group < parquet.num_row_groups
+               and parquet.metadata.row_group(first_group).num_rows <= skip_rows):
+            skip_rows -= parquet.metadata.row_group(first_group).num_rows
+            first_group += 1
+        groups = range(first_group, parquet.num_row_groups)
+        for batch in parquet.iter_batches(batch_size=chunk_size, row_groups=groups):
+            if skip_rows >= len(batch):
+                skip_rows -= len(batch)
+                continue
+            yield batch.slice(skip_rows).to_pandas()
+            skip_rows = 0
+
+
+class BulkScorer:
+    """Chunked, multiprocess, resumable scoring of flow log files"""
+
+    def __init__(self, model_path, output_path, workers=None, chunk_size=100000,
+                 checkpoint_path=None, max_pending=None):
+        self.model_path = model_path
+        if output_path.endswith('.gz'):
+            raise ValueError('Compressed output is not supported; results are appended in place')
+        self.output_path = output_path
+        self.output_format = file_format(output_path, OUTPUT_FORMATS)
+        self.workers = workers or os.cpu_count() or 1
+        self.chunk_size = chunk_size
+        self.checkpoint_path = checkpoint_path or f"{output_path}.checkpoint.json"
+        self.max_pending = max_pending or 2 * self.workers
+        self.logger = logging.getLogger(__name__)
+
+    def run(self, inputs, resume=True):
+        """Score every input file and return a summary of the run"""
+        job = {
+            'inputs': [os.path.abspath(path) for path in inputs],
+            'model': os.path.abspath(self.model_path),
+            'chunk_size': self.chunk_size
+        }
+        state = self._load_checkpoint(job) if resume else None
+        if state is None:
+            state = dict(job, chunks=0, rows=0, threats=0, offset=0, file=0, file_rows=0)
+        skipped, resumed_rows = state['chunks'], state['rows']
+        if skipped:
+            self.logger.info(f"Resuming after {skipped} chunks ({state['rows']} rows), "
+                             f"at row {state['file_rows']} of {job['inputs'][state['file']]}")
+
+        start = time.perf_counter()
+        with open(self.output_path, 'r+b' if state['offset'] else 'wb') as output:
+            output.truncate(state['offset'])
+            output.seek(state['offset'])
+            with ProcessPoolExecutor(max_workers=self.workers, initializer=_init_worker,
+                                     initargs=(self.model_path,)) as executor:
+                pending = deque()
+                chunks = self._chunks(job['inputs'], state['file'], state['file_rows'])
+                for position, chunk in chunks:
+                    pending.append((executor.submit(score_chunk, chunk), position))
+                    if len(pending) >= self.max_pending:
+                        self._write(output, *pending.popleft(), state)
+                while pending:
+                    self._write(output, *pending.popleft(), state)
+
+        elapsed = time.perf_counter() - start
+        rows = state['rows'] - resumed_rows
+        return {
+            'output': self.output_path,
+            'chunks': state['chunks'],
+            'rows': state['rows'],
+            'threats': state['threats'],
+            'resumed_chunks': skipped,
+            'seconds': elapsed,
+            'rows_per_sec': rows / elapsed if elapsed > 0 else 0.0
+        }
+
+    def _chunks(self, inputs, first_file, skip_rows):
+        """Yield ((file index, raw rows read from it), chunk), starting at a checkpoint"""
+        for index in range(first_file, len(inputs)):
+            rows = skip_rows if index == first_file else 0
+            for chunk in read_chunks(inputs[index], self.chunk_size, rows):
+                rows += len(chunk)
+                yield (index, rows), chunk
+
+    def _write(self, output, future, position, state):
+        scored = future.result()
+        if self.output_format == 'csv':
+            payload = scored.to_csv(index=False, header=state['offset'] == 0)
+        else:
+            payload = scored.to_json(orient='records', lines=True)
+            if payload and not payload.endswith('\n'):
+                payload += '\n'
+        output.write(payload.encode())
+        output.flush()
+        os.fsync(output.fileno())
+
+        state['chunks'] += 1
+        state['rows'] += len(scored)
+        state['threats'] += int(scored['is_threat'].sum())
+        state['offset'] = output.tell()
+        state['file'], state['file_rows'] = position
+        self._save_checkpoint(state)
+
+    def _load_checkpoint(self, job):
+        if not os.path.exists(self.checkpoint_path) or not os.path.exists(self.output_path):
+            return None
+        with open(self.checkpoint_path) as handle:
+            state = json.load(handle)
+        if any(state.get(key) != value for key, value in job.items()):
+            raise ValueError(f"Checkpoint {self.checkpoint_path} belongs to a different job; "
+                             "remove it or run without resume")
+        if os.path.getsize(self.output_path) < state['offset']:
+            raise ValueError(f"{self.output_path} is shorter than its checkpoint records")
+        return state
+
+    def _save_checkpoint(self, state):
+        tmp_path = f"{self.checkpoint_path}.tmp-{os.getpid()}"
+        with open(tmp_path, 'w') as handle:
+            json.dump(state, handle, indent=2)
+        os.replace(tmp_path, self.checkpoint_path)
@@ -0,0 +1,174 @@
+"""Vectorized IsolationForest scoring over packed node arrays.
+
+Every tree of the forest lives in one set of concatenated node arrays, so a
+batch is scored by advancing an (n_rows, n_trees) matrix of node ids one level
+per step instead of calling into each estimator in turn. When the scaler is
+folded in, split thresholds are moved into raw feature space and inputs skip
+``StandardScaler.transform`` entirely.
+
+``compile_layout`` builds the traversal arrays; an artifact stores them next
+to the node arrays, so a loaded forest scores straight from the mapped pages.
+"""
+import numpy as np
+
+
+def average_path_length(n_samples):
+    """Expected path length of an unsuccessful BST search over n samples"""
+    n_samples = np.asarray(n_samples, dtype=np.float64)
+    lengths = np.zeros_like(n_samples)
+    lengths[n_samples == 2] = 1.0
+    many = n_samples > 2
+    n = n_samples[many]
+    lengths[many] = 2.0 * (np.log(n - 1.0) + np.euler_gamma) - 2.0 * (n - 1.0) / n
+    return lengths
+
+
+def pack_forest(model):
+    """Concatenate the trees of a fitted IsolationForest into flat node arrays"""
+    features, thresholds, lefts, rights, values, roots = [], [], [], [], [], []
+    offset = 0
+
+    for estimator, subset in zip(model.estimators_, model.estimators_features_):
+        tree = estimator.tree_
+        node_count = tree.node_count
+        left = tree.children_left[:node_count]
+        right = tree.children_right[:node_count]
+        is_leaf = left == -1
+
+        # Children always have larger ids than their parent, so one pass in
+        # id order assigns every depth
+        depth = np.zeros(node_count, dtype=np.int64)
+        for node in np.flatnonzero(~is_leaf):
+            depth[left[node]] = depth[right[node]] = depth[node] + 1
+
+        value = np.zeros(node_count, dtype=np.float64)
+        leaf_samples = tree.n_node_samples[:node_count][is_leaf]
+        value[is_leaf] = depth[is_leaf] + average_path_length(leaf_samples)
+
+        feature = np.where(is_leaf, -1,
+                           np.asarray(subset)[np.maximum(tree.feature[:node_count], 0)])
+        features.append(feature)
+        thresholds.append(np.where(is_leaf, 0.0, tree.threshold[:node_count]))
+        lefts.append(np.where(is_leaf, -1, left + offset))
+        rights.append(np.where(is_leaf, -1, right + offset))
+        values.append(value)
+        roots.append(offset)
+        offset += node_count
+
+    return {
+        'node_feature': np.concatenate(features),
+        'node_threshold': np.concatenate(thresholds),
+        'node_left': np.concatenate(lefts),
+        'node_right': np.concatenate(rights),
+        'node_value': np.concatenate(values),
+        'tree_roots': np.array(roots)
+    }
+
+
+def compile_layout(arrays, scaler_mean=None, scaler_scale=None):
+    """Traversal arrays for packed node arrays, with the scaler folded in when given"""
+    node_feature = np.asarray(arrays['node_feature'])
+    is_leaf = node_feature < 0
+    node_ids = np.arange(len(node_feature), dtype=np.int32)
+
+    # Leaves loop back to themselves with an infinite threshold, so every
+    # row can take exactly max_depth steps without masking finished ones.
+    # children[1] is taken when the row goes left, children[0] otherwise.
+    children = np.stack([
+        np.where(is_leaf, node_ids, arrays['node_right']),
+        np.where(is_leaf, node_ids, arrays['node_left'])
+    ]).astype(np.int32)
+    split_feature = np.where(is_leaf, 0, node_feature).astype(np.int32)
+
+    threshold = np.asarray(arrays['node_threshold'], dtype=np.float64)
+    if scaler_mean is not None:
+        # (x - mean) / scale <= t  <=>  x <= t * scale + mean, since scale > 0
+        scale = np.asarray(scaler_scale)[split_feature]
+        threshold = threshold * scale + np.asarray(scaler_mean)[split_feature]
+    threshold = np.where(is_leaf, np.inf, threshold)
+
+    depth = 0
+    frontier = np.asarray(arrays['tree_roots'], dtype=np.int32)
+    while True:
+        frontier = frontier[~is_leaf[frontier]]
+        if len(frontier) == 0:
+            break
+        frontier = np.concatenate([children[0, frontier], children[1, frontier]])
+        depth += 1
+
+    return {'children': children, 'split_feature': split_feature, 'threshold': threshold,
+            'max_depth': depth}
+
+
+class CompiledForest:
+    """Score all trees of a packed IsolationForest at once"""
+
+    # Rows per traversal block; keeps the (rows, trees) working set in cache
+    BLOCK_ROWS = 1024
+
+    def __init__(self, arrays, max_samples, offset, n_features, scaler_mean=None, scaler_scale=None,
+                 layout=None):
+        self.tree_roots = np.asarray(arrays['tree_roots'], dtype=np.int32)
+        self.node_value = arrays['node_value']
+        self.offset_ = offset
+        self.n_features_in_ = n_features
+        self.folded = scaler_mean is not None
+
+        # A precompiled layout (built with the same scaler) is used as is,
+        # so memory-mapped layout arrays are never copied
+        if layout is None:
+            layout = compile_layout(arrays, scaler_mean, scaler_scale)
+        self._children = layout['children']
+        self._split_feature = layout['split_feature']
+        self._threshold = layout['threshold']
+        self.max_depth = int(layout['max_depth'])
+        self._denominator = len(self.tree_roots) * average_path_length([max_samples])[0]
+
+    @classmethod
+    def compile(cls, scaler, model):
+        """Compile a fitted scaler/forest pair, folding the scaler into the thresholds"""
+        if hasattr(model, 'node_feature'):
+            arrays = {name: getattr(model, name) for name in
+                      ('node_feature', 'node_threshold', 'node_left', 'node_right',
+                       'node_value', 'tree_roots')}
+        else:
+            arrays = pack_forest(model)
+        layout = model.layout_for(scaler) if hasattr(model, 'layout_for') else None
+        return cls(arrays, int(model.max_samples_), float(model.offset_), int(model.n_features_in_),
+                   scaler_mean=scaler.mean_, scaler_scale=scaler.scale_, layout=layout)
+
+    def path_lengths(self, X):
+        """Summed path length of every row over all trees"""
+        if self.folded:
+            X = np.ascontiguousarray(X, dtype=np.float64)
+        else:
+            # scikit-learn compares float32 inputs against float64 thresholds
+            X = np.ascontiguousarray(X, dtype=np.float32)
+
+        lengths = np.empty(len(X), dtype=np.float64)
+        for start in range(0, len(X), self.BLOCK_ROWS):
+            block = X[start:start + self.BLOCK_ROWS]
+            lengths[start:start + len(block)] = self._block_path_lengths(block)
+        return lengths
+
+    def _block_path_lengths(self, X):
+        values = X.ravel()
+        row_offset = (np.arange(len(X), dtype=np.int32) * X.shape[1])[:, None]
+        node = np.repeat(self.tree_roots[None, :], len(X), axis=0)
+
+        for _ in range(self.max_depth):
+            go_left = values[row_offset + self._split_feature[node]] <= self._threshold[node]
+            node = self._children[go_left.view(np.int8), node]
+
+        return self.node_value[node].sum(axis=1)
+
+    def score_samples(self, X):
+        if self._denominator == 0:
+            return -np.ones(len(X))
+        return -(2.0 ** (-self.path_lengths(X) / self._denominator))
+
+    def decision_function(self, X):
+        return self.score_samples(X) - self.offset_
+
+    def predict(self, X):
+        return np.where(self.decision_function(X) < 0, -1, 1)
@@ -0,0 +1,187 @@
+import numpy as np
+import pandas as pd
+
+# Output column order of the feature matrix. Models are trained against this
+# layout, so new features must be appended rather than inserted.
+FEATURE_COLUMNS = ['packet_size', 'frequency', 'port_number', 'protocol_type',
+                   'connection_duration']
+
+# (input field, default) for each output column
+FEATURE_SOURCES = [
+    ('packet_size', 0),
+    ('frequency', 0),
+    ('port', 80),
+    ('protocol', 'TCP'),
+    ('duration', 0)
+]
+
+# Optional columns appended when the extractor has IP reputation lists; each
+# holds the endpoint's reputation code (-1 allowlisted, 0 unknown, 1 blocklisted)
+REPUTATION_COLUMNS = ['source_reputation', 'destination_reputation']
+REPUTATION_SOURCES = ['source_ip', 'destination_ip']
+
+# Sliding-window per-source aggregates written into records by
+# FlowAggregator; appended as feature columns when enabled
+AGGREGATE_COLUMNS = [
+    'source_connection_rate',
+    'source_distinct_ports',
+    'source_byte_rate',
+    'source_mean_duration',
+    'source_port_connection_rate'
+]
+
+# Every record field the extractor reads. Only these decide whether a dict is
+# one record or a dict of columns; other fields may hold anything
+INPUT_FIELDS = frozenset([field for field, _ in FEATURE_SOURCES]
+                         + REPUTATION_SOURCES + AGGREGATE_COLUMNS)
+
+PROTOCOL_CODES = {'TCP': 1, 'UDP': 2, 'ICMP': 3, 'HTTP': 4, 'HTTPS': 5}
+DEFAULT_PROTOCOL = 'TCP'
+
+
+def encode_protocol(protocol):
+    """Encode a single protocol name"""
+    if protocol is None:
+        protocol = DEFAULT_PROTOCOL
+    return PROTOCOL_CODES.get(str(protocol).strip().upper(), 0)
+
+
+class FeatureExtractor:
+    """Columnar feature extraction shared by training and scoring"""
+
+    # Up to this many records, per-record extraction beats building a DataFrame
+    SMALL_BATCH = 16
+
+    def __init__(self, dtype=np.float64, reputation=None, aggregates=False):
+        self.dtype = dtype
+        self.reputation = reputation
+        self.aggregates = aggregates
+
+    @property
+    def columns(self):
+        return (FEATURE_COLUMNS
+                + (REPUTATION_COLUMNS if self.reputation is not None else [])
+                + (AGGREGATE_COLUMNS if self.aggregates else []))
+
+    @property
+    def n_features(self):
+        return len(self.columns)
+
+    def transform(self, data):
+        """Build the feature matrix from records, a DataFrame or a dict of arrays"""
+        if isinstance(data, dict) and not self._is_columnar(data):
+            return self.transform_record(data)
+
+        if isinstance(data, np.ndarray):
+            if data.dtype.names is None:
+                return self._validate_matrix(data)
+            # Flow array (see app.utils.flow_records): field views, no copies
+            return self._transform_columns({name: data[name] for name in data.dtype.names})
+
+        if isinstance(data, (list, tuple)):
+            if len(data) == 0:
+                return np.empty((0, self.n_features), dtype=self.dtype)
+            if not isinstance(data[0], dict):
+                # Already a feature matrix, e.g. JSON training data
+                return self._validate_matrix(np.asarray(data, dtype=self.dtype))
+            if len(data) <= self.SMALL_BATCH:
+                try:
+                    return np.vstack([self.transform_record(record) for record in data])
+                except (TypeError, ValueError):
+                    # Non-numeric values: let the columnar path coerce them
+                    pass
+            data = pd.DataFrame.from_records(data)
+
+        return self._transform_columns(data)
+
+    def transform_record(self, record):
+        """Build a 1 x n feature row for a single record"""
+        row = np.empty((1, self.n_features), dtype=self.dtype)
+        for index, (field, default) in enumerate(FEATURE_SOURCES):
+            value = record.get(field, default)
+            if field == 'protocol':
+                row[0, index] = encode_protocol(value)
+            else:
+                row[0, index] = default if value is None else value
+        if self.reputation is not None:
+            for index, field in enumerate(REPUTATION_SOURCES, len(FEATURE_SOURCES)):
+                row[0, index] = self.reputation.reputation([record.get(field)])[0]
+        if self.aggregates:
+            first = self.n_features - len(AGGREGATE_COLUMNS)
+            for index, field in enumerate(AGGREGATE_COLUMNS, first):
+                value = record.get(field)
+                row[0, index] = 0 if value is None else value
+        return row
+
+    def _transform_columns(self, columns):
+        """Vectorized extraction over any mapping of field name to column"""
+        n_rows = len(columns) if isinstance(columns, pd.DataFrame) else self._column_length(columns)
+        matrix = np.empty((n_rows, self.n_features), dtype=self.dtype)
+
+        for index, (field, default) in enumerate(FEATURE_SOURCES):
+            if field not in columns:
+                matrix[:, index] = self._default_value(field, default)
+                continue
+
+            column = columns[field]
+            if field == 'protocol':
+                matrix[:, index] = self._encode_protocol_column(column)
+            else:
+                values = pd.to_numeric(pd.Series(column, copy=False), errors='coerce')
+                matrix[:, index] = values.fillna(default).to_numpy(dtype=self.dtype)
+
+        if self.reputation is not None:
+            for index, field in enumerate(REPUTATION_SOURCES, len(FEATURE_SOURCES)):
+                if field in columns:
+                    addresses = columns[field]
+                    if not isinstance(addresses, np.ndarray):
+                        addresses = list(addresses)
+                    matrix[:, index] = self.reputation.reputation(addresses)
+                else:
+                    matrix[:, index] = 0
+
+        if self.aggregates:
+            first = self.n_features - len(AGGREGATE_COLUMNS)
+            for index, field in enumerate(AGGREGATE_COLUMNS, first):
+                if field in columns:
+                    values = pd.to_numeric(pd.Series(columns[field], copy=False), errors='coerce')
+                    matrix[:, index] = values.fillna(0).to_numpy(dtype=self.dtype)
+                else:
+                    matrix[:, index] = 0
+
+        return matrix
+
+    def _encode_protocol_column(self, column):
+        """Encode protocols through a lookup table over the distinct values only"""
+        column = np.asarray(column)
+        if np.issubdtype(column.dtype, np.number):
+            # Already encoded upstream
+            return column
+
+        codes, uniques = pd.factorize(column, use_na_sentinel=True)
+        table = np.array([encode_protocol(value) for value in uniques] + [encode_protocol(None)],
+                         dtype=self.dtype)
+        # Missing values carry code -1, which indexes the default entry
+        return table[codes]
+
+    def _default_value(self, field, default):
+        return encode_protocol(default) if field == 'protocol' else default
+
+    def _validate_matrix(self, matrix):
+        if matrix.ndim != 2 or matrix.shape[1] != self.n_features:
+            raise ValueError(
+                f"Expected feature matrix with {self.n_features} columns, got shape {matrix.shape}"
+            )
+        return matrix.astype(self.dtype, copy=False)
+
+    @staticmethod
+    def _is_columnar(data):
+        return any(isinstance(data[field], (np.ndarray, list, tuple, pd.Series))
+                   for field in INPUT_FIELDS if field in data)
+
+    @staticmethod
+    def _column_length(columns):
+        lengths = {len(columns[field]) for field in INPUT_FIELDS if field in columns}
+        if len(lengths) > 1:
+            raise ValueError(f"Columns have different lengths: {sorted(lengths)}")
+        return lengths.pop() if lengths else 0
@@ -0,0 +1,312 @@
+import copy
+import logging
+import threading
+import time
+
+import numpy as np
+from sklearn.base import clone
+from sklearn.ensemble import IsolationForest
+
+from app.models.artifact import PackedForest
+from app.models.compiled_forest import pack_forest
+from app.models.threat_detector import ThreatDetector
+
+
+class ReservoirSample:
+    """Bounded uniform sample of feature rows with optional age-based expiry"""
+
+    def __init__(self, capacity, n_features, max_age=None, random_state=None):
+        self.capacity = capacity
+        self.max_age = max_age
+        self.rows = np.empty((capacity, n_features), dtype=np.float64)
+        self.timestamps = np.empty(capacity, dtype=np.float64)
+        self.size = 0
+        self.seen = 0
+        self.rng = np.random.default_rng(random_state)
+
+    def add(self, X, now=None):
+        """Offer a batch of rows to the reservoir (Algorithm R, vectorized)"""
+        now = time.time() if now is None else now
+        self.expire(now)
+        X = np.asarray(X, dtype=np.float64)
+        if len(X) == 0:
+            return
+
+        # Rows that fit into free slots are always kept
+        free = min(self.capacity - self.size, len(X))
+        if free:
+            self.rows[self.size:self.size + free] = X[:free]
+            self.timestamps[self.size:self.size + free] = now
+            self.size += free
+            self.seen += free
+            X = X[free:]
+
+        if len(X):
+            # Row k of the remainder is the (seen + k + 1)-th row offered and
+            # replaces a random slot with probability capacity / (seen + k + 1)
+            slots = self.rng.integers(0, self.seen + np.arange(1, len(X) + 1))
+            keep = slots < self.capacity
+            self.rows[slots[keep]] = X[keep]
+            self.timestamps[slots[keep]] = now
+            self.seen += len(X)
+
+    def expire(self, now=None):
+        """Drop rows older than max_age, shrinking the seen count to match"""
+        if self.max_age is None or self.size == 0:
+            return
+        now = time.time() if now is None else now
+        fresh = self.timestamps[:self.size] >= now - self.max_age
+        kept = int(fresh.sum())
+        if kept == self.size:
+            return
+        self.rows[:kept] = self.rows[:self.size][fresh]
+        self.timestamps[:kept] = self.timestamps[:self.size][fresh]
+        self.seen = int(self.seen * kept / self.size)
+        self.size = kept
+
+    def sample(self):
+        return self.rows[:self.size].copy()
+
+    def __len__(self):
+        return self.size
+
+
+class IncrementalLearner:
+    """Keep a ThreatDetector current by refreshing part of its forest over a traffic sample
+
+    ``on_update`` is called with the learner's lock held, so it must only
+    publish the detector. ``rebase`` bumps a generation counter, and a
+    refresh that started before it is dropped rather than published over the
+    detector it was given. Callers should rebase before they publish a new
+    detector themselves.
+    """
+
+    def __init__(self, detector, on_update, reservoir_size=10000, max_age=3600.0,
+                 refresh_every=5000, refresh_interval=900.0, refresh_fraction=0.2,
+                 min_samples=256, scaler_horizon=100000, exclude_threats=True,
+                 background=True, random_state=None):
+        self.detector = detector
+        self.on_update = on_update
+        self.refresh_every = refresh_every
+        self.refresh_interval = refresh_interval
+        self.refresh_fraction = refresh_fraction
+        self.min_samples = min_samples
+        self.scaler_horizon = scaler_horizon
+        self.exclude_threats = exclude_threats
+        self.background = background
+        self.rng = np.random.default_rng(random_state)
+        self.reservoir = ReservoirSample(reservoir_size, detector.feature_extractor.n_features,
+                                         max_age=max_age, random_state=random_state)
+        self.scaler = self._initial_scaler(detector)
+        self.pending = 0
+        self.refresh_count = 0
+        self.last_refresh = time.monotonic()
+        self.logger = logging.getLogger(__name__)
+        self._lock = threading.Lock()
+        self._refreshing = False
+        self.generation = 0
+
+    def rebase(self, detector):
+        """Continue from a detector that was trained elsewhere"""
+        with self._lock:
+            self.detector = detector
+            self.scaler = self._initial_scaler(detector)
+            self.generation += 1
+
+    def observe(self, records, results=None):
+        """Take in scored traffic and refresh the model when due"""
+        X = self.detector.extract_features(records)
+        if results is not None and self.exclude_threats:
+            benign = np.array([not result.get('is_threat') for result in results], dtype=bool)
+            X = X[benign]
+        if len(X) == 0:
+            return False
+
+        with self._lock:
+            self.reservoir.add(X)
+            self._update_scaler(X)
+            self.pending += len(X)
+            due = self._refresh_due()
+            if due:
+                self._refreshing = True
+
+        if not due:
+            return False
+        if self.background:
+            threading.Thread(target=self.refresh, name='incremental-refresh', daemon=True).start()
+        else:
+            self.refresh()
+        return True
+
+    def refresh(self):
+        """Build an updated detector from the sample and publish it"""
+        try:
+            with self._lock:
+                detector = self.detector
+                generation = self.generation
+                sample = self.reservoir.sample()
+                scaler = copy.deepcopy(self.scaler)
+
+            start = time.perf_counter()
+            if not detector.is_trained:
+                updated = ThreatDetector()
+                if not updated.train(sample):
+                    raise RuntimeError('Initial fit failed')
+            elif isinstance(detector.model, PackedForest):
+                updated = self._replace_packed_trees(detector, scaler, sample)
+            else:
+                updated = self._replace_trees(detector, scaler, sample)
+
+            with self._lock:
+                if generation != self.generation:
+                    self.logger.info('Incremental refresh dropped: '
+                                     'the detector was replaced meanwhile')
+                    return False
+                self.detector = updated
+                self.pending = 0
+                self.refresh_count += 1
+                self.last_refresh = time.monotonic()
+                self.on_update(updated)
+            self.logger.info(
+                f"Incremental refresh {self.refresh_count} on {len(sample)} samples "
+                f"took {time.perf_counter() - start:.3f}s"
+            )
+            return True
+        except Exception as e:
+            self.logger.error(f"Incremental refresh failed: {e}")
+            return False
+        finally:
+            self._refreshing = False
+
+    def stats(self):
+        return {
+            'reservoir_size': len(self.reservoir),
+            'samples_seen': self.reservoir.seen,
+            'pending': self.pending,
+            'refresh_count': self.refresh_count,
+            'seconds_since_refresh': time.monotonic() - self.last_refresh
+        }
+
+    def _refresh_due(self):
+        if self._refreshing or len(self.reservoir) < self.min_samples:
+            return False
+        if self.pending >= self.refresh_every:
+            return True
+        return self.pending > 0 and time.monotonic() - self.last_refresh >= self.refresh_interval
+
+    def _initial_scaler(self, detector):
+        if detector.is_trained:
+            return copy.deepcopy(detector.scaler)
+        return clone(detector.scaler)
+
+    def _update_scaler(self, X):
+        # Capping the effective sample count turns the running mean/variance
+        # into an exponentially weighted one, so the scaler follows drift
+        if hasattr(self.scaler, 'n_samples_seen_'):
+            self.scaler.n_samples_seen_ = np.minimum(self.scaler.n_samples_seen_,
+                                                     self.scaler_horizon)
+        self.scaler.partial_fit(X)
+
+    def _replace_trees(self, detector, scaler, sample):
+        """Swap the oldest fraction of trees for trees fit on the current sample"""
+        old_model = detector.model
+        n_trees = len(old_model.estimators_)
+        n_replace = min(n_trees, max(1, int(round(self.refresh_fraction * n_trees))))
+
+        X_scaled = scaler.transform(sample)
+        fresh = clone(old_model).set_params(
+            n_estimators=n_replace,
+            random_state=int(self.rng.integers(0, 2 ** 31 - 1))
+        )
+        fresh.fit(X_scaled)
+
+        kept = [self._rescale_tree(tree, features, detector.scaler, scaler)
+                for tree, features in zip(old_model.estimators_[n_replace:],
+                                          old_model.estimators_features_[n_replace:])]
+
+        model = copy.copy(old_model)
+        model.estimators_ = kept + list(fresh.estimators_)
+        model.estimators_features_ = (list(old_model.estimators_features_[n_replace:])
+                                      + list(fresh.estimators_features_))
+        model.n_estimators = len(model.estimators_)
+        if hasattr(old_model, '_seeds'):
+            model._seeds = np.concatenate([old_model._seeds[n_replace:], fresh._seeds])
+        # Per-tree caches that newer scikit-learn versions precompute in fit
+        for attribute in ('_average_path_length_per_tree', '_decision_path_lengths'):
+            if hasattr(old_model, attribute):
+                setattr(model, attribute, tuple(getattr(old_model, attribute)[n_replace:])
+                        + tuple(getattr(fresh, attribute)))
+
+        if model.contamination != 'auto':
+            model.offset_ = np.percentile(model.score_samples(X_scaled),
+                                          100.0 * model.contamination)
+
+        updated = copy.copy(detector)
+        updated.scaler, updated.model = scaler, model
+        # Compile before publishing so no request pays for it
+        updated._get_engine()
+        return updated
+
+    def _replace_packed_trees(self, detector, scaler, sample):
+        """_replace_trees for a forest loaded from a flat-array artifact"""
+        packed = detector.model
+        n_trees = packed.n_trees
+        n_replace = min(n_trees, max(1, int(round(self.refresh_fraction * n_trees))))
+
+        X_scaled = scaler.transform(sample)
+        fresh = IsolationForest(
+            n_estimators=n_replace,
+            max_samples=min(packed.max_samples_, len(X_scaled)),
+            random_state=int(self.rng.integers(0, 2 ** 31 - 1))
+        ).fit(X_scaled)
+        fresh_arrays = pack_forest(fresh)
+
+        # Trees are stored oldest first, each as one contiguous run of nodes
+        cut = int(packed.tree_roots[n_replace]) if n_replace < n_trees else len(packed.node_feature)
+        feature = np.asarray(packed.node_feature[cut:])
+        threshold = np.array(packed.node_threshold[cut:], dtype=np.float64)
+        split = feature >= 0
+        column = feature[split]
+        old_scaler = detector.scaler
+        raw_threshold = threshold[split] * old_scaler.scale_[column] + old_scaler.mean_[column]
+        threshold[split] = (raw_threshold - scaler.mean_[column]) / scaler.scale_[column]
+
+        def children(kept, added):
+            kept = np.asarray(kept)
+            return np.concatenate([np.where(kept >= 0, kept - cut, -1),
+                                   np.where(added >= 0, added + len(feature), -1)])
+
+        arrays = {
+            'node_feature': np.concatenate([feature, fresh_arrays['node_feature']]),
+            'node_threshold': np.concatenate([threshold, fresh_arrays['node_threshold']]),
+            'node_left': children(packed.node_left[cut:], fresh_arrays['node_left']),
+            'node_right': children(packed.node_right[cut:], fresh_arrays['node_right']),
+            'node_value': np.concatenate([packed.node_value[cut:], fresh_arrays['node_value']]),
+            'tree_roots': np.concatenate([np.asarray(packed.tree_roots[n_replace:]) - cut,
+                                          fresh_arrays['tree_roots'] + len(feature)])
+        }
+        model = PackedForest(arrays, packed.max_samples_, packed.offset_, packed.n_features_in_,
+                             contamination=packed.contamination)
+        if model.contamination not in (None, 'auto'):
+            offset = float(np.percentile(model.score_samples(X_scaled),
+                                         100.0 * model.contamination))
+            model = PackedForest(arrays, packed.max_samples_, offset, packed.n_features_in_,
+                                 contamination=packed.contamination)
+
+        updated = copy.copy(detector)
+        updated.scaler, updated.model = scaler, model
+        updated._get_engine()
+        return updated
+
+    @staticmethod
+    def _rescale_tree(tree, features, old_scaler, new_scaler):
+        """Re-express a tree's split thresholds in the new scaler's space"""
+        tree = copy.deepcopy(tree)
+        nodes = tree.tree_
+        split = nodes.feature >= 0
+        column = np.asarray(features)[nodes.feature[split]]
+        raw_threshold = (nodes.threshold[split] * old_scaler.scale_[column]
+                         + old_scaler.mean_[column])
+        nodes.threshold[split] = ((raw_threshold - new_scaler.mean_[column])
+                                  / new_scaler.scale_[column])
+        return tree
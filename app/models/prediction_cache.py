@@ -0,0 +1,140 @@
+"""Bounded LRU cache of anomaly scores keyed on feature vectors.
+
+Much of the traffic repeats the same feature tuple, so the score for a row
+is cached under the row's bytes after optional per-column quantization.
+Entries carry the version token of the scaler/model pair that produced them
+and a lookup only hits for the same version. A retrained or reloaded model
+therefore never reads stale scores, even when detectors share a cache.
+"""
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+from app.utils.metrics import PREDICTION_CACHE_EVENTS
+
+# Rough per-entry cost beyond the key bytes: dict slot, ordering links, the
+# (version, score) tuple and the boxed float
+ENTRY_OVERHEAD_BYTES = 200
+
+
+def parse_quantization(spec):
+    """Parse 'packet_size=8,connection_duration=0.01' into a column -> step dict"""
+    steps = {}
+    for item in (spec or '').split(','):
+        if not item.strip():
+            continue
+        column, _, step = item.partition('=')
+        steps[column.strip()] = float(step)
+    return steps
+
+
+class PredictionCache:
+    """Thread-safe LRU map from quantized feature rows to model scores"""
+
+    def __init__(self, max_entries=100000, max_bytes=None, quantization=None, columns=None):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.quantization = dict(quantization or {})
+        self._steps = None
+        if self.quantization:
+            unknown = set(self.quantization) - set(columns or [])
+            if unknown:
+                raise ValueError(f"Cannot quantize unknown feature columns: {sorted(unknown)}")
+            self._steps = np.array([self.quantization.get(column, 0.0) for column in columns])
+        self._init_state()
+
+    def _init_state(self):
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._capacity = None
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __getstate__(self):
+        # Entries are tied to this process's model objects; ship the settings only
+        state = self.__dict__.copy()
+        for name in ('_entries', '_lock', '_capacity', 'hits', 'misses', 'evictions'):
+            state.pop(name)
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._init_state()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def keys(self, features):
+        """Cache key per row: the bytes of the (quantized) feature vector"""
+        features = np.asarray(features, dtype=np.float64)
+        if self._steps is not None:
+            quantized = self._steps > 0
+            features = features.copy()
+            features[:, quantized] = np.round(features[:, quantized] / self._steps[quantized])
+        return [row.tobytes() for row in np.ascontiguousarray(features)]
+
+    def lookup(self, features, version):
+        """Return (scores, pending): scores for hits, and key -> row indexes still to score.
+
+        Rows that share a key are scored once, so pending groups them.
+        """
+        keys = self.keys(features)
+        scores = np.empty(len(keys), dtype=np.float64)
+        pending = {}
+        hits = 0
+        with self._lock:
+            entries = self._entries
+            for index, key in enumerate(keys):
+                entry = entries.get(key)
+                if entry is not None and entry[0] is version:
+                    entries.move_to_end(key)
+                    scores[index] = entry[1]
+                    hits += 1
+                else:
+                    pending.setdefault(key, []).append(index)
+            self.hits += hits
+            self.misses += len(keys) - hits
+        PREDICTION_CACHE_EVENTS.labels(event='hit').inc(hits)
+        PREDICTION_CACHE_EVENTS.labels(event='miss').inc(len(keys) - hits)
+        return scores, pending
+
+    def store(self, keys, scores, version):
+        """Insert freshly computed scores, evicting least recently used entries"""
+        evicted = 0
+        with self._lock:
+            entries = self._entries
+            for key, score in zip(keys, scores):
+                entries[key] = (version, float(score))
+                entries.move_to_end(key)
+            capacity = self._capacity_for(next(iter(keys), b''))
+            while len(entries) > capacity:
+                entries.popitem(last=False)
+                evicted += 1
+            self.evictions += evicted
+        if evicted:
+            PREDICTION_CACHE_EVENTS.labels(event='eviction').inc(evicted)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        requests = self.hits + self.misses
+        return {
+            'entries': len(self._entries),
+            'capacity': self._capacity,
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'hit_rate': self.hits / requests if requests else 0.0
+        }
+
+    def _capacity_for(self, key):
+        if self._capacity is None:
+            capacity = self.max_entries
+            if self.max_bytes:
+                capacity = min(capacity, self.max_bytes // (len(key) + ENTRY_OVERHEAD_BYTES))
+            self._capacity = max(int(capacity), 1)
+        return self._capacity
@@ -0,0 +1,290 @@
+"""Versioned model registry on local disk with background hot reload.
+
+Layout under the registry root::
+
+    versions/v0001/      flat-array artifact (see app.models.artifact)
+    versions/v0002/
+    registry.json        {"current": "v0002", "history": ["v0001"],
+                          "shadow": {"version": "v0003", "sample_rate": 0.1}}
+
+``registry.json`` is replaced atomically, so readers never see a partial
+pointer. Serving processes do not share memory, so each runs a
+``RegistryWatcher`` that polls the pointer file and, when the current or
+shadow version changes, loads the new artifact on its own thread and hands
+the finished detector to a callback. The request path never waits for a load
+and never takes a lock: the callback publishes by reference assignment.
+
+``RegistryWatcher.start`` is safe to call on every request: it starts the
+thread once per process. Under gunicorn's ``preload_app`` the app is
+imported in the master, and a thread started there would not exist in the
+forked workers.
+"""
+import json
+import logging
+import os
+import shutil
+import threading
+import time
+
+from app.models import artifact
+from app.models.threat_detector import ThreatDetector
+
+STATE_FILE = 'registry.json'
+VERSIONS_DIR = 'versions'
+VERSION_PREFIX = 'v'
+
+
+class RegistryError(Exception):
+    """Raised for unknown versions or a registry operation that cannot apply"""
+
+
+class ModelRegistry:
+    """Versioned ThreatDetector artifacts with a current pointer and rollback history"""
+
+    def __init__(self, root, keep=10):
+        self.root = root
+        self.keep = keep
+        self.versions_path = os.path.join(root, VERSIONS_DIR)
+        self.state_path = os.path.join(root, STATE_FILE)
+        os.makedirs(self.versions_path, exist_ok=True)
+        self._lock = threading.Lock()
+        self.logger = logging.getLogger(__name__)
+
+    def publish(self, detector, metadata=None, activate=False):
+        """Save a trained detector as the next version and return its name"""
+        if not detector.is_trained:
+            raise RegistryError('Cannot publish an untrained detector')
+        version = self._reserve_version()
+        path = self.path(version)
+        try:
+            artifact.save_artifact(path, detector.scaler, detector.model, metadata)
+        except Exception:
+            shutil.rmtree(path, ignore_errors=True)
+            raise
+        detector.registry_version = version
+        self.logger.info(f"Published model version {version}")
+        if activate:
+            self.activate(version)
+        self.prune()
+        return version
+
+    def versions(self):
+        """Version names, oldest first"""
+        names = [name for name in os.listdir(self.versions_path)
+                 if name.startswith(VERSION_PREFIX) and artifact.is_artifact(self.path(name))]
+        return sorted(names, key=_version_number)
+
+    def describe(self):
+        """Headers of every version plus the registry pointers"""
+        state = self.state()
+        models = []
+        for version in self.versions():
+            header = artifact.read_header(self.path(version))
+            models.append({
+                'version': version,
+                'model_id': header['model_id'],
+                'created_at': header['created_at'],
+                'n_trees': header['n_trees'],
+                'metadata': header.get('metadata', {}),
+                'active': version == state['current'],
+                'shadow': version == (state['shadow'] or {}).get('version')
+            })
+        return {'current': state['current'], 'history': state['history'],
+                'shadow': state['shadow'], 'models': models}
+
+    def path(self, version):
+        return os.path.join(self.versions_path, version)
+
+    def load(self, version):
+        """A fresh ThreatDetector serving the given version"""
+        self._require(version)
+        detector = ThreatDetector()
+        if not detector.load_model(self.path(version)):
+            raise RegistryError(f"Could not load model version {version}")
+        detector.registry_version = version
+        return detector
+
+    def state(self):
+        try:
+            with open(self.state_path) as handle:
+                state = json.load(handle)
+        except FileNotFoundError:
+            state = {}
+        return {'current': state.get('current'), 'history': state.get('history', []),
+                'shadow': state.get('shadow')}
+
+    def current_version(self):
+        return self.state()['current']
+
+    def activate(self, version):
+        """Point serving at a version, remembering the previous one for rollback"""
+        self._require(version)
+        with self._lock:
+            state = self.state()
+            if state['current'] == version:
+                return version
+            if state['current'] is not None:
+                state['history'] = (state['history'] + [state['current']])[-self.keep:]
+            state['current'] = version
+            self._write_state(state)
+        self.logger.info(f"Activated model version {version}")
+        return version
+
+    def rollback(self):
+        """Re-activate the most recent previous version"""
+        with self._lock:
+            state = self.state()
+            history = [version for version in state['history'] if version in set(self.versions())]
+            if not history:
+                raise RegistryError('No previous version to roll back to')
+            state['current'] = history.pop()
+            state['history'] = history
+            self._write_state(state)
+        self.logger.info(f"Rolled back to model version {state['current']}")
+        return state['current']
+
+    def set_shadow(self, version, sample_rate=0.1):
+        """Run a candidate version in shadow on a sample of traffic (None stops it)"""
+        if version is not None:
+            self._require(version)
+            if not 0 < sample_rate <= 1:
+                raise RegistryError('sample_rate must be in (0, 1]')
+        with self._lock:
+            state = self.state()
+            state['shadow'] = None if version is None else {'version': version,
+                                                            'sample_rate': float(sample_rate)}
+            self._write_state(state)
+        return state['shadow']
+
+    def prune(self):
+        """Delete the oldest versions beyond ``keep``, never one that is referenced"""
+        state = self.state()
+        shadow_version = (state['shadow'] or {}).get('version')
+        referenced = set(state['history']) | {state['current'], shadow_version}
+        versions = self.versions()
+        for version in versions[:max(len(versions) - self.keep, 0)]:
+            if version not in referenced:
+                shutil.rmtree(self.path(version), ignore_errors=True)
+
+    def _reserve_version(self):
+        """Claim the next version name; mkdir makes the claim safe across processes"""
+        number = max((_version_number(name) for name in os.listdir(self.versions_path)
+                      if name.startswith(VERSION_PREFIX)), default=0)
+        while True:
+            number += 1
+            version = f"{VERSION_PREFIX}{number:04d}"
+            try:
+                os.mkdir(self.path(version))
+                return version
+            except FileExistsError:
+                continue
+
+    def _require(self, version):
+        if version not in self.versions():
+            raise RegistryError(f"Unknown model version {version}")
+
+    def _write_state(self, state):
+        tmp_path = f"{self.state_path}.tmp-{os.getpid()}-{threading.get_ident()}"
+        with open(tmp_path, 'w') as handle:
+            json.dump(state, handle, indent=2)
+        os.replace(tmp_path, self.state_path)
+
+
+def _version_number(name):
+    try:
+        return int(name[len(VERSION_PREFIX):])
+    except ValueError:
+        return 0
+
+
+class RegistryWatcher:
+    """Follow the registry pointers, loading changed versions off the request path"""
+
+    def __init__(self, registry, on_activate, on_shadow, poll_interval=5.0, served_version=None):
+        self.registry = registry
+        self.on_activate = on_activate
+        self.on_shadow = on_shadow
+        self.poll_interval = poll_interval
+        self.served_version = served_version
+        self.shadow = None
+        self.last_error = None
+        self._failed = set()
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._check_lock = threading.Lock()
+        self._start_lock = threading.Lock()
+        self._thread = None
+        self._pid = None
+        self.logger = logging.getLogger(__name__)
+
+    def start(self):
+        """Start the watch thread in this process, if it is not running here yet"""
+        # Compared per call since gunicorn forks workers after import
+        if self._pid == os.getpid():
+            return
+        with self._start_lock:
+            if self._pid == os.getpid():
+                return
+            if self._pid is not None:
+                # Forked from a process that ran the thread: its events and lock
+                # may be held by a thread that does not exist here
+                self._wake = threading.Event()
+                self._stop = threading.Event()
+                self._check_lock = threading.Lock()
+            self._thread = threading.Thread(target=self._run, name='registry-watcher', daemon=True)
+            self._pid = os.getpid()
+            self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._wake.set()
+
+    def refresh(self):
+        """Check the pointers now instead of at the next poll"""
+        self._wake.set()
+
+    def wait_for(self, version, timeout=30.0):
+        """Block until ``version`` is being served; False on timeout or load failure"""
+        deadline = time.monotonic() + timeout
+        while self.served_version != version:
+            if version in self._failed or time.monotonic() >= deadline:
+                return False
+            time.sleep(0.01)
+        return True
+
+    def check(self):
+        """Load and publish whatever the pointers name, if it is not served yet"""
+        with self._check_lock:
+            state = self.registry.state()
+            current = state['current']
+            if current and current != self.served_version and current not in self._failed:
+                detector = self._load(current)
+                if detector is not None:
+                    self.on_activate(detector)
+                    self.served_version = current
+
+            shadow = state['shadow']
+            key = (shadow['version'], shadow['sample_rate']) if shadow else None
+            if key != self.shadow and (key is None or key[0] not in self._failed):
+                detector = None if key is None else self._load(key[0])
+                if key is None or detector is not None:
+                    self.on_shadow(detector, *(key or (None, 0.0)))
+                    self.shadow = key
+
+    def _load(self, version):
+        try:
+            return self.registry.load(version)
+        except Exception as e:
+            self.logger.error(f"Loading model version {version} failed: {e}")
+            self.last_error = str(e)
+            self._failed.add(version)
+            return None
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                self.check()
+            except Exception as e:
+                self.logger.error(f"Registry watch error: {e}")
+            self._wake.wait(self.poll_interval)
+            self._wake.clear()
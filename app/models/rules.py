@@ -0,0 +1,430 @@
+"""Configurable rule engine for the untrained path and as a pre-filter.
+
+Rules are loaded from a JSON file and compiled once into lookup structures:
+port sets and ranges become a 65536-entry bitmap, protocols a table indexed by
+protocol code, CIDR lists longest-prefix-match tables. A batch is then
+evaluated with one vectorized pass per rule.
+
+Example rule::
+
+    {"name": "rdp_from_outside", "ports": [3389], "port_ranges": [[5900, 5910]],
+     "protocols": ["TCP"], "thresholds": {"packet_size": {"gt": 1500}},
+     "source_cidrs": ["203.0.113.0/24"], "weight": 1.0, "threat_level": "high",
+     "verdict": "malicious"}
+
+Thresholds may also use the sliding-window aggregates FlowAggregator adds to
+records (``source_distinct_ports``, ``source_connection_rate``, ...).
+``source_reputation`` and ``destination_reputation`` take a list of
+``blocklisted``/``allowlisted`` and match against the IP reputation lists
+configured with IP_BLOCKLIST_PATHS and IP_ALLOWLIST_PATHS.
+
+All conditions of a rule must hold for it to match. A flow is a threat when
+the weights of its matching rules add up to ``threat_threshold``; its level is
+the highest level among them. Rules with a ``verdict`` of ``malicious`` or
+``benign`` let the detector skip model scoring for the flows they match.
+
+``evaluate`` checks a single record with scalar comparisons instead of a
+one-row batch, and reputation rules are skipped while no lists are loaded.
+"""
+import json
+import logging
+import operator
+import os
+import threading
+import time
+
+import numpy as np
+import pandas as pd
+
+from app.models.features import (AGGREGATE_COLUMNS, FEATURE_SOURCES, PROTOCOL_CODES,
+                                 FeatureExtractor, encode_protocol)
+from app.utils.ip_intel import REPUTATION_NAMES, UNKNOWN, PrefixTable, get_ip_reputation
+
+DEFAULT_RULES_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'default_rules.json')
+
+THREAT_LEVELS = ['low', 'medium', 'high']
+VERDICTS = {'benign': -1, 'malicious': 1}
+# The operator functions compare scalars and, elementwise, arrays
+COMPARATORS = {
+    'gt': operator.gt,
+    'gte': operator.ge,
+    'lt': operator.lt,
+    'lte': operator.le,
+    'eq': operator.eq
+}
+# Numeric fields rules may compare, mapped to their feature matrix column
+FIELD_COLUMNS = {field: index for index, (field, _) in enumerate(FEATURE_SOURCES)
+                 if field != 'protocol'}
+PROTOCOL_COLUMN = [field for field, _ in FEATURE_SOURCES].index('protocol')
+PORT_COLUMN = FIELD_COLUMNS['port']
+
+
+class RuleConfigError(ValueError):
+    """Raised when a rule file cannot be compiled"""
+
+
+# What malformed values (wrong types, out-of-range ports, short ranges) raise
+# while compiling; reported as RuleConfigError so a bad edit never escapes
+CONFIG_ERRORS = (AttributeError, IndexError, KeyError, TypeError, ValueError)
+
+
+class CompiledRule:
+    """A single rule reduced to array lookups"""
+
+    def __init__(self, config):
+        self.name = config.get('name') or 'unnamed'
+        self.weight = float(config.get('weight', 1.0))
+        level = config.get('threat_level', 'low')
+        if level not in THREAT_LEVELS:
+            raise RuleConfigError(f"Rule '{self.name}': unknown threat level '{level}'")
+        self.level_rank = THREAT_LEVELS.index(level) + 1
+        verdict = config.get('verdict')
+        if verdict is not None and verdict not in VERDICTS:
+            raise RuleConfigError(f"Rule '{self.name}': unknown verdict '{verdict}'")
+        self.verdict = VERDICTS.get(verdict, 0)
+
+        self.port_bitmap = None
+        if 'ports' in config or 'port_ranges' in config:
+            self.port_bitmap = np.zeros(65536, dtype=bool)
+            ports = np.asarray(config.get('ports', []), dtype=np.int64)
+            if ports.ndim != 1 or ((ports < 0) | (ports > 65535)).any():
+                raise RuleConfigError(f"Rule '{self.name}': ports must be a list of 0-65535")
+            self.port_bitmap[ports] = True
+            for low, high in config.get('port_ranges', []):
+                low, high = int(low), int(high)
+                if not 0 <= low <= high <= 65535:
+                    raise RuleConfigError(f"Rule '{self.name}': bad port range [{low}, {high}]")
+                self.port_bitmap[low:high + 1] = True
+
+        self.protocol_table = None
+        if 'protocols' in config:
+            self.protocol_table = np.zeros(max(PROTOCOL_CODES.values()) + 1, dtype=bool)
+            for protocol in config['protocols']:
+                self.protocol_table[encode_protocol(protocol)] = True
+
+        self.thresholds = []
+        self.field_thresholds = []
+        for field, bounds in config.get('thresholds', {}).items():
+            if field not in FIELD_COLUMNS and field not in AGGREGATE_COLUMNS:
+                raise RuleConfigError(f"Rule '{self.name}': unknown threshold field '{field}'")
+            for operator, value in bounds.items():
+                if operator not in COMPARATORS:
+                    raise RuleConfigError(f"Rule '{self.name}': unknown comparison '{operator}'")
+                if field in FIELD_COLUMNS:
+                    self.thresholds.append((FIELD_COLUMNS[field], COMPARATORS[operator],
+                                            float(value)))
+                else:
+                    # Aggregates are read from the records, not the feature matrix
+                    self.field_thresholds.append((field, COMPARATORS[operator], float(value)))
+
+        try:
+            self.source_cidrs = (PrefixTable(config['source_cidrs'])
+                                 if 'source_cidrs' in config else None)
+            self.destination_cidrs = (PrefixTable(config['destination_cidrs'])
+                                      if 'destination_cidrs' in config else None)
+        except ValueError as e:
+            raise RuleConfigError(f"Rule '{self.name}': {e}") from e
+
+        self.reputation = {}
+        for endpoint in ('source', 'destination'):
+            names = config.get(f'{endpoint}_reputation')
+            if names is None:
+                continue
+            unknown = set(names) - set(REPUTATION_NAMES)
+            if unknown:
+                raise RuleConfigError(f"Rule '{self.name}': unknown reputation {sorted(unknown)}")
+            self.reputation[endpoint] = np.array([REPUTATION_NAMES[name] for name in names])
+        self.reputation_sets = {endpoint: frozenset(codes.tolist())
+                                for endpoint, codes in self.reputation.items()}
+
+    @property
+    def uses_ips(self):
+        return self.source_cidrs is not None or self.destination_cidrs is not None
+
+    def matches(self, features, fields):
+        mask = np.ones(len(features), dtype=bool)
+        if self.port_bitmap is not None:
+            ports = np.clip(features[:, PORT_COLUMN], 0, 65535).astype(np.int64)
+            mask &= self.port_bitmap[ports]
+        if self.protocol_table is not None:
+            codes = features[:, PROTOCOL_COLUMN].astype(np.int64)
+            known = (codes >= 0) & (codes < len(self.protocol_table))
+            mask &= known & self.protocol_table[np.where(known, codes, 0)]
+        for column, compare, value in self.thresholds:
+            mask &= compare(features[:, column], value)
+        for field, compare, value in self.field_thresholds:
+            mask &= compare(fields[field], value)
+        if self.source_cidrs is not None:
+            mask &= self.source_cidrs.contains(fields['source_ip'])
+        if self.destination_cidrs is not None:
+            mask &= self.destination_cidrs.contains(fields['destination_ip'])
+        for endpoint, codes in self.reputation.items():
+            mask &= np.isin(fields[f'{endpoint}_reputation'], codes)
+        return mask
+
+    def matches_record(self, features, fields):
+        """Scalar ``matches`` for one record: a feature row as a list and scalar fields"""
+        if self.port_bitmap is not None:
+            if not self.port_bitmap[int(min(max(features[PORT_COLUMN], 0), 65535))]:
+                return False
+        if self.protocol_table is not None:
+            code = int(features[PROTOCOL_COLUMN])
+            if not (0 <= code < len(self.protocol_table) and self.protocol_table[code]):
+                return False
+        for column, compare, value in self.thresholds:
+            if not compare(features[column], value):
+                return False
+        for field, compare, value in self.field_thresholds:
+            if not compare(fields[field], value):
+                return False
+        if self.source_cidrs is not None:
+            if not self.source_cidrs.contains([fields['source_ip']])[0]:
+                return False
+        if self.destination_cidrs is not None:
+            if not self.destination_cidrs.contains([fields['destination_ip']])[0]:
+                return False
+        for endpoint, codes in self.reputation_sets.items():
+            if fields[f'{endpoint}_reputation'] not in codes:
+                return False
+        return True
+
+
+class RuleEvaluation:
+    """Vectorized outcome of evaluating a rule set over a batch"""
+
+    def __init__(self, matched, rules, threat_threshold):
+        self.matched = matched
+        self.rule_names = [rule.name for rule in rules]
+        weights = np.array([rule.weight for rule in rules])
+        ranks = np.array([rule.level_rank for rule in rules])
+        verdicts = np.array([rule.verdict for rule in rules])
+
+        n_rows = matched.shape[1]
+        if len(rules):
+            self.scores = weights @ matched
+            level_rank = (matched * ranks[:, None]).max(axis=0)
+            malicious = ((verdicts > 0)[:, None] & matched).any(axis=0)
+            benign = ((verdicts < 0)[:, None] & matched).any(axis=0)
+        else:
+            self.scores = np.zeros(n_rows)
+            level_rank = np.zeros(n_rows, dtype=np.int64)
+            malicious = benign = np.zeros(n_rows, dtype=bool)
+
+        self.is_threat = (self.scores >= threat_threshold) | malicious
+        self.threat_levels = np.array(['low'] + THREAT_LEVELS)[level_rank]
+        # Malicious verdicts win over benign ones
+        self.verdicts = np.where(malicious, 1, np.where(benign, -1, 0))
+
+    def __len__(self):
+        return len(self.scores)
+
+    def matched_rules(self, index):
+        return [name for name, hit in zip(self.rule_names, self.matched[:, index]) if hit]
+
+
+class RecordEvaluation:
+    """RuleEvaluation of a single record, built from its matching rules without arrays"""
+
+    def __init__(self, matched, threat_threshold):
+        self.rule_names = [rule.name for rule in matched]
+        score = sum(rule.weight for rule in matched)
+        level_rank = max((rule.level_rank for rule in matched), default=0)
+        malicious = any(rule.verdict > 0 for rule in matched)
+        benign = any(rule.verdict < 0 for rule in matched)
+        self.scores = [score]
+        self.is_threat = [score >= threat_threshold or malicious]
+        self.threat_levels = [(['low'] + THREAT_LEVELS)[level_rank]]
+        self.verdicts = [1 if malicious else -1 if benign else 0]
+
+    def __len__(self):
+        return 1
+
+    def matched_rules(self, index):
+        return list(self.rule_names)
+
+
+class RuleEngine:
+    """A compiled, immutable rule set"""
+
+    def __init__(self, config, reputation=None):
+        try:
+            self.threat_threshold = float(config.get('threat_threshold', 1.0))
+            self.threat_confidence = float(config.get('threat_confidence', 0.75))
+            self.benign_confidence = float(config.get('benign_confidence', 0.25))
+            rules = [rule for rule in config.get('rules', []) if rule.get('enabled', True)]
+        except RuleConfigError:
+            raise
+        except CONFIG_ERRORS as e:
+            raise RuleConfigError(f"Invalid rule set: {e!r}") from e
+        self.rules = [_compile_rule(rule) for rule in rules]
+        self.uses_ips = any(rule.uses_ips for rule in self.rules)
+        self.uses_reputation = any(rule.reputation for rule in self.rules)
+        self.record_fields = sorted({field for rule in self.rules
+                                     for field, _, _ in rule.field_thresholds})
+        if self.uses_reputation and reputation is None:
+            reputation = get_ip_reputation()
+        self.reputation = reputation
+        # Without lists every address is UNKNOWN, which no reputation rule matches
+        self.reputation_loaded = self.uses_reputation and reputation.enabled
+        self.record_rules = [rule for rule in self.rules
+                             if not rule.reputation or self.reputation_loaded]
+        self.feature_extractor = FeatureExtractor()
+
+    @classmethod
+    def from_file(cls, path):
+        try:
+            with open(path) as handle:
+                config = json.load(handle)
+        except (OSError, ValueError) as e:
+            raise RuleConfigError(f"Cannot read rules from {path}: {e}") from e
+        return cls(config)
+
+    def evaluate_batch(self, records, features=None):
+        """Evaluate every rule over records (list of dicts, DataFrame or dict of arrays)"""
+        if features is None:
+            features = self.feature_extractor.transform(records)
+        fields = {}
+        if self.uses_ips or self.uses_reputation:
+            for endpoint in ('source', 'destination'):
+                addresses = _column(records, f'{endpoint}_ip', len(features))
+                fields[f'{endpoint}_ip'] = addresses
+                if self.reputation_loaded:
+                    fields[f'{endpoint}_reputation'] = self.reputation.reputation(addresses)
+                elif self.uses_reputation:
+                    fields[f'{endpoint}_reputation'] = np.full(len(features), UNKNOWN)
+        for field in self.record_fields:
+            fields[field] = _numeric_column(records, field, len(features))
+
+        matched = np.zeros((len(self.rules), len(features)), dtype=bool)
+        for index, rule in enumerate(self.rules):
+            matched[index] = rule.matches(features, fields)
+        return RuleEvaluation(matched, self.rules, self.threat_threshold)
+
+    def evaluate(self, record):
+        """Evaluate every rule over a single record with scalar comparisons"""
+        features = self.feature_extractor.transform_record(record)[0].tolist()
+        fields = {}
+        if self.uses_ips or self.reputation_loaded:
+            for endpoint in ('source', 'destination'):
+                address = record.get(f'{endpoint}_ip')
+                fields[f'{endpoint}_ip'] = address
+                if self.reputation_loaded:
+                    fields[f'{endpoint}_reputation'] = int(
+                        self.reputation.reputation([address])[0])
+        for field in self.record_fields:
+            fields[field] = _numeric_value(record.get(field))
+        matched = [rule for rule in self.record_rules if rule.matches_record(features, fields)]
+        return RecordEvaluation(matched, self.threat_threshold)
+
+
+def _compile_rule(config):
+    try:
+        return CompiledRule(config)
+    except RuleConfigError:
+        raise
+    except CONFIG_ERRORS as e:
+        raise RuleConfigError(f"Rule '{config.get('name') or 'unnamed'}': {e!r}") from e
+
+
+def _column(records, field, length):
+    if isinstance(records, np.ndarray):
+        return records[field] if field in records.dtype.names else [None] * length
+    if isinstance(records, dict):
+        column = records.get(field)
+        return list(column) if column is not None else [None] * length
+    if hasattr(records, 'columns'):
+        return list(records[field]) if field in records.columns else [None] * length
+    return [record.get(field) for record in records]
+
+
+def _numeric_value(value):
+    # Missing or unparseable values count as 0, as in the feature extractor
+    if value is None:
+        return 0.0
+    try:
+        value = float(value)
+    except (TypeError, ValueError):
+        return 0.0
+    return 0.0 if value != value else value
+
+
+def _numeric_column(records, field, length):
+    if isinstance(records, dict) and field not in records:
+        return np.zeros(length)
+    if hasattr(records, 'columns') and field not in records.columns:
+        return np.zeros(length)
+    if isinstance(records, np.ndarray) and field not in records.dtype.names:
+        return np.zeros(length)
+    values = _column(records, field, length)
+    try:
+        column = np.array(values, dtype=np.float64)
+    except (TypeError, ValueError):
+        column = pd.to_numeric(pd.Series(values, dtype=object),
+                               errors='coerce').to_numpy(dtype=np.float64)
+    # Missing or unparseable values count as 0, as in the feature extractor
+    return np.nan_to_num(column, nan=0.0)
+
+
+class RuleEngineLoader:
+    """Serve the current RuleEngine for a file, recompiling it when the file changes"""
+
+    def __init__(self, path, check_interval=5.0):
+        self.path = path
+        self.check_interval = check_interval
+        self.logger = logging.getLogger(__name__)
+        self._lock = threading.Lock()
+        self._mtime = None
+        self._next_check = 0.0
+        self._engine = RuleEngine({'rules': []})
+        self.reload()
+
+    def __reduce__(self):
+        # Unpickle to the receiving process's shared loader for the same file
+        return get_rule_loader, (self.path, self.check_interval)
+
+    def current(self):
+        """Return the compiled engine, checking the file's mtime at most every check_interval"""
+        if time.monotonic() >= self._next_check:
+            self._check_for_changes()
+        return self._engine
+
+    def reload(self):
+        """Recompile the rule file; keep the previous engine if it is invalid"""
+        with self._lock:
+            try:
+                mtime = os.path.getmtime(self.path)
+                self._engine = RuleEngine.from_file(self.path)
+                self._mtime = mtime
+                self.logger.info(f"Loaded {len(self._engine.rules)} rules from {self.path}")
+                return True
+            except (OSError, RuleConfigError) as e:
+                self.logger.error(f"Rule reload failed, keeping previous rules: {e}")
+                return False
+            finally:
+                self._next_check = time.monotonic() + self.check_interval
+
+    def _check_for_changes(self):
+        try:
+            changed = os.path.getmtime(self.path) != self._mtime
+        except OSError:
+            changed = False
+        if changed:
+            self.reload()
+        else:
+            self._next_check = time.monotonic() + self.check_interval
+
+
+_loaders = {}
+_loaders_lock = threading.Lock()
+
+
+def get_rule_loader(path=None, check_interval=None):
+    """Shared loader per rule file, so each worker compiles and reloads a file once"""
+    path = os.path.abspath(path or os.getenv('RULES_PATH') or DEFAULT_RULES_PATH)
+    if check_interval is None:
+        check_interval = float(os.getenv('RULES_RELOAD_INTERVAL', '5'))
+    with _loaders_lock:
+        loader = _loaders.get(path)
+        if loader is None:
+            loader = _loaders[path] = RuleEngineLoader(path, check_interval)
+        return loader
@@ -0,0 +1,150 @@
+"""Shadow scoring of a candidate model on live traffic.
+
+The request path calls ``offer(records, results)`` after the primary result
+is ready. A sample of the records is put on a bounded queue without
+blocking (batches that do not fit are dropped and counted) and a worker
+thread scores them with the candidate. Agreement with the primary verdicts
+and the candidate's scoring latency are kept for ``stats()`` and exported as
+Prometheus metrics. The candidate's results never reach clients, and its
+threats are not counted in the detection metrics.
+"""
+import logging
+import queue
+import random
+import threading
+import time
+from collections import deque
+
+import numpy as np
+
+from app.utils.flow_records import as_records
+from app.utils.metrics import SHADOW_COMPARISONS, SHADOW_LATENCY
+
+_STOP = object()
+
+
+class ShadowScorer:
+    """Score a sample of live traffic with a candidate detector on a background thread"""
+
+    def __init__(self, detector, version=None, sample_rate=0.1, max_queue=1000,
+                 latency_window=1000):
+        self.detector = detector
+        self.version = version
+        self.sample_rate = sample_rate
+        self._queue = queue.Queue(max_queue)
+        self._latencies = deque(maxlen=latency_window)
+        self._lock = threading.Lock()
+        self._thread = None
+        self.started_at = time.time()
+        self.sampled = 0
+        self.scored = 0
+        self.dropped = 0
+        self.errors = 0
+        self.agree = 0
+        self.level_agree = 0
+        self.primary_only = 0
+        self.shadow_only = 0
+        self.logger = logging.getLogger(__name__)
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name='shadow-scorer', daemon=True)
+            self._thread.start()
+        return self
+
+    def stop(self):
+        """Finish queued work and stop the worker"""
+        if self._thread is not None:
+            self._queue.put(_STOP)
+            self._thread.join()
+            self._thread = None
+
+    def offer(self, records, results):
+        """Queue a sample of scored records for the candidate; never blocks"""
+        records = as_records(records)
+        if self.sample_rate >= 1:
+            sample = [(dict(record), result) for record, result in zip(records, results)]
+        else:
+            sample = [(dict(record), result) for record, result in zip(records, results)
+                      if random.random() < self.sample_rate]
+        if not sample:
+            return
+        try:
+            self._queue.put_nowait(sample)
+        except queue.Full:
+            with self._lock:
+                self.dropped += len(sample)
+            SHADOW_COMPARISONS.labels(outcome='dropped').inc(len(sample))
+            return
+        with self._lock:
+            self.sampled += len(sample)
+
+    def stats(self):
+        with self._lock:
+            latencies = np.array(self._latencies) * 1000
+            scored = self.scored
+            return {
+                'version': self.version,
+                'sample_rate': self.sample_rate,
+                'started_at': self.started_at,
+                'sampled': self.sampled,
+                'scored': scored,
+                'dropped': self.dropped,
+                'errors': self.errors,
+                'pending': self._queue.qsize(),
+                'agreement': self.agree / scored if scored else None,
+                'threat_level_agreement': self.level_agree / scored if scored else None,
+                'primary_only_threats': self.primary_only,
+                'shadow_only_threats': self.shadow_only,
+                'batch_latency_ms': ({f'p{q}': float(np.percentile(latencies, q))
+                                      for q in (50, 95, 99)} if len(latencies) else None)
+            }
+
+    def _run(self):
+        while True:
+            sample = self._queue.get()
+            if sample is _STOP:
+                return
+            records = [record for record, _ in sample]
+            try:
+                start = time.perf_counter()
+                results = self.detector.predict_batch(records, record_metrics=False)
+                elapsed = time.perf_counter() - start
+            except Exception as e:
+                self.logger.error(f"Shadow scoring failed: {e}")
+                with self._lock:
+                    self.errors += len(records)
+                SHADOW_COMPARISONS.labels(outcome='error').inc(len(records))
+                continue
+            SHADOW_LATENCY.observe(elapsed)
+            self._compare([primary for _, primary in sample], results, elapsed)
+
+    def _compare(self, primary_results, shadow_results, elapsed):
+        agree = level_agree = primary_only = shadow_only = errors = 0
+        for primary, shadow in zip(primary_results, shadow_results):
+            if 'error' in shadow:
+                errors += 1
+                continue
+            primary_threat = bool(primary.get('is_threat'))
+            shadow_threat = bool(shadow.get('is_threat'))
+            if primary_threat == shadow_threat:
+                agree += 1
+                if primary.get('threat_level') == shadow.get('threat_level'):
+                    level_agree += 1
+            elif primary_threat:
+                primary_only += 1
+            else:
+                shadow_only += 1
+        scored = len(shadow_results) - errors
+        with self._lock:
+            self.scored += scored
+            self.errors += errors
+            self.agree += agree
+            self.level_agree += level_agree
+            self.primary_only += primary_only
+            self.shadow_only += shadow_only
+            self._latencies.append(elapsed)
+        SHADOW_COMPARISONS.labels(outcome='agree').inc(agree)
+        SHADOW_COMPARISONS.labels(outcome='disagree').inc(primary_only + shadow_only)
+        if errors:
+            SHADOW_COMPARISONS.labels(outcome='error').inc(errors)
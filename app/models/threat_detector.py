@@ -1,102 +1,303 @@
 import numpy as np
 import pandas as pd
+from sklearn.base import clone
 from sklearn.ensemble import IsolationForest
 from sklearn.preprocessing import StandardScaler
 import joblib
 import logging
+import os
+import time
+from app.models import artifact
+from app.models.compiled_forest import CompiledForest
+from app.models.features import FeatureExtractor, encode_protocol
+from app.models.prediction_cache import PredictionCache, parse_quantization
+from app.models.rules import get_rule_loader
+from app.utils.ip_intel import get_ip_reputation
+from app.utils.metrics import (BATCH_SIZE, MODEL_LOAD_DURATION, MODEL_TRAIN_DURATION,
+                               record_results, stage_timer)
 
 class ThreatDetector:
-    def __init__(self):
+    HIGH_CONFIDENCE = 0.7
+    MEDIUM_CONFIDENCE = 0.4
+    # Above this many rows sklearn's Cython traversal outruns the compiled
+    # scorer, whose advantage is avoiding per-call overhead
+    COMPILED_MAX_ROWS = 512
+    
+    def __init__(self, compiled=None, rules=None, rule_prefilter=None, ip_reputation=None,
+                 cache=None):
         self.model = IsolationForest(contamination=0.1, random_state=42)
         self.scaler = StandardScaler()
         self.is_trained = False
+        # Reputation and aggregate columns change the feature layout, so models
+        # must be trained with the same settings they are served with
+        if ip_reputation is None and os.getenv('IP_REPUTATION_FEATURES', 'false').lower() == 'true':
+            ip_reputation = get_ip_reputation()
+        aggregate_features = os.getenv('AGGREGATE_FEATURES', 'false').lower() == 'true'
+        self.feature_extractor = FeatureExtractor(reputation=ip_reputation,
+                                                  aggregates=aggregate_features)
+        if compiled is None:
+            compiled = os.getenv('COMPILED_SCORER', 'true').lower() == 'true'
+        self.compiled = compiled
+        self.rules = rules or get_rule_loader()
+        if rule_prefilter is None:
+            rule_prefilter = os.getenv('RULE_PREFILTER', 'false').lower() == 'true'
+        self.rule_prefilter = rule_prefilter
+        self._engine = None
+        self._engine_source = None
+        # cache=None uses the PREDICTION_CACHE_* settings (off unless
+        # PREDICTION_CACHE_ENTRIES is set); cache=False disables it
+        self.cache = self._default_cache() if cache is None else (None if cache is False else cache)
+        self._version = None
+        self._version_source = None
+        # Registry version name when loaded from or published to a ModelRegistry
+        self.registry_version = None
+        # Rows, forest settings and wall time of the last train() call
+        self.training_stats = None
         self.logger = logging.getLogger(__name__)
     
+    def _default_cache(self):
+        max_entries = int(os.getenv('PREDICTION_CACHE_ENTRIES', '0'))
+        if max_entries <= 0:
+            return None
+        return PredictionCache(
+            max_entries=max_entries,
+            max_bytes=int(os.getenv('PREDICTION_CACHE_MAX_BYTES', str(64 * 1024 * 1024))),
+            quantization=parse_quantization(os.getenv('PREDICTION_CACHE_QUANTIZATION')),
+            columns=self.feature_extractor.columns
+        )
+    
+    @property
+    def model_version(self):
+        """Token identifying the current scaler/model pair; changes on train, load and swap"""
+        scaler, model = self.scaler, self.model
+        source = self._version_source
+        if source is None or source[0] is not scaler or source[1] is not model:
+            self._version = object()
+            self._version_source = (scaler, model)
+        return self._version
+    
     def extract_features(self, network_data):
         """Extract features from network traffic data"""
         try:
-            features = {
-                'packet_size': network_data.get('packet_size', 0),
-                'frequency': network_data.get('frequency', 0),
-                'port_number': network_data.get('port', 80),
-                'protocol_type': self._encode_protocol(network_data.get('protocol', 'TCP')),
-                'connection_duration': network_data.get('duration', 0)
-            }
-            return np.array(list(features.values())).reshape(1, -1)
+            return self.feature_extractor.transform(network_data)
         except Exception as e:
             self.logger.error(f"Feature extraction failed: {e}")
             raise
     
     def _encode_protocol(self, protocol):
         """Simple protocol encoding"""
-        protocol_map = {'TCP': 1, 'UDP': 2, 'ICMP': 3, 'HTTP': 4, 'HTTPS': 5}
-        return protocol_map.get(protocol.upper(), 0)
+        return encode_protocol(protocol)
     
-    def train(self, training_data):
-        """Train the threat detection model"""
+    def train(self, training_data, progress_callback=None, max_samples=None, n_jobs=None):
+        """Train the threat detection model
+        
+        max_samples and n_jobs override the forest's settings for this fit
+        (defaults: TRAIN_MAX_SAMPLES, TRAIN_N_JOBS). Trees are built in
+        parallel; scoring stays single-threaded.
+        """
+        report = progress_callback or (lambda stage, progress: None)
         try:
-            X = np.array(training_data)
-            X_scaled = self.scaler.fit_transform(X)
-            self.model.fit(X_scaled)
+            start = time.perf_counter()
+            report('extracting_features', 0.1)
+            X = self.extract_features(training_data)
+            
+            # Fit a fresh scaler/model pair and publish both together, so the
+            # detector never pairs a refit scaler with the previous forest
+            report('fitting_scaler', 0.3)
+            scaler = clone(self.scaler)
+            X_scaled = scaler.fit_transform(X)
+            report('fitting_model', 0.4)
+            model = clone(self.model)
+            n_jobs = self._train_n_jobs(n_jobs)
+            model.set_params(max_samples=self._train_max_samples(max_samples), n_jobs=n_jobs)
+            model.fit(X_scaled)
+            model.set_params(n_jobs=None)
+            
+            self.scaler, self.model = scaler, model
             self.is_trained = True
+            self._get_engine()
+            report('completed', 1.0)
+            elapsed = time.perf_counter() - start
+            MODEL_TRAIN_DURATION.observe(elapsed)
+            self.training_stats = {'rows': len(X), 'max_samples': int(model.max_samples_),
+                                   'n_jobs': n_jobs, 'seconds': elapsed}
             self.logger.info("Model training completed successfully")
             return True
         except Exception as e:
             self.logger.error(f"Training failed: {e}")
             return False
     
+    @staticmethod
+    def _train_max_samples(max_samples):
+        if max_samples is None:
+            max_samples = os.getenv('TRAIN_MAX_SAMPLES', 'auto')
+        if isinstance(max_samples, str) and max_samples != 'auto':
+            max_samples = float(max_samples) if '.' in max_samples else int(max_samples)
+        return max_samples
+    
+    @staticmethod
+    def _train_n_jobs(n_jobs):
+        if n_jobs is None:
+            n_jobs = int(os.getenv('TRAIN_N_JOBS', '-1'))
+        return n_jobs
+    
     def predict_threat(self, network_data):
         """Predict if network data contains threats"""
         if not self.is_trained:
-            # For demo purposes, use a simple rule-based approach
-            return self._simple_threat_detection(network_data)
+            # Without a model, the configured rule set decides
+            result = self._simple_threat_detection(network_data)
+            record_results([result])
+            return result
         
         try:
-            features = self.extract_features(network_data)
-            features_scaled = self.scaler.transform(features)
-            prediction = self.model.predict(features_scaled)
-            confidence = self.model.decision_function(features_scaled)[0]
-            
-            is_threat = prediction[0] == -1
-            threat_level = self._calculate_threat_level(confidence)
-            
-            return {
-                'is_threat': is_threat,
-                'confidence': abs(confidence),
-                'threat_level': threat_level,
-                'recommendation': self._get_recommendation(is_threat, threat_level)
-            }
+            with stage_timer('feature_extraction'):
+                features = self.extract_features(network_data)
+            result = self._predict_features([network_data], features)[0]
+            record_results([result])
+            return result
         except Exception as e:
             self.logger.error(f"Prediction failed: {e}")
             return {'error': 'Prediction failed', 'is_threat': False}
     
-    def _simple_threat_detection(self, network_data):
-        """Simple rule-based threat detection for demo"""
-        suspicious_ports = [1433, 3389, 22, 23, 135, 139, 445]
-        large_packet_threshold = 1500
+    def predict_batch(self, records, record_metrics=True):
+        """Predict threats for a batch of network records in a single pass"""
+        if len(records) == 0:
+            return []
         
-        port = network_data.get('port', 80)
-        packet_size = network_data.get('packet_size', 0)
+        if record_metrics:
+            BATCH_SIZE.observe(len(records))
         
-        is_threat = (port in suspicious_ports or 
-                    packet_size > large_packet_threshold or
-                    network_data.get('frequency', 0) > 1000)
+        try:
+            with stage_timer('feature_extraction'):
+                features = self.extract_features(records)
+            if self.is_trained:
+                results = self._predict_features(records, features)
+            else:
+                engine = self.rules.current()
+                with stage_timer('rules'):
+                    evaluation = engine.evaluate_batch(records, features)
+                results = self._rule_results(engine, evaluation)
+            if record_metrics:
+                record_results(results)
+            return results
+        except Exception as e:
+            self.logger.error(f"Batch prediction failed: {e}")
+            return [{'error': 'Prediction failed', 'is_threat': False} for _ in range(len(records))]
+    
+    def _predict_features(self, records, features):
+        """Score rows with the model, letting rule verdicts settle clear-cut rows first"""
+        if not self.rule_prefilter:
+            return self._score_matrix(features)
         
-        threat_level = 'high' if port in suspicious_ports else ('medium' if packet_size > large_packet_threshold else 'low')
+        engine = self.rules.current()
+        with stage_timer('rules'):
+            evaluation = engine.evaluate_batch(records, features)
+        decided = evaluation.verdicts != 0
+        if not decided.any():
+            return self._score_matrix(features)
         
-        return {
-            'is_threat': is_threat,
-            'confidence': 0.75 if is_threat else 0.25,
-            'threat_level': threat_level,
-            'recommendation': self._get_recommendation(is_threat, threat_level)
-        }
+        results = [None] * len(features)
+        decided_indexes = np.flatnonzero(decided)
+        decided_results = self._rule_results(engine, evaluation, decided_indexes)
+        for index, result in zip(decided_indexes, decided_results):
+            results[index] = result
+        undecided_indexes = np.flatnonzero(~decided)
+        if len(undecided_indexes):
+            scored = self._score_matrix(features[undecided_indexes])
+            for index, result in zip(undecided_indexes, scored):
+                results[index] = result
+        return results
+    
+    def decision_scores(self, features):
+        """Anomaly scores for a raw feature matrix (negative means threat)"""
+        engine = self._get_engine()
+        if engine is not None and (len(features) <= self.COMPILED_MAX_ROWS
+                                   or not hasattr(self.model, 'estimators_')):
+            with stage_timer('scoring'):
+                return engine.decision_function(features)
+        
+        with stage_timer('scaling'):
+            features_scaled = self.scaler.transform(features)
+        with stage_timer('scoring'):
+            return self.model.decision_function(features_scaled)
+    
+    def _cached_scores(self, features):
+        """Decision scores, reading repeated rows from the prediction cache"""
+        if self.cache is None:
+            return self.decision_scores(features)
+        
+        version = self.model_version
+        with stage_timer('cache_lookup'):
+            scores, pending = self.cache.lookup(features, version)
+        if pending:
+            groups = list(pending.values())
+            fresh = self.decision_scores(features[[indexes[0] for indexes in groups]])
+            for indexes, score in zip(groups, fresh):
+                scores[indexes] = score
+            self.cache.store(pending.keys(), fresh, version)
+        return scores
+    
+    def _get_engine(self):
+        """Compiled scorer for the current scaler/model pair, rebuilt when either changes"""
+        if not self.compiled:
+            return None
+        scaler, model = self.scaler, self.model
+        source = self._engine_source
+        if self._engine is None or source[0] is not scaler or source[1] is not model:
+            self._engine = CompiledForest.compile(scaler, model)
+            self._engine_source = (scaler, model)
+        return self._engine
+    
+    def _score_matrix(self, features):
+        """Score a feature matrix and build one result per row"""
+        # IsolationForest.predict is decision_function < 0, so score once
+        # and derive the prediction instead of traversing the forest twice
+        scores = self._cached_scores(features)
+        
+        with stage_timer('result_building'):
+            is_threat = scores < 0
+            abs_scores = np.abs(scores)
+            threat_levels = np.where(abs_scores > self.HIGH_CONFIDENCE, 'high',
+                                     np.where(abs_scores > self.MEDIUM_CONFIDENCE, 'medium', 'low'))
+            
+            return [
+                {
+                    'is_threat': bool(threat),
+                    'confidence': float(confidence),
+                    'threat_level': str(level),
+                    'recommendation': self._get_recommendation(threat, level)
+                }
+                for threat, confidence, level in zip(is_threat, abs_scores, threat_levels)
+            ]
+    
+    def _simple_threat_detection(self, network_data):
+        """Rule-based threat detection using the configured rule set"""
+        engine = self.rules.current()
+        return self._rule_results(engine, engine.evaluate(network_data))[0]
+    
+    def _rule_results(self, engine, evaluation, indexes=None):
+        """Build one result per evaluated row (or per selected index)"""
+        if indexes is None:
+            indexes = range(len(evaluation))
+        results = []
+        for index in indexes:
+            is_threat = bool(evaluation.is_threat[index])
+            threat_level = str(evaluation.threat_levels[index])
+            results.append({
+                'is_threat': is_threat,
+                'confidence': engine.threat_confidence if is_threat else engine.benign_confidence,
+                'threat_level': threat_level,
+                'recommendation': self._get_recommendation(is_threat, threat_level),
+                'matched_rules': evaluation.matched_rules(index)
+            })
+        return results
     
     def _calculate_threat_level(self, confidence):
         """Calculate threat level based on confidence"""
         abs_confidence = abs(confidence)
-        if abs_confidence > 0.7:
+        if abs_confidence > self.HIGH_CONFIDENCE:
             return 'high'
-        elif abs_confidence > 0.4:
+        elif abs_confidence > self.MEDIUM_CONFIDENCE:
             return 'medium'
         else:
             return 'low'
@@ -128,15 +329,47 @@ class ThreatDetector:
             self.logger.error(f"Failed to save model: {e}")
             return False
     
-    def load_model(self, filepath):
-        """Load trained model"""
+    def save_artifact(self, path, metadata=None):
+        """Save trained model as a memory-mappable flat-array artifact"""
+        if not self.is_trained:
+            self.logger.error("Cannot save an untrained model as an artifact")
+            return False
+        try:
+            header = artifact.save_artifact(path, self.scaler, self.model, metadata)
+            self.logger.info(f"Model artifact {header['model_id']} saved to {path}")
+            return True
+        except Exception as e:
+            self.logger.error(f"Failed to save model artifact: {e}")
+            return False
+    
+    def load_model(self, filepath, mmap=True, verify=True):
+        """Load trained model from a joblib file or an artifact directory"""
         try:
-            model_data = joblib.load(filepath)
-            self.model = model_data['model']
-            self.scaler = model_data['scaler']
-            self.is_trained = model_data['is_trained']
+            start = time.perf_counter()
+            if os.path.isdir(filepath):
+                self._load_artifact(filepath, mmap=mmap, verify=verify)
+            else:
+                model_data = joblib.load(filepath)
+                self.model = model_data['model']
+                self.scaler = model_data['scaler']
+                self.is_trained = model_data['is_trained']
+            if self.is_trained:
+                self._get_engine()
+            MODEL_LOAD_DURATION.observe(time.perf_counter() - start)
             self.logger.info(f"Model loaded from {filepath}")
             return True
         except Exception as e:
             self.logger.error(f"Failed to load model: {e}")
             return False
+    
+    def _load_artifact(self, path, mmap=True, verify=True):
+        header, mean, scale, forest = artifact.load_artifact(path, mmap=mmap, verify=verify)
+        scaler = StandardScaler()
+        scaler.mean_ = mean
+        scaler.scale_ = scale
+        scaler.var_ = np.square(scale)
+        scaler.n_features_in_ = header['n_features']
+        scaler.n_samples_seen_ = header.get('scaler_samples_seen', 0)
+        self.scaler, self.model = scaler, forest
+        self.is_trained = True
+        self._get_engine()
@@ -0,0 +1,286 @@
+"""Background training jobs.
+
+Training runs in a process pool started with ``forkserver`` (``spawn`` where
+that is unavailable), never ``fork``: the serving process has request,
+watcher and logging threads, and a forked child could inherit locks they
+hold.
+
+Under gunicorn each worker has its own ``TrainingJobManager``, and a job
+lives in the worker that received ``POST /api/train``. So that any worker
+can answer for it:
+
+* with ``state_dir`` set, every change of a job's state is written to
+  ``<state_dir>/<job_id>.json``, and ``get``/``wait`` fall back to that file
+  for jobs started elsewhere,
+* the finished model is published through ``on_complete``. Only the worker
+  that trained it swaps it in directly; the API also records it in the model
+  registry (``MODEL_REGISTRY_DIR``), whose watcher loads it in every other
+  worker. Without a registry, only the training worker serves the new model.
+
+A job whose worker died mid-run stays ``running`` in its file.
+"""
+import json
+import logging
+import multiprocessing
+import os
+import re
+import resource
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+
+from app.models.threat_detector import ThreatDetector
+from app.models.training_data import TrainingFile, load_matrix
+
+# Progress queue handed to pool workers through the executor initializer
+_progress_queue = None
+
+JOB_ID_PATTERN = re.compile(r'^[0-9a-f]{32}$')
+
+
+def _init_worker(progress_queue):
+    global _progress_queue
+    _progress_queue = progress_queue
+
+
+def _report_progress(job_id, stage, progress):
+    if _progress_queue is not None:
+        _progress_queue.put((job_id, stage, progress))
+
+
+def fit_detector(job_id, training_data, options=None):
+    """Build and train a brand new ThreatDetector (runs in a pool worker)
+
+    training_data is a JSON-style list or a TrainingFile. options may set
+    subsample (row count), subsample_method, max_samples and n_jobs.
+    """
+    options = options or {}
+    report = lambda stage, progress: _report_progress(job_id, stage, progress)  # noqa: E731
+    start = time.perf_counter()
+    detector = ThreatDetector()
+    try:
+        report('loading_data', 0.05)
+        if not isinstance(training_data, TrainingFile):
+            training_data = detector.extract_features(training_data)
+        X, total_rows = load_matrix(training_data, detector.feature_extractor,
+                                    subsample=options.get('subsample'),
+                                    method=options.get('subsample_method', 'reservoir'),
+                                    random_state=options.get('random_state'))
+        trained = detector.train(X, progress_callback=report,
+                                 max_samples=options.get('max_samples'),
+                                 n_jobs=options.get('n_jobs'))
+    finally:
+        if isinstance(training_data, TrainingFile):
+            training_data.cleanup()
+    if not trained:
+        raise RuntimeError('Training failed')
+    # ru_maxrss is the worker's lifetime peak, reported in KiB on Linux
+    peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+    detector.training_stats.update(total_rows=total_rows, wall_seconds=time.perf_counter() - start,
+                                   peak_rss_bytes=peak_rss)
+    return detector
+
+
+class TrainingJob:
+    """State of a single background training run"""
+
+    def __init__(self, job_id, n_samples):
+        self.job_id = job_id
+        self.n_samples = n_samples
+        self.status = 'queued'
+        self.stage = 'queued'
+        self.progress = 0.0
+        self.error = None
+        self.stats = None
+        self.created_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+
+    def to_dict(self):
+        return {
+            'job_id': self.job_id,
+            'status': self.status,
+            'stage': self.stage,
+            'progress': self.progress,
+            'n_samples': self.n_samples,
+            'error': self.error,
+            'stats': self.stats,
+            'created_at': self.created_at,
+            'started_at': self.started_at,
+            'finished_at': self.finished_at
+        }
+
+    @classmethod
+    def from_dict(cls, data):
+        job = cls(data['job_id'], data.get('n_samples'))
+        for field in ('status', 'stage', 'progress', 'error', 'stats', 'created_at', 'started_at',
+                      'finished_at'):
+            setattr(job, field, data.get(field))
+        return job
+
+
+class TrainingJobManager:
+    """Run training in a process pool and publish finished detectors"""
+
+    def __init__(self, on_complete, max_workers=1, max_jobs=100, state_dir=None, start_method=None):
+        self.on_complete = on_complete
+        self.max_workers = max_workers
+        self.max_jobs = max_jobs
+        self.state_dir = state_dir
+        if start_method is None:
+            available = multiprocessing.get_all_start_methods()
+            start_method = 'forkserver' if 'forkserver' in available else 'spawn'
+        self.start_method = start_method
+        self.jobs = OrderedDict()
+        self.logger = logging.getLogger(__name__)
+        self._executor = None
+        self._progress_queue = None
+        self._lock = threading.Lock()
+        self._progress_lock = threading.Lock()
+        if state_dir:
+            os.makedirs(state_dir, exist_ok=True)
+
+    def submit(self, training_data, options=None):
+        """Queue a training run and return its job"""
+        n_samples = None if isinstance(training_data, TrainingFile) else len(training_data)
+        job = TrainingJob(uuid.uuid4().hex, n_samples)
+        with self._lock:
+            executor = self._get_executor()
+            self.jobs[job.job_id] = job
+            while len(self.jobs) > self.max_jobs:
+                self.jobs.popitem(last=False)
+        self._save(job)
+        self._prune_saved()
+
+        future = executor.submit(fit_detector, job.job_id, training_data, options)
+        future.add_done_callback(lambda done: self._finish(job, done))
+        return job
+
+    def get(self, job_id):
+        """Look up a job; jobs started by another process are read from ``state_dir``"""
+        job = self.jobs.get(job_id)
+        if job is None:
+            job = self._load(job_id)
+        return job
+
+    def wait(self, job_id, timeout=None):
+        """Block until a job finishes or the timeout expires"""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        job = self.get(job_id)
+        while job is not None and job.status in ('queued', 'running'):
+            if deadline is not None and time.monotonic() >= deadline:
+                break
+            time.sleep(0.05)
+            job = self.get(job_id)
+        return job
+
+    def shutdown(self):
+        with self._lock:
+            if self._executor is not None:
+                self._executor.shutdown(wait=False, cancel_futures=True)
+                self._executor = None
+                self._progress_queue.put(None)
+
+    def _get_executor(self):
+        if self._executor is None:
+            context = multiprocessing.get_context(self.start_method)
+            self._progress_queue = context.Queue()
+            self._executor = ProcessPoolExecutor(
+                max_workers=self.max_workers,
+                mp_context=context,
+                initializer=_init_worker,
+                initargs=(self._progress_queue,)
+            )
+            threading.Thread(target=self._follow_progress, args=(self._progress_queue,),
+                             name='training-progress', daemon=True).start()
+        return self._executor
+
+    def _job_path(self, job_id):
+        return os.path.join(self.state_dir, f"{job_id}.json")
+
+    def _save(self, job):
+        """Write a job's state for other processes; replaced atomically"""
+        if not self.state_dir:
+            return
+        tmp_path = f"{self._job_path(job.job_id)}.tmp-{os.getpid()}-{threading.get_ident()}"
+        try:
+            with open(tmp_path, 'w') as handle:
+                json.dump(job.to_dict(), handle)
+            os.replace(tmp_path, self._job_path(job.job_id))
+        except OSError as e:
+            self.logger.error(f"Saving training job {job.job_id} failed: {e}")
+
+    def _load(self, job_id):
+        # job_id comes from the URL, so only well-formed ids become paths
+        if not self.state_dir or not JOB_ID_PATTERN.match(job_id):
+            return None
+        try:
+            with open(self._job_path(job_id)) as handle:
+                return TrainingJob.from_dict(json.load(handle))
+        except (OSError, ValueError, KeyError):
+            return None
+
+    def _prune_saved(self):
+        """Keep the files of the newest ``max_jobs`` jobs"""
+        if not self.state_dir:
+            return
+        try:
+            paths = [entry.path for entry in os.scandir(self.state_dir)
+                     if entry.name.endswith('.json')]
+            paths.sort(key=os.path.getmtime)
+            for path in paths[:max(len(paths) - self.max_jobs, 0)]:
+                os.remove(path)
+        except OSError as e:
+            self.logger.error(f"Pruning training job files failed: {e}")
+
+    def _follow_progress(self, progress_queue):
+        """Apply progress as the workers report it, so saved job states stay current"""
+        while True:
+            update = progress_queue.get()
+            if update is None:
+                return
+            job_id, stage, progress = update
+            with self._progress_lock:
+                job = self.jobs.get(job_id)
+                if job is None or job.status not in ('queued', 'running'):
+                    continue
+                if job.status == 'queued':
+                    job.status = 'running'
+                    job.started_at = time.time()
+                job.stage = stage
+                job.progress = progress
+                self._save(job)
+
+    def _finish(self, job, future):
+        with self._progress_lock:
+            job.finished_at = time.time()
+            try:
+                self._complete(job, future)
+            finally:
+                self._save(job)
+
+    def _complete(self, job, future):
+        if future.cancelled():
+            job.status, job.stage = 'cancelled', 'cancelled'
+            return
+
+        error = future.exception()
+        if error is not None:
+            self.logger.error(f"Training job {job.job_id} failed: {error}")
+            job.status, job.stage, job.error = 'failed', 'failed', str(error)
+            return
+
+        detector = future.result()
+        job.stats = detector.training_stats
+        job.n_samples = detector.training_stats['total_rows']
+        try:
+            self.on_complete(detector)
+        except Exception as e:
+            self.logger.error(f"Publishing model from job {job.job_id} failed: {e}")
+            job.status, job.stage, job.error = 'failed', 'failed', str(e)
+            return
+
+        job.status, job.stage, job.progress = 'completed', 'completed', 1.0
+        self.logger.info(f"Training job {job.job_id} completed")
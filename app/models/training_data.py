@@ -0,0 +1,236 @@
+"""Training data ingestion from binary files, with optional subsampling.
+
+``TrainingFile`` names a ``.npy`` matrix or an Arrow/Parquet table on disk:
+either an upload that was spooled to a temporary file or a server-side path
+under ``TRAINING_DATA_DIR``. Only the path crosses into the training worker,
+which opens the data there:
+
+* ``.npy`` files are memory-mapped, and shape and dtype are checked against
+  the header without reading the rows,
+* Arrow and Parquet tables are read batch by batch. Columns named like the
+  feature columns are used as they are, and raw flow fields go through the
+  FeatureExtractor.
+
+Subsampling runs over fixed-size chunks, so memory stays bounded by the
+sample size. ``reservoir`` keeps a uniform sample (Algorithm R).
+``stratified`` counts rows per value of one feature column in a first pass,
+then keeps a proportional reservoir per value, so rare protocols or ports
+keep their share.
+"""
+import os
+import tempfile
+
+import numpy as np
+import pandas as pd
+
+from app.models.incremental import ReservoirSample
+
+FORMATS = {'.npy': 'npy', '.parquet': 'parquet', '.arrow': 'arrow', '.feather': 'arrow'}
+CONTENT_TYPES = {
+    'application/x-npy': 'npy',
+    'application/octet-stream': 'npy',
+    'application/vnd.apache.parquet': 'parquet',
+    'application/x-parquet': 'parquet',
+    'application/vnd.apache.arrow.file': 'arrow'
+}
+SUBSAMPLE_METHODS = ('reservoir', 'stratified')
+CHUNK_ROWS = 1000000
+
+
+class TrainingFile:
+    """A training matrix on disk; ``delete`` removes it once training is done"""
+
+    def __init__(self, path, file_format=None, delete=False):
+        self.path = path
+        self.format = file_format or format_for_path(path)
+        self.delete = delete
+
+    def cleanup(self):
+        if self.delete:
+            try:
+                os.remove(self.path)
+            except OSError:
+                pass
+
+
+def format_for_path(path):
+    extension = os.path.splitext(path)[1].lower()
+    if extension not in FORMATS:
+        raise ValueError(f"Unsupported training file type '{extension}'; "
+                         f"expected one of {sorted(FORMATS)}")
+    return FORMATS[extension]
+
+
+def resolve_server_path(path, root):
+    """Absolute path of a server-side training file, which must lie under root"""
+    if not root:
+        raise PermissionError('Server-side training paths are disabled (set TRAINING_DATA_DIR)')
+    root = os.path.realpath(root)
+    resolved = os.path.realpath(os.path.join(root, path))
+    if os.path.commonpath([root, resolved]) != root:
+        raise PermissionError('Training path is outside TRAINING_DATA_DIR')
+    if not os.path.isfile(resolved):
+        raise FileNotFoundError(f"No training file at {path}")
+    return resolved
+
+
+class UploadTooLarge(ValueError):
+    """Raised when a training upload exceeds the configured size limit"""
+
+
+def spool_upload(stream, file_format, directory=None, block_size=1 << 20, max_bytes=None):
+    """Copy a request body to a temporary file in blocks and return a TrainingFile"""
+    suffix = {'npy': '.npy', 'parquet': '.parquet', 'arrow': '.arrow'}[file_format]
+    handle = tempfile.NamedTemporaryFile(prefix='training-', suffix=suffix, dir=directory,
+                                         delete=False)
+    written = 0
+    try:
+        with handle:
+            for block in iter(lambda: stream.read(block_size), b''):
+                written += len(block)
+                if max_bytes is not None and written > max_bytes:
+                    raise UploadTooLarge(f"Training upload exceeds {max_bytes} bytes")
+                handle.write(block)
+        if written == 0:
+            raise ValueError('Empty training upload')
+    except Exception:
+        os.remove(handle.name)
+        raise
+    return TrainingFile(handle.name, file_format, delete=True)
+
+
+def validate_matrix(X, n_features, check_finite=True):
+    """Check a feature matrix's shape and dtype (and values) without copying it"""
+    if X.ndim != 2 or X.shape[1] != n_features:
+        raise ValueError(f"Expected feature matrix with {n_features} columns, got shape {X.shape}")
+    if X.dtype.kind not in 'fiu':
+        raise ValueError(f"Training matrix must be numeric, got dtype {X.dtype}")
+    if check_finite and X.dtype.kind == 'f':
+        # Chunked so a memory-mapped matrix is never materialized whole
+        for start in range(0, len(X), CHUNK_ROWS):
+            if not np.isfinite(X[start:start + CHUNK_ROWS]).all():
+                raise ValueError('Training matrix contains NaN or infinite values')
+    return X
+
+
+def open_matrix(path):
+    """Memory-map a .npy matrix; the header gives shape and dtype"""
+    return np.load(path, mmap_mode='r', allow_pickle=False)
+
+
+def iter_feature_chunks(source, extractor, chunk_rows=CHUNK_ROWS):
+    """Yield feature matrices of at most chunk_rows rows from a TrainingFile or matrix"""
+    if isinstance(source, np.ndarray) or source.format == 'npy':
+        X = source if isinstance(source, np.ndarray) else open_matrix(source.path)
+        X = validate_matrix(X, extractor.n_features)
+        for start in range(0, len(X), chunk_rows):
+            yield X[start:start + chunk_rows]
+        return
+
+    for batch in _iter_record_batches(source, chunk_rows):
+        names = batch.schema.names
+        if all(column in names for column in extractor.columns):
+            chunk = np.column_stack([
+                batch.column(names.index(column)).to_numpy(zero_copy_only=False)
+                for column in extractor.columns
+            ])
+            yield validate_matrix(chunk, extractor.n_features)
+        else:
+            yield validate_matrix(extractor.transform(batch.to_pandas()), extractor.n_features)
+
+
+def _iter_record_batches(source, chunk_rows):
+    try:
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+    except ImportError as error:
+        raise ImportError('Arrow and Parquet training data require pyarrow') from error
+
+    if source.format == 'parquet':
+        yield from pq.ParquetFile(source.path).iter_batches(batch_size=chunk_rows)
+        return
+    with pa.memory_map(source.path) as mapped:
+        try:
+            reader = pa.ipc.open_file(mapped)
+            batches = (reader.get_batch(index) for index in range(reader.num_record_batches))
+        except pa.ArrowInvalid:
+            mapped.seek(0)
+            batches = pa.ipc.open_stream(mapped)
+        for batch in batches:
+            for start in range(0, batch.num_rows, chunk_rows):
+                yield batch.slice(start, chunk_rows)
+
+
+def load_matrix(source, extractor, subsample=None, method='reservoir',
+                stratify_column='protocol_type', random_state=None, chunk_rows=CHUNK_ROWS):
+    """Feature matrix for a TrainingFile (or in-memory matrix) and its total row count
+
+    Without subsampling a .npy file is returned memory-mapped; Arrow and
+    Parquet tables are converted to one float matrix.
+    """
+    if subsample is None:
+        if isinstance(source, np.ndarray) or source.format == 'npy':
+            X = source if isinstance(source, np.ndarray) else open_matrix(source.path)
+            X = validate_matrix(X, extractor.n_features)
+            return X, len(X)
+        chunks = list(iter_feature_chunks(source, extractor, chunk_rows))
+        X = np.concatenate(chunks) if chunks else np.empty((0, extractor.n_features))
+        return X, len(X)
+
+    if method not in SUBSAMPLE_METHODS:
+        raise ValueError(f"Unknown subsample method '{method}'; "
+                         f"expected one of {SUBSAMPLE_METHODS}")
+    if method == 'reservoir':
+        reservoir = ReservoirSample(subsample, extractor.n_features, random_state=random_state)
+        for chunk in iter_feature_chunks(source, extractor, chunk_rows):
+            reservoir.add(chunk, now=0)
+        return reservoir.sample(), reservoir.seen
+
+    column = extractor.columns.index(stratify_column)
+    counts = pd.Series(dtype=np.int64)
+    for chunk in iter_feature_chunks(source, extractor, chunk_rows):
+        counts = counts.add(pd.Series(chunk[:, column]).value_counts(), fill_value=0)
+    total = int(counts.sum())
+    quotas = stratified_quotas(counts, subsample)
+    rng = np.random.default_rng(random_state)
+    reservoirs = {value: ReservoirSample(int(quota), extractor.n_features,
+                                         random_state=rng.integers(2 ** 32))
+                  for value, quota in quotas.items() if quota > 0}
+    for chunk in iter_feature_chunks(source, extractor, chunk_rows):
+        values = chunk[:, column]
+        for value, reservoir in reservoirs.items():
+            reservoir.add(chunk[values == value], now=0)
+    samples = [reservoir.sample() for reservoir in reservoirs.values()]
+    X = np.concatenate(samples) if samples else np.empty((0, extractor.n_features))
+    return X, total
+
+
+def stratified_quotas(counts, subsample):
+    """Proportional rows per stratum adding up to ``subsample``, at least one for
+    every stratum present while there are no more strata than rows
+    """
+    counts = counts.astype(np.int64)
+    total = counts.sum()
+    if total <= subsample:
+        return counts
+    values = counts.to_numpy()
+    quotas = np.zeros(len(values), dtype=np.int64)
+    if len(values) >= subsample:
+        # Too many strata to keep them all: one row for each of the largest
+        quotas[np.argsort(-values, kind='stable')[:subsample]] = 1
+        return pd.Series(quotas, index=counts.index)
+
+    # Largest remainder rounding, so the quotas add up to subsample exactly
+    exact = values * subsample / total
+    quotas[:] = np.floor(exact)
+    short = subsample - quotas.sum()
+    quotas[np.argsort(-(exact - quotas), kind='stable')[:short]] += 1
+    # Rare strata get one row, taken back from the largest quotas
+    excess = int((quotas == 0).sum())
+    quotas[quotas == 0] = 1
+    while excess > 0:
+        spare = np.flatnonzero(quotas > 1)
+        take = spare[np.argsort(-quotas[spare], kind='stable')[:excess]]
+        quotas[take] -= 1
+        excess -= len(take)
+    return pd.Series(quotas, index=counts.index)
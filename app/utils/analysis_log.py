@@ -0,0 +1,164 @@
+"""Queue-backed structured logging of analysis results.
+
+Request threads only build a small dict and put it on a queue; a
+``QueueListener`` thread formats each event as one JSON line and writes it.
+Threats are always logged, except alerts the AlertSuppressor collapsed into an
+incident, which is logged once when it closes. Benign results are sampled at
+``benign_sample_rate`` because at production rates they are almost all of
+the volume and carry little information. Nothing is built at all when the
+``threat_detection.analysis`` logger is disabled for INFO.
+
+``start`` only attaches the handler. The listener thread starts on the first
+event in each process, because gunicorn's ``preload_app`` imports the app in
+the master and threads do not survive the fork into workers.
+"""
+import atexit
+import json
+import logging
+import os
+import queue
+import random
+import sys
+import threading
+from logging.handlers import QueueHandler, QueueListener
+
+LOGGER_NAME = 'threat_detection.analysis'
+
+
+class JSONLineFormatter(logging.Formatter):
+    """Render a record and its ``fields`` dict as a single JSON line"""
+
+    def format(self, record):
+        event = {'ts': round(record.created, 6), 'level': record.levelname,
+                 'event': record.getMessage()}
+        event.update(getattr(record, 'fields', {}))
+        return json.dumps(event, separators=(',', ':'), default=str)
+
+
+class _DropWhenFull(QueueHandler):
+    """Never block a request thread on a backed-up log writer"""
+
+    def __init__(self, log_queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+    def prepare(self, record):
+        # The listener formats; skip QueueHandler's eager message rendering
+        return record
+
+
+class _Listener(QueueListener):
+    def enqueue_sentinel(self):
+        # The listener thread is draining, so waiting for room is safe here
+        self.queue.put(self._sentinel)
+
+
+class AnalysisLogger:
+    """Asynchronous, sampled, structured logger for analysis results"""
+
+    def __init__(self, benign_sample_rate=0.01, max_queue=10000, stream=None, logger=None):
+        self.benign_sample_rate = benign_sample_rate
+        self.max_queue = max_queue
+        self.logger = logger or logging.getLogger(LOGGER_NAME)
+        self._queue = queue.Queue(max_queue)
+        self._handler = _DropWhenFull(self._queue)
+        self._output = logging.StreamHandler(stream or sys.stderr)
+        self._output.setFormatter(JSONLineFormatter())
+        self._listener = _Listener(self._queue, self._output, respect_handler_level=False)
+        self._started = False
+        self._pid = None
+        self._lock = threading.Lock()
+
+    @property
+    def dropped(self):
+        return self._handler.dropped
+
+    def start(self):
+        """Attach to the logger; the listener thread starts with the first event"""
+        with self._lock:
+            if not self._started:
+                self.logger.addHandler(self._handler)
+                self.logger.propagate = False
+                if self.logger.level == logging.NOTSET:
+                    self.logger.setLevel(logging.INFO)
+                self._started = True
+                atexit.register(self.stop)
+
+    def stop(self):
+        """Flush queued events and detach from the logger"""
+        with self._lock:
+            if self._started:
+                if self._pid == os.getpid():
+                    self._listener.stop()
+                self.logger.removeHandler(self._handler)
+                self._started = False
+                self._pid = None
+
+    def _ensure_listener(self):
+        # Started lazily and per process, since gunicorn forks after import
+        if self._pid == os.getpid() or not self._started:
+            return
+        with self._lock:
+            if self._pid == os.getpid() or not self._started:
+                return
+            if self._pid is not None:
+                # Forked from a process whose listener thread did not come along;
+                # its queue may hold events and locks that thread owned
+                self._queue = queue.Queue(self.max_queue)
+                self._handler.queue = self._queue
+                self._listener = _Listener(self._queue, self._output, respect_handler_level=False)
+            self._listener.start()
+            self._pid = os.getpid()
+
+    def log_result(self, record, result):
+        """Log one analysis, sampling benign results"""
+        if not self.logger.isEnabledFor(logging.INFO) or result.get('suppressed'):
+            return
+        if not result.get('is_threat') and random.random() >= self.benign_sample_rate:
+            return
+        self._ensure_listener()
+        self.logger.info('threat_analysis', extra={'fields': self._fields(record, result)})
+
+    def log_batch(self, kind, records, results):
+        """One summary event per batch plus an event for each threat"""
+        if not self.logger.isEnabledFor(logging.INFO):
+            return
+        self._ensure_listener()
+        threats = suppressed = 0
+        for record, result in zip(records, results):
+            if result.get('is_threat'):
+                threats += 1
+                if result.get('suppressed'):
+                    suppressed += 1
+                else:
+                    self.logger.info('threat_analysis',
+                                     extra={'fields': self._fields(record, result)})
+        fields = {'kind': kind, 'records': len(results), 'threats': threats,
+                  'suppressed': suppressed}
+        self.logger.info('batch_analysis', extra={'fields': fields})
+
+    def log_incident(self, incident):
+        """One event for a closed incident of collapsed alerts"""
+        if self.logger.isEnabledFor(logging.INFO):
+            self._ensure_listener()
+            self.logger.info('threat_incident', extra={'fields': incident})
+
+    @staticmethod
+    def _fields(record, result):
+        return {
+            'is_threat': result.get('is_threat'),
+            'threat_level': result.get('threat_level'),
+            'confidence': result.get('confidence'),
+            'source_ip': record.get('source_ip'),
+            'destination_ip': record.get('destination_ip'),
+            'port': record.get('port'),
+            'protocol': record.get('protocol'),
+            'matched_rules': result.get('matched_rules'),
+            'error': result.get('error')
+        }
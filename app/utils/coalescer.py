@@ -0,0 +1,118 @@
+"""Coalesce concurrent single-record requests into vectorized batches.
+
+Request threads call ``submit(record)`` and block. A flusher thread collects
+queued records and calls ``score_batch`` once per batch. It flushes when the
+batch reaches ``max_batch``, when ``max_delay`` has passed since the first
+record was taken, or as soon as every waiting caller is already in the batch.
+The last condition keeps an idle server from paying the deadline on each
+request. Under load, records queue up while a batch is being scored, so the
+next batch fills on its own.
+"""
+import logging
+import os
+import queue
+import threading
+import time
+
+from app.utils.metrics import COALESCER_BATCH_FILL, COALESCER_FLUSHES, COALESCER_WAIT
+
+
+class _Slot:
+    __slots__ = ('record', 'result', 'error', 'done', 'enqueued')
+
+    def __init__(self, record):
+        self.record = record
+        self.result = None
+        self.error = None
+        self.done = threading.Event()
+        self.enqueued = time.perf_counter()
+
+
+class RequestCoalescer:
+    """Batch concurrent submit() calls into score_batch(records) -> results"""
+
+    def __init__(self, score_batch, max_batch=64, max_delay=0.002, timeout=30.0):
+        self.score_batch = score_batch
+        self.max_batch = max_batch
+        self.max_delay = max_delay
+        self.timeout = timeout
+        self.logger = logging.getLogger(__name__)
+        self._waiting = 0
+        self._waiting_lock = threading.Lock()
+        self._start_lock = threading.Lock()
+        self._queue = None
+        self._flusher = None
+        self._pid = None
+
+    def submit(self, record):
+        """Score one record as part of the next batch and return its result"""
+        self._ensure_flusher()
+        slot = _Slot(record)
+        with self._waiting_lock:
+            self._waiting += 1
+        try:
+            self._queue.put(slot)
+            if not slot.done.wait(self.timeout):
+                raise TimeoutError('Timed out waiting for a coalesced batch')
+        finally:
+            with self._waiting_lock:
+                self._waiting -= 1
+        if slot.error is not None:
+            raise slot.error
+        return slot.result
+
+    def _ensure_flusher(self):
+        # Started lazily and per process, since gunicorn forks after import
+        if self._pid == os.getpid():
+            return
+        with self._start_lock:
+            if self._pid == os.getpid():
+                return
+            self._queue = queue.Queue()
+            self._flusher = threading.Thread(target=self._run, name='request-coalescer',
+                                             daemon=True)
+            self._pid = os.getpid()
+            self._flusher.start()
+
+    def _run(self):
+        while True:
+            batch, reason = self._collect()
+            self._flush(batch, reason)
+
+    def _collect(self):
+        batch = [self._queue.get()]
+        deadline = time.perf_counter() + self.max_delay
+        while len(batch) < self.max_batch:
+            try:
+                batch.append(self._queue.get_nowait())
+                continue
+            except queue.Empty:
+                pass
+            if len(batch) >= self._waiting:
+                return batch, 'idle'
+            remaining = deadline - time.perf_counter()
+            if remaining <= 0:
+                return batch, 'deadline'
+            try:
+                batch.append(self._queue.get(timeout=remaining))
+            except queue.Empty:
+                return batch, 'deadline'
+        return batch, 'size'
+
+    def _flush(self, batch, reason):
+        COALESCER_FLUSHES.labels(reason=reason).inc()
+        COALESCER_BATCH_FILL.observe(len(batch) / self.max_batch)
+        started = time.perf_counter()
+        for slot in batch:
+            COALESCER_WAIT.observe(started - slot.enqueued)
+        try:
+            results = self.score_batch([slot.record for slot in batch])
+            for slot, result in zip(batch, results):
+                slot.result = result
+        except Exception as e:
+            self.logger.error(f"Coalesced batch of {len(batch)} failed: {e}")
+            for slot in batch:
+                slot.error = e
+        finally:
+            for slot in batch:
+                slot.done.set()
@@ -0,0 +1,216 @@
+"""Compact flow records in a NumPy structured array.
+
+``process_network_log`` returns one dict per flow, holding a timestamp string and
+dotted-quad IP strings: several hundred bytes and a handful of objects for
+the GC to track per flow. ``normalize_flows`` fills one structured array for a
+whole batch instead:
+
+* timestamps are epoch seconds (float64),
+* IPv4 addresses are packed into uint32, and 0 (0.0.0.0) means missing.
+  Other address families also pack as 0, so flows with IPv6 endpoints
+  belong on the dict path,
+* protocols are ``PROTOCOL_CODES`` values (uint8, 0 for unknown), the same
+  codes the feature matrix uses,
+* durations are float32, which keeps about seven significant digits,
+* with ``aggregates=True`` there is room for the FlowAggregator window
+  statistics, which ``FlowAggregator.enrich`` fills in on a copy.
+
+A flow costs ``FLOW_DTYPE.itemsize`` bytes (31). FeatureExtractor, the rule
+engine, FlowAggregator and IP reputation lookups read the columns directly.
+``FlowRecord`` is a slotted, dict-like view of one row, for code that handles
+a single flow at a time.
+"""
+import socket
+import time
+
+import numpy as np
+import pandas as pd
+
+from app.models.features import AGGREGATE_COLUMNS, PROTOCOL_CODES
+from app.utils.ip_intel import parse_address
+
+FLOW_FIELDS = [
+    ('timestamp', np.float64),
+    ('source_ip', np.uint32),
+    ('destination_ip', np.uint32),
+    ('port', np.uint16),
+    ('protocol', np.uint8),
+    ('packet_size', np.uint32),
+    ('frequency', np.uint32),
+    ('duration', np.float32)
+]
+FLOW_DTYPE = np.dtype(FLOW_FIELDS)
+AGGREGATE_FLOW_DTYPE = np.dtype(FLOW_FIELDS + [(name, np.float32) for name in AGGREGATE_COLUMNS])
+
+IP_FIELDS = ('source_ip', 'destination_ip')
+PROTOCOL_NAMES = {code: name for name, code in PROTOCOL_CODES.items()}
+UNKNOWN_PROTOCOL = 'UNKNOWN'
+
+# (field, default, upper bound) for the numeric fields, as in process_network_log
+NUMERIC_DEFAULTS = [
+    ('port', 80, 65535),
+    ('packet_size', 0, np.iinfo(np.uint32).max),
+    ('frequency', 1, np.iinfo(np.uint32).max),
+    ('duration', 0.0, None)
+]
+
+
+def flow_dtype(aggregates=False):
+    return AGGREGATE_FLOW_DTYPE if aggregates else FLOW_DTYPE
+
+
+def is_flow_array(data):
+    return (isinstance(data, np.ndarray) and data.dtype.names is not None
+            and 'source_ip' in data.dtype.names)
+
+
+def pack_ipv4(addresses, strict=False):
+    """uint32 per IPv4 address string; missing, invalid and IPv6 addresses become 0
+
+    With ``strict``, returns None instead when any address other than a
+    missing one or 0.0.0.0 is not IPv4.
+    """
+    if isinstance(addresses, np.ndarray) and addresses.dtype.kind in 'ui':
+        return addresses.astype(np.uint32, copy=False)
+    # Flows repeat endpoints heavily, so parse each distinct string once
+    codes, uniques = pd.factorize(np.asarray(addresses, dtype=object))
+    table = np.zeros(len(uniques) + 1, dtype=np.uint32)
+    for index, address in enumerate(uniques):
+        parsed = parse_address(address)
+        if parsed is not None and parsed[0] == 4:
+            table[index] = parsed[1]
+        elif strict:
+            return None
+    # Missing values carry code -1, which indexes the trailing 0
+    return table[codes]
+
+
+def unpack_ipv4(packed, missing=None):
+    """Dotted-quad strings (object array) for packed addresses; 0 becomes ``missing``"""
+    codes, uniques = pd.factorize(np.asarray(packed))
+    table = np.empty(len(uniques), dtype=object)
+    table[:] = [socket.inet_ntoa(int(value).to_bytes(4, 'big')) if value else missing
+                for value in uniques]
+    return table[codes]
+
+
+def encode_protocols(protocols):
+    """PROTOCOL_CODES value per protocol name; unknown or missing names are 0"""
+    if not isinstance(protocols, np.ndarray):
+        protocols = np.asarray(protocols, dtype=object)
+    if protocols.dtype.kind in 'uif':
+        return np.clip(np.nan_to_num(protocols), 0, 255).astype(np.uint8)
+    codes, uniques = pd.factorize(protocols)
+    table = np.array([PROTOCOL_CODES.get(str(value).strip().upper(), 0) for value in uniques] + [0],
+                     dtype=np.uint8)
+    return table[codes]
+
+
+def epoch_seconds(timestamps, now=None):
+    """Epoch seconds from epoch numbers or ISO-8601 strings; missing or bad values get ``now``"""
+    # A batch usually shares few distinct timestamps, so convert each once
+    codes, uniques = pd.factorize(np.asarray(timestamps, dtype=object))
+    uniques = pd.Series(uniques, dtype=object)
+    seconds = pd.to_numeric(uniques, errors='coerce')
+    text = seconds.isna()
+    if text.any():
+        # Naive timestamps are UTC, as in the threat history
+        parsed = pd.to_datetime(uniques[text].astype(str), utc=True, errors='coerce')
+        seconds[text] = (parsed - pd.Timestamp(0, tz='UTC')).dt.total_seconds()
+    fallback = time.time() if now is None else now
+    table = np.append(seconds.fillna(fallback).to_numpy(dtype=np.float64), fallback)
+    # Missing values carry code -1, which indexes the fallback
+    return table[codes]
+
+
+def normalize_flows(records, aggregates=False, now=None, ipv4_only=False):
+    """Fill a flow array from parsed records: a list of dicts, a DataFrame or a dict of columns
+
+    Fields are converted column by column with the same defaults as
+    ``process_network_log``. Unparseable numbers fall back to the default
+    and out-of-range ones are clipped, so one bad record does not sink the
+    batch. With ``ipv4_only``, returns None when an endpoint address is
+    IPv6 or unparseable, so that callers can keep the dicts instead.
+    """
+    if isinstance(records, (pd.DataFrame, dict)):
+        if isinstance(records, pd.DataFrame):
+            n_rows = len(records)
+        else:
+            n_rows = len(next(iter(records.values()), ()))
+
+        def column(field):
+            return records[field] if field in records else None
+    else:
+        n_rows = len(records)
+
+        def column(field):
+            return [record.get(field) for record in records]
+
+    flows = np.zeros(n_rows, dtype=flow_dtype(aggregates))
+    if n_rows == 0:
+        return flows
+
+    for field in IP_FIELDS:
+        addresses = column(field)
+        if addresses is not None:
+            packed = pack_ipv4(addresses, strict=ipv4_only)
+            if packed is None:
+                return None
+            flows[field] = packed
+    timestamps = column('timestamp')
+    flows['timestamp'] = epoch_seconds([None] * n_rows if timestamps is None else timestamps, now)
+    protocols = column('protocol')
+    if protocols is not None:
+        flows['protocol'] = encode_protocols(protocols)
+    for field, default, upper in NUMERIC_DEFAULTS:
+        values = column(field)
+        if values is None:
+            flows[field] = default
+            continue
+        values = pd.to_numeric(pd.Series(values, copy=False), errors='coerce')
+        values = values.fillna(default).to_numpy()
+        flows[field] = np.clip(values, 0, upper) if upper is not None else values
+    return flows
+
+
+class FlowRecord:
+    """Dict-like view of one flow array row; IPs and protocol decode on access"""
+
+    __slots__ = ('_row',)
+
+    def __init__(self, flows, index):
+        # Indexing a structured array yields a view, so no fields are copied
+        self._row = flows[index]
+
+    def __getitem__(self, field):
+        value = self._row[field]
+        if field in IP_FIELDS:
+            return socket.inet_ntoa(int(value).to_bytes(4, 'big')) if value else None
+        if field == 'protocol':
+            return PROTOCOL_NAMES.get(int(value), UNKNOWN_PROTOCOL)
+        return value.item()
+
+    def get(self, field, default=None):
+        if field not in self._row.dtype.names:
+            return default
+        value = self[field]
+        return default if value is None else value
+
+    def __contains__(self, field):
+        return field in self._row.dtype.names
+
+    def keys(self):
+        return self._row.dtype.names
+
+    def to_dict(self):
+        return {field: self[field] for field in self.keys()}
+
+    def __repr__(self):
+        return f"FlowRecord({self.to_dict()})"
+
+
+def as_records(records):
+    """Iterate records one at a time, as FlowRecord views when given a flow array"""
+    if is_flow_array(records):
+        return (FlowRecord(records, index) for index in range(len(records)))
+    return records
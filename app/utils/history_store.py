@@ -0,0 +1,275 @@
+"""Append-only threat history backed by SQLite in WAL mode.
+
+Detections are handed to ``record()``, which only enqueues them; a background
+writer thread drains the queue and commits in batches, so the scoring path
+never waits on disk. Readers use their own per-thread connections and WAL
+lets them run alongside the writer. Rows older than the retention window are
+deleted in bounded batches by the writer thread.
+"""
+import logging
+import os
+import queue
+import sqlite3
+import threading
+import time
+from datetime import datetime, timezone
+
+SCHEMA = [
+    """CREATE TABLE IF NOT EXISTS detections (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        timestamp REAL NOT NULL,
+        threat_level TEXT NOT NULL,
+        source_ip TEXT,
+        destination_ip TEXT,
+        destination_port INTEGER,
+        protocol TEXT,
+        confidence REAL,
+        action_taken TEXT
+    )""",
+    "CREATE INDEX IF NOT EXISTS idx_detections_timestamp ON detections (timestamp)",
+    "CREATE INDEX IF NOT EXISTS idx_detections_level ON detections (threat_level, timestamp)",
+    "CREATE INDEX IF NOT EXISTS idx_detections_source ON detections (source_ip, timestamp)",
+    "CREATE INDEX IF NOT EXISTS idx_detections_port ON detections (destination_port, timestamp)"
+]
+
+COLUMNS = ['id', 'timestamp', 'threat_level', 'source_ip', 'destination_ip',
+           'destination_port', 'protocol', 'confidence', 'action_taken']
+
+ACTIONS = {'high': 'blocked', 'medium': 'investigating', 'low': 'monitored'}
+
+
+def to_epoch(value):
+    """Parse an epoch number or ISO-8601 string into epoch seconds"""
+    if value is None or value == '':
+        return None
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        pass
+    parsed = datetime.fromisoformat(str(value).replace('Z', '+00:00'))
+    if parsed.tzinfo is None:
+        parsed = parsed.replace(tzinfo=timezone.utc)
+    return parsed.timestamp()
+
+
+def to_iso(epoch):
+    return datetime.fromtimestamp(epoch, tz=timezone.utc).isoformat().replace('+00:00', 'Z')
+
+
+class HistoryStore:
+    """Threat history with a non-blocking buffered writer"""
+
+    def __init__(self, path, retention_days=30.0, queue_size=100000, batch_size=1000,
+                 flush_interval=0.5, retention_interval=3600.0):
+        self.path = path
+        self.retention_seconds = retention_days * 86400 if retention_days else None
+        self.queue_size = queue_size
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.retention_interval = retention_interval
+        self.dropped = 0
+        self.written = 0
+        self.logger = logging.getLogger(__name__)
+        self._local = threading.local()
+        self._start_lock = threading.Lock()
+        self._pid = None
+        self._queue = None
+        self._writer = None
+        self._stopping = False
+
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        connection = self._connect()
+        with connection:
+            for statement in SCHEMA:
+                connection.execute(statement)
+        connection.close()
+
+    def record(self, entries):
+        """Queue detections for persistence without blocking; returns how many were accepted"""
+        self._ensure_writer()
+        now = time.time()
+        accepted = 0
+        for entry in entries:
+            level = entry.get('threat_level', 'low')
+            row = (
+                entry.get('timestamp', now),
+                level,
+                entry.get('source_ip'),
+                entry.get('destination_ip'),
+                entry.get('destination_port'),
+                entry.get('protocol'),
+                entry.get('confidence'),
+                entry.get('action_taken') or ACTIONS.get(level, 'monitored')
+            )
+            try:
+                self._queue.put_nowait(row)
+                accepted += 1
+            except queue.Full:
+                self.dropped += 1
+        return accepted
+
+    def query(self, start=None, end=None, threat_level=None, source_ip=None,
+              destination_port=None, cursor=None, limit=100):
+        """Newest-first page of detections and the cursor for the next page"""
+        where, params = self._filters(start, end, threat_level, source_ip, destination_port)
+        if cursor is not None:
+            where.append('id < ?')
+            params.append(int(cursor))
+        sql = f"SELECT {', '.join(COLUMNS)} FROM detections"
+        if where:
+            sql += ' WHERE ' + ' AND '.join(where)
+        sql += ' ORDER BY id DESC LIMIT ?'
+        params.append(int(limit) + 1)
+
+        rows = self._connection().execute(sql, params).fetchall()
+        has_more = len(rows) > limit
+        rows = rows[:limit]
+        threats = []
+        for row in rows:
+            threat = dict(zip(COLUMNS, row))
+            threat['timestamp'] = to_iso(threat['timestamp'])
+            threats.append(threat)
+        next_cursor = rows[-1][0] if has_more and rows else None
+        return threats, next_cursor
+
+    def counts(self, start=None, end=None, threat_level=None, source_ip=None,
+               destination_port=None):
+        """Detection counts by threat level for the same filters as query()"""
+        where, params = self._filters(start, end, threat_level, source_ip, destination_port)
+        sql = 'SELECT threat_level, COUNT(*) FROM detections'
+        if where:
+            sql += ' WHERE ' + ' AND '.join(where)
+        sql += ' GROUP BY threat_level'
+        return dict(self._connection().execute(sql, params).fetchall())
+
+    def flush(self, timeout=5.0):
+        """Wait until everything queued so far has been written"""
+        if self._queue is None:
+            return True
+        deadline = time.monotonic() + timeout
+        while self._queue.unfinished_tasks and time.monotonic() < deadline:
+            time.sleep(0.01)
+        return not self._queue.unfinished_tasks
+
+    def apply_retention(self, now=None, batch=10000):
+        """Delete detections older than the retention window in bounded batches"""
+        if not self.retention_seconds:
+            return 0
+        cutoff = (now or time.time()) - self.retention_seconds
+        connection = self._connection()
+        deleted = 0
+        while True:
+            with connection:
+                cursor = connection.execute(
+                    'DELETE FROM detections WHERE id IN '
+                    '(SELECT id FROM detections WHERE timestamp < ? LIMIT ?)',
+                    (cutoff, batch)
+                )
+            deleted += cursor.rowcount
+            if cursor.rowcount < batch:
+                break
+        if deleted:
+            connection.execute('PRAGMA incremental_vacuum')
+            connection.execute('PRAGMA wal_checkpoint(TRUNCATE)')
+            self.logger.info(f"Expired {deleted} threat history records")
+        return deleted
+
+    def stats(self):
+        return {
+            'queued': self._queue.qsize() if self._queue else 0,
+            'written': self.written,
+            'dropped': self.dropped
+        }
+
+    def close(self):
+        self._stopping = True
+        if self._writer is not None and self._pid == os.getpid():
+            self._writer.join(timeout=5)
+
+    def _filters(self, start, end, threat_level, source_ip, destination_port):
+        where, params = [], []
+        if start is not None:
+            where.append('timestamp >= ?')
+            params.append(float(start))
+        if end is not None:
+            where.append('timestamp < ?')
+            params.append(float(end))
+        if threat_level:
+            where.append('threat_level = ?')
+            params.append(threat_level)
+        if source_ip:
+            where.append('source_ip = ?')
+            params.append(source_ip)
+        if destination_port is not None:
+            where.append('destination_port = ?')
+            params.append(int(destination_port))
+        return where, params
+
+    def _connect(self):
+        connection = sqlite3.connect(self.path, timeout=30, check_same_thread=False)
+        connection.execute('PRAGMA journal_mode=WAL')
+        connection.execute('PRAGMA synchronous=NORMAL')
+        connection.execute('PRAGMA auto_vacuum=INCREMENTAL')
+        return connection
+
+    def _connection(self):
+        # Connections are per thread and per process (workers fork after import)
+        connection = getattr(self._local, 'connection', None)
+        if connection is None or self._local.pid != os.getpid():
+            connection = self._local.connection = self._connect()
+            self._local.pid = os.getpid()
+        return connection
+
+    def _ensure_writer(self):
+        if self._pid == os.getpid() and self._writer is not None:
+            return
+        with self._start_lock:
+            if self._pid == os.getpid() and self._writer is not None:
+                return
+            self._queue = queue.Queue(maxsize=self.queue_size)
+            self._writer = threading.Thread(target=self._write_loop, name='history-writer',
+                                            daemon=True)
+            self._pid = os.getpid()
+            self._writer.start()
+
+    def _write_loop(self):
+        next_retention = time.monotonic()
+        while not self._stopping:
+            rows = self._next_batch()
+            if rows:
+                try:
+                    connection = self._connection()
+                    with connection:
+                        connection.executemany(
+                            'INSERT INTO detections (timestamp, threat_level, source_ip, '
+                            'destination_ip, destination_port, protocol, confidence, action_taken) '
+                            'VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+                            rows
+                        )
+                    self.written += len(rows)
+                except sqlite3.Error as e:
+                    self.dropped += len(rows)
+                    self.logger.error(f"Threat history write failed: {e}")
+                finally:
+                    for _ in rows:
+                        self._queue.task_done()
+
+            if time.monotonic() >= next_retention:
+                next_retention = time.monotonic() + self.retention_interval
+                try:
+                    self.apply_retention()
+                except sqlite3.Error as e:
+                    self.logger.error(f"Threat history retention failed: {e}")
+
+    def _next_batch(self):
+        try:
+            rows = [self._queue.get(timeout=self.flush_interval)]
+        except queue.Empty:
+            return []
+        while len(rows) < self.batch_size:
+            try:
+                rows.append(self._queue.get_nowait())
+            except queue.Empty:
+                break
+        return rows
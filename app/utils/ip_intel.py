@@ -0,0 +1,238 @@
+"""IP intelligence: longest-prefix-match over large CIDR lists.
+
+A list of prefixes (which may nest and overlap) is flattened once into
+disjoint address intervals, each tagged with the most specific prefix that
+covers it. A lookup is then a single binary search per address, so a batch
+is answered with one ``np.searchsorted`` call per address family no matter
+how many prefixes are loaded. IPv4 keys are uint64; IPv6 keys are Python
+ints in object arrays, which stay correct across the full 128-bit range.
+
+List files hold one CIDR (or bare address) per line, optionally followed by a
+label, with ``#`` comments::
+
+    203.0.113.0/24   scanner
+    2001:db8::/32    botnet
+"""
+import ipaddress
+import logging
+import os
+import socket
+import threading
+
+import numpy as np
+
+# Reputation encoding used for feature columns: allowlist wins over blocklist
+UNKNOWN, ALLOWLISTED, BLOCKLISTED = 0, -1, 1
+REPUTATION_NAMES = {'allowlisted': ALLOWLISTED, 'blocklisted': BLOCKLISTED}
+NETWORK_TYPES = (ipaddress.IPv4Network, ipaddress.IPv6Network)
+
+
+def parse_address(address):
+    """(version, integer) for an address string, or None when it is not a valid IP"""
+    if isinstance(address, bytes):
+        address = address.decode()
+    if not isinstance(address, str):
+        return None
+    try:
+        return 4, int.from_bytes(socket.inet_pton(socket.AF_INET, address), 'big')
+    except OSError:
+        pass
+    try:
+        return 6, int.from_bytes(socket.inet_pton(socket.AF_INET6, address), 'big')
+    except (OSError, ValueError):
+        return None
+
+
+def split_addresses(addresses):
+    """Split address strings by family into (row indexes, integer values) pairs"""
+    if isinstance(addresses, np.ndarray) and addresses.dtype.kind in 'ui':
+        # Packed IPv4 addresses (see app.utils.flow_records); 0 marks a missing one
+        index = np.flatnonzero(addresses)
+        return ((index, addresses[index].astype(np.uint64)),
+                (np.empty(0, dtype=np.int64), np.empty(0, dtype=object)))
+    v4_index, v4_values, v6_index, v6_values = [], [], [], []
+    cache = {}
+    for index, address in enumerate(addresses):
+        # Flows repeat endpoints heavily, so parse each distinct string once
+        parsed = cache.get(address, False) if isinstance(address, str) else False
+        if parsed is False:
+            parsed = parse_address(address)
+            if isinstance(address, str):
+                cache[address] = parsed
+        if parsed is None:
+            continue
+        if parsed[0] == 4:
+            v4_index.append(index)
+            v4_values.append(parsed[1])
+        else:
+            v6_index.append(index)
+            v6_values.append(parsed[1])
+    return ((np.array(v4_index, dtype=np.int64), np.array(v4_values, dtype=np.uint64)),
+            (np.array(v6_index, dtype=np.int64), np.array(v6_values, dtype=object)))
+
+
+def read_prefixes(path):
+    """(network, label) pairs from a list file; invalid lines are logged and skipped"""
+    logger = logging.getLogger(__name__)
+    prefixes = []
+    with open(path) as handle:
+        for number, line in enumerate(handle, 1):
+            line = line.split('#', 1)[0].strip()
+            if not line:
+                continue
+            parts = line.split(None, 1)
+            try:
+                network = ipaddress.ip_network(parts[0], strict=False)
+            except ValueError:
+                logger.warning(f"{path}:{number}: skipping invalid prefix '{parts[0]}'")
+                continue
+            prefixes.append((network, parts[1].strip() if len(parts) > 1 else None))
+    return prefixes
+
+
+class PrefixTable:
+    """Longest-prefix-match lookups over IPv4 and IPv6 CIDR blocks"""
+
+    def __init__(self, prefixes=()):
+        """prefixes: CIDR strings/networks or (cidr, label) pairs"""
+        self.networks = []
+        self.labels = []
+        by_version = {4: [], 6: []}
+        for entry in prefixes:
+            cidr, label = entry if isinstance(entry, tuple) else (entry, None)
+            if isinstance(cidr, NETWORK_TYPES):
+                network = cidr
+            else:
+                network = ipaddress.ip_network(cidr, strict=False)
+            # Avoid network.broadcast_address, which dominates load time on big lists
+            start = int(network.network_address)
+            end = start | ((1 << (network.max_prefixlen - network.prefixlen)) - 1)
+            by_version[network.version].append((start, end, len(self.networks)))
+            self.networks.append(network)
+            self.labels.append(label)
+
+        self._v4 = self._flatten(by_version[4], np.uint64)
+        self._v6 = self._flatten(by_version[6], object)
+
+    @classmethod
+    def from_file(cls, path):
+        return cls(read_prefixes(path))
+
+    def __len__(self):
+        return len(self.networks)
+
+    @staticmethod
+    def _flatten(intervals, dtype):
+        """Disjoint (starts, prefix index) segments; -1 marks addresses outside every prefix"""
+        starts, owners = [], []
+
+        def begin(position, owner):
+            if starts and starts[-1] == position:
+                owners[-1] = owner
+            elif not owners or owners[-1] != owner:
+                starts.append(position)
+                owners.append(owner)
+
+        # Parents sort before the prefixes nested inside them, so a stack of
+        # open prefixes always has the most specific one on top
+        stack = []
+        for start, end, owner in sorted(intervals, key=lambda item: (item[0], -item[1])):
+            while stack and stack[-1][0] < start:
+                closed_end, _ = stack.pop()
+                begin(closed_end + 1, stack[-1][1] if stack else -1)
+            stack.append((end, owner))
+            begin(start, owner)
+        while stack:
+            closed_end, _ = stack.pop()
+            begin(closed_end + 1, stack[-1][1] if stack else -1)
+
+        return np.array(starts, dtype=dtype), np.array(owners, dtype=np.int64)
+
+    def lookup(self, addresses):
+        """Index into ``networks`` of the longest matching prefix per address, -1 for none"""
+        result = np.full(len(addresses), -1, dtype=np.int64)
+        if not self.networks:
+            return result
+        tables = (self._v4, self._v6)
+        for (index, values), (starts, owners) in zip(split_addresses(addresses), tables):
+            if len(index) and len(starts):
+                position = np.searchsorted(starts, values, side='right') - 1
+                found = position >= 0
+                result[index[found]] = owners[position[found]]
+        return result
+
+    def contains(self, addresses):
+        """Boolean mask of which addresses fall inside any prefix"""
+        return self.lookup(addresses) >= 0
+
+    def match(self, address):
+        """(network, label) of the longest prefix containing address, or None"""
+        owner = self.lookup([address])[0]
+        if owner < 0:
+            return None
+        return self.networks[owner], self.labels[owner]
+
+
+class IPReputation:
+    """Blocklist/allowlist membership for flow endpoints"""
+
+    def __init__(self, blocklist=None, allowlist=None, paths=None):
+        self.blocklist = blocklist or PrefixTable()
+        self.allowlist = allowlist or PrefixTable()
+        self.paths = paths
+
+    @classmethod
+    def from_files(cls, blocklist_paths=(), allowlist_paths=()):
+        return cls(_load_lists(blocklist_paths), _load_lists(allowlist_paths),
+                   paths=(tuple(blocklist_paths), tuple(allowlist_paths)))
+
+    def __reduce__(self):
+        # Rebuild from the list files in the receiving process instead of
+        # pickling the interval arrays
+        if self.paths is None:
+            return IPReputation, (self.blocklist, self.allowlist)
+        return get_ip_reputation, self.paths
+
+    @property
+    def enabled(self):
+        return bool(len(self.blocklist) or len(self.allowlist))
+
+    def reputation(self, addresses):
+        """UNKNOWN, ALLOWLISTED or BLOCKLISTED per address; allowlist entries win"""
+        result = np.full(len(addresses), UNKNOWN, dtype=np.int8)
+        if len(self.blocklist):
+            result[self.blocklist.contains(addresses)] = BLOCKLISTED
+        if len(self.allowlist):
+            result[self.allowlist.contains(addresses)] = ALLOWLISTED
+        return result
+
+
+def _load_lists(paths):
+    return PrefixTable([prefix for path in paths for prefix in read_prefixes(path)])
+
+
+def _split_paths(value):
+    return tuple(path.strip() for path in (value or '').split(',') if path.strip())
+
+
+_reputations = {}
+_reputations_lock = threading.Lock()
+
+
+def get_ip_reputation(blocklist_paths=None, allowlist_paths=None):
+    """Shared reputation lists per set of files, so each worker loads them once"""
+    if blocklist_paths is None:
+        blocklist_paths = _split_paths(os.getenv('IP_BLOCKLIST_PATHS'))
+    if allowlist_paths is None:
+        allowlist_paths = _split_paths(os.getenv('IP_ALLOWLIST_PATHS'))
+    key = (tuple(blocklist_paths), tuple(allowlist_paths))
+    with _reputations_lock:
+        reputation = _reputations.get(key)
+        if reputation is None:
+            try:
+                reputation = IPReputation.from_files(*key)
+            except OSError as e:
+                logging.getLogger(__name__).error(f"Cannot load IP reputation lists: {e}")
+                reputation = IPReputation(paths=key)
+            _reputations[key] = reputation
+        return reputation
@@ -0,0 +1,159 @@
+"""Prometheus metrics for the threat detection service.
+
+When PROMETHEUS_MULTIPROC_DIR is set (as it is under gunicorn) every worker
+writes its samples to mmap files in that directory and /metrics aggregates
+them, so scrapes see the whole server rather than whichever worker answered.
+"""
+import os
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from prometheus_client import (CONTENT_TYPE_LATEST, CollectorRegistry, Counter, Gauge,
+                               Histogram, generate_latest)
+from prometheus_client import multiprocess
+
+LATENCY_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01,
+                   0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+BATCH_SIZE_BUCKETS = (1, 2, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000)
+MODEL_DURATION_BUCKETS = (0.01, 0.05, 0.1, 0.5, 1.0, 5.0, 10.0, 30.0, 60.0, 300.0, 900.0)
+
+REQUEST_COUNT = Counter(
+    'threat_api_requests',
+    'HTTP requests by route, method and status code',
+    ['route', 'method', 'status']
+)
+REQUEST_LATENCY = Histogram(
+    'threat_api_request_duration_seconds',
+    'HTTP request latency by route',
+    ['route'],
+    buckets=LATENCY_BUCKETS
+)
+REQUESTS_IN_PROGRESS = Gauge(
+    'threat_api_requests_in_progress',
+    'HTTP requests currently being served',
+    multiprocess_mode='livesum'
+)
+STAGE_LATENCY = Histogram(
+    'threat_detector_stage_duration_seconds',
+    'Latency of each threat detection stage',
+    ['stage'],
+    buckets=LATENCY_BUCKETS
+)
+BATCH_SIZE = Histogram(
+    'threat_detector_batch_size',
+    'Number of records scored per detector call',
+    buckets=BATCH_SIZE_BUCKETS
+)
+THREATS_DETECTED = Counter(
+    'threats_detected',
+    'Flows flagged as threats by threat level',
+    ['level']
+)
+PREDICTION_CACHE_EVENTS = Counter(
+    'threat_prediction_cache_events',
+    'Prediction cache lookups and evictions by event (hit, miss, eviction)',
+    ['event']
+)
+COALESCER_BATCH_FILL = Histogram(
+    'threat_coalescer_batch_fill_ratio',
+    'Coalesced /analyze batch size as a fraction of the maximum batch size',
+    buckets=(0.01, 0.05, 0.1, 0.25, 0.5, 0.75, 0.9, 1.0)
+)
+COALESCER_FLUSHES = Counter(
+    'threat_coalescer_flushes',
+    'Coalesced batches flushed, by trigger (size, deadline, idle)',
+    ['reason']
+)
+COALESCER_WAIT = Histogram(
+    'threat_coalescer_wait_seconds',
+    'Time a coalesced request waits before its batch is scored',
+    buckets=LATENCY_BUCKETS
+)
+MODEL_TRAIN_DURATION = Histogram(
+    'threat_model_train_duration_seconds',
+    'Wall time of model training runs',
+    buckets=MODEL_DURATION_BUCKETS
+)
+MODEL_LOAD_DURATION = Histogram(
+    'threat_model_load_duration_seconds',
+    'Wall time of model loads from disk',
+    buckets=MODEL_DURATION_BUCKETS
+)
+
+SHADOW_COMPARISONS = Counter(
+    'threat_shadow_comparisons',
+    'Shadow-scored records by outcome (agree, disagree, dropped, error)',
+    ['outcome']
+)
+SHADOW_LATENCY = Histogram(
+    'threat_shadow_batch_duration_seconds',
+    'Scoring time of the shadow candidate per sampled batch',
+    buckets=LATENCY_BUCKETS
+)
+ALERT_EVENTS = Counter(
+    'threat_alerts',
+    'Threat alerts after per-source suppression, by outcome (emitted, suppressed, short_circuit)',
+    ['outcome']
+)
+
+# A list while the current request is being profiled (see app.utils.profiling)
+request_spans = ContextVar('request_spans', default=None)
+
+
+@contextmanager
+def stage_timer(stage):
+    """Observe the wall time of a detection stage"""
+    spans = request_spans.get()
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - start
+        STAGE_LATENCY.labels(stage=stage).observe(elapsed)
+        if spans is not None:
+            spans.append((stage, elapsed))
+
+
+def record_results(results):
+    """Count flagged results by threat level"""
+    counts = {}
+    for result in results:
+        if result.get('is_threat'):
+            level = result.get('threat_level', 'unknown')
+            counts[level] = counts.get(level, 0) + 1
+    for level, count in counts.items():
+        THREATS_DETECTED.labels(level=level).inc(count)
+
+
+def init_app(app):
+    """Register request instrumentation hooks on a Flask app"""
+    from flask import g, request
+
+    @app.before_request
+    def _start_request_timer():
+        g.metrics_start = time.perf_counter()
+        REQUESTS_IN_PROGRESS.inc()
+
+    @app.after_request
+    def _record_request(response):
+        start = g.pop('metrics_start', None)
+        if start is not None:
+            route = request.url_rule.rule if request.url_rule else 'unmatched'
+            REQUEST_LATENCY.labels(route=route).observe(time.perf_counter() - start)
+            REQUEST_COUNT.labels(route=route, method=request.method,
+                                 status=str(response.status_code)).inc()
+        return response
+
+    @app.teardown_request
+    def _finish_request(exc):
+        REQUESTS_IN_PROGRESS.dec()
+
+
+def generate_metrics():
+    """Render the exposition payload and its content type"""
+    if os.getenv('PROMETHEUS_MULTIPROC_DIR'):
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+        return generate_latest(registry), CONTENT_TYPE_LATEST
+    return generate_latest(), CONTENT_TYPE_LATEST
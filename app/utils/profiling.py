@@ -0,0 +1,331 @@
+"""On-demand request profiling for the Flask app.
+
+A ``ProfileSession`` is started from the admin API and runs until its
+duration passes or it has profiled N requests. Each request is profiled with
+probability ``sample_rate`` in one of two modes:
+
+* ``cprofile``: a ``cProfile.Profile`` wraps the request and results are
+  merged into one ``pstats.Stats``,
+* ``sampling``: a background thread reads the stacks of the threads serving
+  sampled requests every ``interval`` seconds and counts them as collapsed
+  stacks, which costs the request threads nothing.
+
+In both modes every ``stage_timer`` span of a sampled request (parse,
+validate, feature_extraction, scaling, scoring, serialization, ...) is
+recorded. When a session ends it writes to its output directory:
+
+* ``profile.prof`` and ``profile.txt`` (cprofile mode),
+* ``stacks.folded`` (sampling mode),
+* ``spans.folded`` with request;stage lines weighted in microseconds,
+* ``summary.json`` with per-stage span statistics.
+
+The ``.folded`` files feed flamegraph.pl or speedscope directly. While no
+session is running the request hooks return after one attribute read and
+``stage_timer`` adds one context variable lookup. Spans of records scored on
+the coalescer's flush thread are not attributed to a request.
+
+Sessions live in the worker process that received the admin request, and
+the other workers neither profile nor know about them. A GET or DELETE
+routed to a different worker reports no session. Profile with a single
+worker (``GUNICORN_WORKERS=1``, or the Flask development server) so that
+every admin call and every profiled request reach the same process. Each
+summary carries the ``pid`` of the worker that ran it.
+"""
+import cProfile
+import io
+import json
+import logging
+import os
+import pstats
+import random
+import sys
+import threading
+import time
+import uuid
+from collections import Counter, defaultdict
+
+import numpy as np
+
+from app.utils.metrics import request_spans
+
+MODES = ('cprofile', 'sampling')
+
+
+class ProfileSession:
+    """One profiling run: its limits, what it collected, and where it is written"""
+
+    def __init__(self, mode='sampling', duration=30.0, max_requests=None, sample_rate=1.0,
+                 interval=0.005, output_dir='data/profiles'):
+        if mode not in MODES:
+            raise ValueError(f"mode must be one of {', '.join(MODES)}")
+        if not 0 < sample_rate <= 1:
+            raise ValueError('sample_rate must be in (0, 1]')
+        if duration is None and max_requests is None:
+            raise ValueError('Give a duration, a request count or both')
+        self.session_id = time.strftime('%Y%m%dT%H%M%S') + '-' + uuid.uuid4().hex[:6]
+        self.pid = os.getpid()
+        self.mode = mode
+        self.duration = duration
+        self.max_requests = max_requests
+        self.sample_rate = sample_rate
+        self.interval = interval
+        self.output_path = os.path.join(output_dir, self.session_id)
+        self.started_at = time.time()
+        self.deadline = None if duration is None else time.monotonic() + duration
+        self.profiled = 0
+        self.stopped_reason = None
+        self.files = []
+        self._stats = None
+        self._stacks = Counter()
+        self._spans = defaultdict(list)
+        self._span_stacks = Counter()
+        self._threads = set()
+        self._lock = threading.Lock()
+        self._done = threading.Event()
+        self._written = threading.Event()
+        self._sampler = None
+
+    @property
+    def active(self):
+        return not self._done.is_set()
+
+    def start(self):
+        if self.mode == 'sampling':
+            self._sampler = threading.Thread(target=self._sample_stacks, name='profile-sampler',
+                                             daemon=True)
+            self._sampler.start()
+        return self
+
+    def expired(self):
+        if self.deadline is not None and time.monotonic() >= self.deadline:
+            return 'duration'
+        if self.max_requests is not None and self.profiled >= self.max_requests:
+            return 'requests'
+        return None
+
+    def begin_request(self):
+        """Start profiling the current request if it is sampled; returns a token or None"""
+        if self.sample_rate < 1 and random.random() >= self.sample_rate:
+            return None
+        with self._lock:
+            if self._done.is_set() or self.expired():
+                return None
+            self.profiled += 1
+        spans = []
+        span_token = request_spans.set(spans)
+        profiler = None
+        if self.mode == 'cprofile':
+            profiler = cProfile.Profile()
+            profiler.enable()
+        else:
+            with self._lock:
+                self._threads.add(threading.get_ident())
+        return profiler, spans, span_token, time.perf_counter()
+
+    def end_request(self, token, route):
+        profiler, spans, span_token, start = token
+        elapsed = time.perf_counter() - start
+        if profiler is not None:
+            profiler.disable()
+        request_spans.reset(span_token)
+        with self._lock:
+            self._threads.discard(threading.get_ident())
+            if profiler is not None:
+                if self._stats is None:
+                    self._stats = pstats.Stats(profiler)
+                else:
+                    self._stats.add(profiler)
+            self._spans['request'].append(elapsed)
+            accounted = 0.0
+            for stage, seconds in spans:
+                self._spans[stage].append(seconds)
+                self._span_stacks[f"{route};{stage}"] += int(seconds * 1e6)
+                accounted += seconds
+            self._span_stacks[f"{route};other"] += int(max(elapsed - accounted, 0) * 1e6)
+
+    def stop(self, reason='stopped'):
+        """End the session and write its files; safe to call more than once"""
+        with self._lock:
+            if self._done.is_set():
+                return self.files
+            self._done.set()
+            self.stopped_reason = reason
+        if self._sampler is not None:
+            self._sampler.join()
+        try:
+            self.files = self._write()
+        finally:
+            self._written.set()
+        return self.files
+
+    def wait(self, timeout=None):
+        """Block until the session's files are written; False on timeout"""
+        return self._written.wait(timeout)
+
+    def summary(self):
+        with self._lock:
+            stages = {
+                stage: {
+                    'count': len(values),
+                    'total_ms': float(np.sum(values) * 1000),
+                    'mean_ms': float(np.mean(values) * 1000),
+                    'p50_ms': float(np.percentile(values, 50) * 1000),
+                    'p95_ms': float(np.percentile(values, 95) * 1000),
+                    'max_ms': float(np.max(values) * 1000)
+                }
+                for stage, values in self._spans.items() if values
+            }
+            return {
+                'session_id': self.session_id,
+                'pid': self.pid,
+                'mode': self.mode,
+                'active': self.active,
+                'started_at': self.started_at,
+                'duration': self.duration,
+                'max_requests': self.max_requests,
+                'sample_rate': self.sample_rate,
+                'profiled_requests': self.profiled,
+                'stack_samples': sum(self._stacks.values()),
+                'stopped_reason': self.stopped_reason,
+                'output_path': self.output_path,
+                'files': self.files,
+                'stages': stages
+            }
+
+    def _sample_stacks(self):
+        own = threading.get_ident()
+        while not self._done.wait(self.interval):
+            with self._lock:
+                threads = set(self._threads)
+            if not threads:
+                continue
+            frames = sys._current_frames()
+            for ident in threads:
+                frame = frames.get(ident)
+                if frame is None or ident == own:
+                    continue
+                names = []
+                while frame is not None:
+                    code = frame.f_code
+                    filename = os.path.basename(code.co_filename)
+                    names.append(f"{code.co_name} ({filename}:{code.co_firstlineno})")
+                    frame = frame.f_back
+                key = ';'.join(reversed(names))
+                with self._lock:
+                    self._stacks[key] += 1
+
+    def _write(self):
+        os.makedirs(self.output_path, exist_ok=True)
+        files = []
+
+        def path(name):
+            files.append(os.path.join(self.output_path, name))
+            return files[-1]
+
+        if self._stats is not None:
+            self._stats.dump_stats(path('profile.prof'))
+            text = io.StringIO()
+            self._stats.stream = text
+            self._stats.sort_stats('cumulative').print_stats(50)
+            with open(path('profile.txt'), 'w') as handle:
+                handle.write(text.getvalue())
+        if self._stacks:
+            _write_folded(path('stacks.folded'), self._stacks)
+        if self._span_stacks:
+            _write_folded(path('spans.folded'), self._span_stacks)
+        summary_path = path('summary.json')
+        summary = self.summary()
+        with open(summary_path, 'w') as handle:
+            json.dump(summary, handle, indent=2)
+        return files
+
+
+def _write_folded(path, counts):
+    with open(path, 'w') as handle:
+        for stack, count in counts.most_common():
+            if count > 0:
+                handle.write(f"{stack} {count}\n")
+
+
+class RequestProfiler:
+    """Holds the current ProfileSession and hooks it into Flask requests.
+
+    One per worker process; see the module docstring for multi-worker servers.
+    """
+
+    def __init__(self, output_dir='data/profiles', exclude_prefixes=('/api/admin/',)):
+        self.output_dir = output_dir
+        self.exclude_prefixes = exclude_prefixes
+        self.session = None
+        self.last_session = None
+        self._lock = threading.Lock()
+        self.logger = logging.getLogger(__name__)
+
+    def start(self, **options):
+        with self._lock:
+            if self.session is not None and self.session.active:
+                raise RuntimeError(f"Profiling session {self.session.session_id} "
+                                   "is already running")
+            options.setdefault('output_dir', self.output_dir)
+            session = ProfileSession(**options).start()
+            self.session = session
+        if session.duration is not None:
+            # Ends an idle session too, not only one that sees a request after its deadline
+            timer = threading.Timer(session.duration, self._stop_logged, args=('duration', session))
+            timer.daemon = True
+            timer.start()
+        self.logger.info(f"Profiling session {session.session_id} started ({session.mode})")
+        return session
+
+    def stop(self, reason='stopped', session=None):
+        """Stop the running session (or only ``session``), returning it; None if not running"""
+        with self._lock:
+            if self.session is None or (session is not None and session is not self.session):
+                return None
+            session, self.session = self.session, None
+            self.last_session = session
+        session.stop(reason)
+        self.logger.info(f"Profiling session {session.session_id} written to {session.output_path}")
+        return session
+
+    def init_app(self, app):
+        from flask import g, request
+
+        @app.before_request
+        def _begin_profile():
+            session = self.session
+            if session is None or request.path.startswith(self.exclude_prefixes):
+                return
+            reason = session.expired()
+            if reason is not None:
+                self._finish_in_background(reason, session)
+                return
+            token = session.begin_request()
+            if token is not None:
+                g.profile = (session, token)
+
+        @app.teardown_request
+        def _end_profile(exc):
+            profile = g.pop('profile', None)
+            if profile is None:
+                return
+            session, token = profile
+            route = request.url_rule.rule if request.url_rule else 'unmatched'
+            session.end_request(token, route)
+            reason = session.expired()
+            if reason is not None:
+                self._finish_in_background(reason, session)
+
+    def _finish_in_background(self, reason, session):
+        """Write files off the request path when a limit is reached"""
+        threading.Thread(target=self._stop_logged, args=(reason, session), name='profile-writer',
+                         daemon=True).start()
+
+    def _stop_logged(self, reason, session):
+        try:
+            self.stop(reason, session)
+        except Exception as e:
+            self.logger.error(f"Writing profiling session {session.session_id} failed: {e}")
+
+
+profiler = RequestProfiler(os.getenv('PROFILE_OUTPUT_DIR', 'data/profiles'))
@@ -0,0 +1,63 @@
+"""Response encoding for the hot paths.
+
+``encode_response`` picks the body encoding from the request's ``Accept``
+header: MessagePack for ``application/msgpack`` (or ``application/x-msgpack``)
+when the ``msgpack`` package is installed, JSON otherwise. JSON goes through
+``orjson`` when it is installed and compact ``json.dumps`` when it is not;
+either way it skips ``jsonify``'s pretty-printing and key sorting.
+"""
+import json
+
+import numpy as np
+from flask import Response
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+JSON_MIMETYPE = 'application/json'
+MSGPACK_MIMETYPES = ('application/msgpack', 'application/x-msgpack')
+
+
+def _default(value):
+    """Encode the numpy scalars and arrays that can leak into results"""
+    if isinstance(value, np.generic):
+        return value.item()
+    if isinstance(value, np.ndarray):
+        return value.tolist()
+    raise TypeError(f"Object of type {type(value).__name__} is not serializable")
+
+
+if orjson is not None:
+    def dumps_json(payload):
+        return orjson.dumps(payload, default=_default, option=orjson.OPT_SERIALIZE_NUMPY)
+else:
+    def dumps_json(payload):
+        return json.dumps(payload, separators=(',', ':'), default=_default).encode()
+
+
+def dumps_msgpack(payload):
+    return msgpack.packb(payload, default=_default, use_bin_type=True)
+
+
+def response_mimetype(request):
+    """Best supported encoding the client accepts, defaulting to JSON"""
+    if msgpack is not None:
+        best = request.accept_mimetypes.best_match((JSON_MIMETYPE,) + MSGPACK_MIMETYPES,
+                                                   default=JSON_MIMETYPE)
+        if best in MSGPACK_MIMETYPES:
+            return best
+    return JSON_MIMETYPE
+
+
+def encode_response(payload, request, status=200):
+    """Serialize payload in the encoding negotiated with the request"""
+    mimetype = response_mimetype(request)
+    body = dumps_json(payload) if mimetype == JSON_MIMETYPE else dumps_msgpack(payload)
+    return Response(body, status=status, mimetype=mimetype)
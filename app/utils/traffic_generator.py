@@ -0,0 +1,207 @@
+"""Bulk synthetic network traffic with labelled attack scenarios.
+
+``TrafficGenerator`` draws whole columns at once from its own
+``np.random.Generator``, so millions of flows take seconds and separate
+generators never share RNG state. Background flows follow the distribution
+of ``NetworkDataProcessor.generate_sample_data``. Attacks are injected as
+contiguous bursts, each burst sharing one attacker or victim so per-source
+aggregation sees it the way it would see the real thing:
+
+* ``port_scan``: one source walks consecutive ports on one target with
+  small, short-lived TCP probes,
+* ``syn_flood``: spoofed sources hammer one victim port with minimal
+  packets at very high frequency,
+* ``exfiltration``: an internal host sends exfiltration-sized transfers to an
+  external address over long connections.
+
+Each scenario has a rate (expected fraction of rows) and a burst length.
+``iter_chunks`` streams fixed-size DataFrames for datasets larger than
+memory; ``write_npy`` and ``write_parquet`` spill them to disk chunk by chunk.
+"""
+import os
+
+import numpy as np
+import pandas as pd
+
+from app.models.features import FeatureExtractor
+
+PROTOCOLS = np.array(['TCP', 'UDP', 'HTTP', 'HTTPS', 'ICMP'], dtype=object)
+PORTS = np.array([80, 443, 22, 23, 53, 135, 139, 445, 1433, 3389])
+COLUMNS = ['timestamp', 'source_ip', 'destination_ip', 'port', 'protocol', 'packet_size',
+           'frequency', 'duration', 'label']
+
+# Label codes as written to .npy label files; 0 is background traffic
+LABELS = ['normal', 'port_scan', 'syn_flood', 'exfiltration']
+LABEL_CODES = {name: code for code, name in enumerate(LABELS)}
+
+DEFAULT_ATTACK_RATES = {'port_scan': 0.01, 'syn_flood': 0.01, 'exfiltration': 0.002}
+DEFAULT_BURST_LENGTHS = {'port_scan': 200, 'syn_flood': 500, 'exfiltration': 5}
+
+_INTERNAL_BASE = 192 << 24 | 168 << 16   # 192.168.0.0/16
+_SERVER_BASE = 10 << 24                  # 10.0.0.0/16
+_EXTERNAL_BASE = 198 << 24 | 51 << 16    # 198.51.0.0/16
+
+
+# Octet strings for building dotted quads by object-array concatenation
+_OCTETS = np.array([str(value) for value in range(256)], dtype=object)
+_LEADING_OCTETS = np.array([f"{value}." for value in range(256)], dtype=object)
+
+
+def ip_strings(addresses):
+    """Dotted-quad strings for an array of IPv4 addresses held as integers"""
+    addresses = np.asarray(addresses, dtype=np.uint32)
+    return (_LEADING_OCTETS[addresses >> 24] + _LEADING_OCTETS[(addresses >> 16) & 0xFF] +
+            _LEADING_OCTETS[(addresses >> 8) & 0xFF] + _OCTETS[addresses & 0xFF])
+
+
+class TrafficGenerator:
+    """Vectorized flow generator with attack injection and chunked output"""
+
+    def __init__(self, seed=None, attack_rates=None, burst_lengths=None, flows_per_second=1000.0,
+                 start_time=0.0):
+        self.attack_rates = dict(DEFAULT_ATTACK_RATES if attack_rates is None else attack_rates)
+        self.burst_lengths = {**DEFAULT_BURST_LENGTHS, **(burst_lengths or {})}
+        unknown = set(self.attack_rates) - set(LABELS[1:])
+        if unknown:
+            raise ValueError(f"Unknown attack scenarios: {sorted(unknown)}")
+        if sum(self.attack_rates.values()) >= 1:
+            raise ValueError('Attack rates must sum to less than 1')
+        self.rng = np.random.default_rng(seed)
+        self.flows_per_second = float(flows_per_second)
+        self.clock = float(start_time)
+
+    def generate(self, num_rows):
+        """One DataFrame of ``num_rows`` flows with a ``label`` column"""
+        columns = self._background(num_rows)
+        labels = np.zeros(num_rows, dtype=np.int8)
+        for name, rate in self.attack_rates.items():
+            if rate > 0:
+                self._inject(name, rate, columns, labels)
+        frame = pd.DataFrame({
+            'timestamp': columns['timestamp'],
+            'source_ip': ip_strings(columns['source_ip']),
+            'destination_ip': ip_strings(columns['destination_ip']),
+            'port': columns['port'],
+            'protocol': PROTOCOLS[columns['protocol']],
+            'packet_size': columns['packet_size'],
+            'frequency': columns['frequency'],
+            'duration': columns['duration'],
+            'label': pd.Categorical.from_codes(labels, LABELS)
+        })
+        return frame
+
+    def iter_chunks(self, num_rows, chunk_size=1000000):
+        """Yield DataFrames of at most ``chunk_size`` rows until ``num_rows`` are produced"""
+        for start in range(0, num_rows, chunk_size):
+            yield self.generate(min(chunk_size, num_rows - start))
+
+    def write_npy(self, path, num_rows, chunk_size=1000000, labels_path=None):
+        """Stream a feature matrix to ``path`` and label codes to ``labels_path``
+
+        The matrix uses the FeatureExtractor column layout, so it can be fed
+        straight to training. Labels default to ``<path stem>.labels.npy``.
+        """
+        extractor = FeatureExtractor()
+        labels_path = labels_path or f"{os.path.splitext(path)[0]}.labels.npy"
+        matrix = np.lib.format.open_memmap(path, mode='w+', dtype=np.float64,
+                                           shape=(num_rows, extractor.n_features))
+        labels = np.lib.format.open_memmap(labels_path, mode='w+', dtype=np.int8, shape=(num_rows,))
+        offset = 0
+        for chunk in self.iter_chunks(num_rows, chunk_size):
+            end = offset + len(chunk)
+            matrix[offset:end] = extractor.transform(chunk)
+            labels[offset:end] = chunk['label'].cat.codes.to_numpy()
+            offset = end
+        matrix.flush()
+        labels.flush()
+        return path, labels_path
+
+    def write_parquet(self, path, num_rows, chunk_size=1000000):
+        """Stream flows with labels to a Parquet file, one row group per chunk"""
+        try:
+            import pyarrow as pa
+            import pyarrow.parquet as pq
+        except ImportError as error:
+            raise ImportError('Parquet output requires pyarrow') from error
+
+        writer = None
+        try:
+            for chunk in self.iter_chunks(num_rows, chunk_size):
+                table = pa.Table.from_pandas(chunk, preserve_index=False)
+                if writer is None:
+                    writer = pq.ParquetWriter(path, table.schema)
+                writer.write_table(table)
+        finally:
+            if writer is not None:
+                writer.close()
+        return path
+
+    def _background(self, num_rows):
+        rng = self.rng
+        gaps = rng.exponential(1.0 / self.flows_per_second, num_rows)
+        timestamps = self.clock + np.cumsum(gaps)
+        if num_rows:
+            self.clock = float(timestamps[-1])
+        return {
+            'timestamp': timestamps,
+            'source_ip': (_INTERNAL_BASE + rng.integers(1, 255, num_rows) * 256
+                          + rng.integers(1, 255, num_rows)),
+            'destination_ip': (_SERVER_BASE + rng.integers(1, 255, num_rows) * 256
+                               + rng.integers(1, 255, num_rows)),
+            'port': rng.choice(PORTS, num_rows),
+            'protocol': rng.integers(0, len(PROTOCOLS), num_rows),
+            'packet_size': np.maximum(rng.normal(512, 200, num_rows), 0).astype(np.int64),
+            'frequency': rng.poisson(10, num_rows),
+            'duration': rng.exponential(0.5, num_rows)
+        }
+
+    def _inject(self, name, rate, columns, labels):
+        """Overwrite bursts of rows in place with one attack scenario"""
+        rng = self.rng
+        num_rows = len(labels)
+        length = min(self.burst_lengths[name], num_rows)
+        if length <= 0:
+            return
+        bursts = rng.poisson(num_rows * rate / length)
+        if bursts == 0:
+            return
+        starts = rng.integers(0, num_rows - length + 1, bursts)
+        rows = (starts[:, None] + np.arange(length)).ravel()
+        # Burst-level attributes, repeated over each burst's rows
+        burst = np.repeat(np.arange(bursts), length)
+        size = len(rows)
+        tcp = 0
+
+        if name == 'port_scan':
+            attackers = _EXTERNAL_BASE + rng.integers(1, 2 ** 16, bursts)
+            targets = _SERVER_BASE + rng.integers(1, 2 ** 16, bursts)
+            first_ports = rng.integers(1, 65536 - length, bursts)
+            columns['source_ip'][rows] = attackers[burst]
+            columns['destination_ip'][rows] = targets[burst]
+            columns['port'][rows] = first_ports[burst] + np.tile(np.arange(length), bursts)
+            columns['protocol'][rows] = tcp
+            columns['packet_size'][rows] = rng.integers(40, 65, size)
+            columns['frequency'][rows] = rng.poisson(50, size)
+            columns['duration'][rows] = rng.exponential(0.005, size)
+        elif name == 'syn_flood':
+            victims = _SERVER_BASE + rng.integers(1, 2 ** 16, bursts)
+            victim_ports = rng.choice([80, 443], bursts)
+            columns['source_ip'][rows] = rng.integers(1 << 24, 224 << 24, size)
+            columns['destination_ip'][rows] = victims[burst]
+            columns['port'][rows] = victim_ports[burst]
+            columns['protocol'][rows] = tcp
+            columns['packet_size'][rows] = rng.integers(40, 61, size)
+            columns['frequency'][rows] = rng.poisson(1000, size)
+            columns['duration'][rows] = rng.exponential(0.001, size)
+        elif name == 'exfiltration':
+            sources = _INTERNAL_BASE + rng.integers(1, 2 ** 16, bursts)
+            sinks = _EXTERNAL_BASE + rng.integers(1, 2 ** 16, bursts)
+            sink_ports = rng.choice([443, 53, 22], bursts)
+            columns['source_ip'][rows] = sources[burst]
+            columns['destination_ip'][rows] = sinks[burst]
+            columns['port'][rows] = sink_ports[burst]
+            columns['protocol'][rows] = np.where(sink_ports[burst] == 53, 1, tcp)
+            columns['packet_size'][rows] = rng.lognormal(np.log(50000), 0.5, size).astype(np.int64)
+            columns['frequency'][rows] = rng.poisson(2, size)
+            columns['duration'][rows] = rng.exponential(120, size)
+        labels[rows] = LABEL_CODES[name]
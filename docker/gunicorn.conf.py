@@ -0,0 +1,29 @@
+import multiprocessing
+import os
+
+bind = '0.0.0.0:5000'
+# Set GUNICORN_WORKERS=1 while using /api/admin/profile: profiling sessions are per worker
+workers = int(os.getenv('GUNICORN_WORKERS', multiprocessing.cpu_count()))
+threads = int(os.getenv('GUNICORN_THREADS', '4'))
+timeout = 120
+
+# Load the app (and MODEL_PATH) once in the master so workers share the
+# memory-mapped model pages instead of each loading a private copy
+preload_app = True
+
+
+def on_starting(server):
+    """Clear metric files left behind by a previous server run"""
+    metrics_dir = os.getenv('PROMETHEUS_MULTIPROC_DIR')
+    if metrics_dir:
+        os.makedirs(metrics_dir, exist_ok=True)
+        for name in os.listdir(metrics_dir):
+            if name.endswith('.db'):
+                os.remove(os.path.join(metrics_dir, name))
+
+
+def child_exit(server, worker):
+    """Drop a dead worker's live gauges from the multiprocess metrics files"""
+    if os.getenv('PROMETHEUS_MULTIPROC_DIR'):
+        from prometheus_client import multiprocess
+        multiprocess.mark_process_dead(worker.pid)
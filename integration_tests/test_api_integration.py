@@ -53,8 +53,7 @@ class TestAPIIntegration(unittest.TestCase):
         response = requests.get(f'{base_url}/metrics')
         
         self.assertEqual(response.status_code, 200)
-        data = response.json()
-        self.assertIn('requests_total', data)
+        self.assertIn('threat_api_requests_total', response.text)
 
 if __name__ == '__main__':
     unittest.main()
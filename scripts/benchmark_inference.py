@@ -0,0 +1,77 @@
+#!/usr/bin/env python
+"""Latency benchmark: compiled flat-array scorer vs scikit-learn.
+
+Usage: python scripts/benchmark_inference.py [--train-rows 10000] [--iterations 2000]
+"""
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.models.compiled_forest import CompiledForest  # noqa: E402
+from app.models.threat_detector import ThreatDetector  # noqa: E402
+
+
+def make_features(num_rows, seed=42):
+    rng = np.random.default_rng(seed)
+    return np.column_stack([
+        rng.normal(512, 200, num_rows),
+        rng.poisson(10, num_rows),
+        rng.choice([80, 443, 22, 53, 3389], num_rows),
+        rng.choice([1, 2, 3, 4, 5], num_rows),
+        rng.exponential(0.5, num_rows)
+    ])
+
+
+def latency_percentiles(func, rows, iterations):
+    timings = np.empty(iterations)
+    for index in range(iterations):
+        row = rows[index % len(rows)].reshape(1, -1)
+        start = time.perf_counter()
+        func(row)
+        timings[index] = time.perf_counter() - start
+    return np.percentile(timings, 50) * 1e6, np.percentile(timings, 99) * 1e6
+
+
+def run(train_rows, iterations, batch_size):
+    detector = ThreatDetector(compiled=False)
+    detector.train(make_features(train_rows))
+    engine = CompiledForest.compile(detector.scaler, detector.model)
+    probe = make_features(max(iterations, batch_size), seed=7)
+
+    scorers = [
+        ('sklearn', lambda X: detector.model.decision_function(detector.scaler.transform(X))),
+        ('compiled', engine.decision_function),
+    ]
+
+    max_error = np.abs(scorers[0][1](probe[:batch_size]) - scorers[1][1](probe[:batch_size])).max()
+    print(f"max |score difference| over {batch_size} rows: {max_error:.2e}")
+    print(f"{'scorer':<10}{'p50 us':>12}{'p99 us':>12}{f'batch {batch_size} rows/s':>22}")
+
+    results = {}
+    for name, func in scorers:
+        func(probe[:1])  # warm up
+        p50, p99 = latency_percentiles(func, probe, iterations)
+        start = time.perf_counter()
+        func(probe[:batch_size])
+        throughput = batch_size / (time.perf_counter() - start)
+        results[name] = {'p50_us': p50, 'p99_us': p99, 'batch_rows_per_sec': throughput}
+        print(f"{name:<10}{p50:>12.1f}{p99:>12.1f}{throughput:>22,.0f}")
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--train-rows', type=int, default=10000)
+    parser.add_argument('--iterations', type=int, default=2000)
+    parser.add_argument('--batch-size', type=int, default=10000)
+    args = parser.parse_args()
+    run(args.train_rows, args.iterations, args.batch_size)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,342 @@
+#!/usr/bin/env python
+"""Performance benchmark suite for the threat detection service.
+
+Measures single-record latency (trained and rule modes), batch scoring
+throughput, training time, model save/load time and size, and end-to-end
+request throughput through the Flask test client. Results are written as
+JSON; with --baseline, the gated metrics are compared against a stored run
+and regressions beyond --tolerance are reported (exit status 2).
+
+Only metrics that repeat within a few percent between runs on one machine
+are gated: medians, best-of-N throughput and timings, and artifact sizes.
+Tail percentiles and millisecond save/load timings are recorded but never
+fail a run.
+
+Absolute timings only compare on like hardware, so every run first times a
+fixed reference workload (interpreter-bound loops plus NumPy array work),
+and timings and rates are also stored relative to it as ``normalized``.
+The comparison uses those, which lets a baseline recorded on one machine
+gate runs on a faster or slower CI agent. Training runs single-threaded so
+that the core count does not enter. The comparison is skipped only when the
+Python minor version, library versions or architecture differ, since those
+change the work itself.
+
+Usage:
+    python scripts/benchmark_suite.py --output benchmark-results.json
+    python scripts/benchmark_suite.py --quick --baseline benchmarks/baseline.json
+"""
+import argparse
+import json
+import logging
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# Keep the API benchmark from writing threat history
+os.environ.pop('HISTORY_DB_PATH', None)
+
+from app.models.threat_detector import ThreatDetector  # noqa: E402
+
+PROTOCOLS = np.array(['TCP', 'UDP', 'HTTP', 'HTTPS', 'ICMP'])
+PORTS = np.array([80, 443, 22, 53, 3389, 8080])
+
+
+def make_features(num_rows, seed=42):
+    rng = np.random.default_rng(seed)
+    return np.column_stack([
+        rng.normal(512, 200, num_rows),
+        rng.poisson(10, num_rows),
+        rng.choice(PORTS, num_rows),
+        rng.integers(1, 6, num_rows),
+        rng.exponential(0.5, num_rows)
+    ])
+
+
+def make_records(num_rows, seed=7):
+    rng = np.random.default_rng(seed)
+    return [
+        {
+            'source_ip': f"192.168.{a}.{b}",
+            'destination_ip': '10.0.0.1',
+            'packet_size': float(size),
+            'frequency': int(frequency),
+            'port': int(port),
+            'protocol': str(protocol),
+            'duration': float(duration)
+        }
+        for a, b, size, frequency, port, protocol, duration in zip(
+            rng.integers(1, 255, num_rows), rng.integers(1, 255, num_rows),
+            rng.normal(512, 200, num_rows), rng.poisson(10, num_rows),
+            rng.choice(PORTS, num_rows), rng.choice(PROTOCOLS, num_rows),
+            rng.exponential(0.5, num_rows))
+    ]
+
+
+def percentiles(timings):
+    timings = np.asarray(timings) * 1e6
+    return {f'p{q}_us': float(np.percentile(timings, q)) for q in (50, 95, 99)}
+
+
+def reference_workload(values):
+    """Fixed mix of interpreter-bound and NumPy work that timings are normalized by"""
+    counts = {}
+    for index in range(200000):
+        key = index % 97
+        counts[key] = counts.get(key, 0) + 1
+    np.sort(values)
+    np.percentile(values, 99)
+    return float((values * 2.5 + 1.0).sum())
+
+
+# Units of timings (normalized as value / reference) and of rates (value * reference)
+TIME_UNITS = ('us', 's')
+RATE_UNITS = ('rows/s', 'req/s')
+
+
+class Suite:
+    def __init__(self, iterations, batch_sizes, train_sizes, api_requests, repeats=3):
+        self.iterations = iterations
+        self.repeats = repeats
+        self.batch_sizes = batch_sizes
+        self.train_sizes = train_sizes
+        self.api_requests = api_requests
+        self.metrics = {}
+        self.reference = None
+
+    def record(self, name, value, unit, better, gate=True):
+        metric = {'value': float(value), 'unit': unit, 'better': better, 'gate': gate}
+        if unit in TIME_UNITS:
+            metric['normalized'] = float(value) / self.reference
+        elif unit in RATE_UNITS:
+            metric['normalized'] = float(value) * self.reference
+        self.metrics[name] = metric
+        print(f"  {name:<44}{value:>16,.2f} {unit}")
+
+    def best_time(self, func, repeats=None):
+        """Fastest of several runs; the minimum is the least noisy estimate"""
+        timings = []
+        for _ in range(repeats or self.repeats):
+            start = time.perf_counter()
+            func()
+            timings.append(time.perf_counter() - start)
+        return min(timings)
+
+    def run(self):
+        values = np.random.default_rng(0).random(1000000)
+        self.reference = self.best_time(lambda: reference_workload(values), repeats=5)
+        print(f"reference workload: {self.reference * 1000:,.2f} ms")
+
+        # The prediction cache would turn repeated benchmark rows into hits
+        trained = ThreatDetector(cache=False)
+        trained.train(make_features(10000))
+        rules_only = ThreatDetector(cache=False)
+        records = make_records(max(self.iterations, max(self.batch_sizes)))
+
+        print('single-record latency')
+        for mode, detector in (('trained', trained), ('rules', rules_only)):
+            detector.predict_threat(records[0])
+            timings = []
+            for record in records[:self.iterations]:
+                start = time.perf_counter()
+                detector.predict_threat(record)
+                timings.append(time.perf_counter() - start)
+            for name, value in percentiles(timings).items():
+                # Tail percentiles swing with scheduler noise, so only the median gates
+                self.record(f'predict_threat.{mode}.{name}', value, 'us', 'lower',
+                            gate=name == 'p50_us')
+
+        print('batch throughput')
+        for size in self.batch_sizes:
+            batch = records[:size]
+            trained.predict_batch(batch)
+            calls = max(1, 2000 // size)
+            elapsed = self.best_time(lambda: [trained.predict_batch(batch) for _ in range(calls)])
+            self.record(f'predict_batch.{size}.rows_per_sec', size * calls / elapsed,
+                        'rows/s', 'higher')
+
+        print('training')
+        for size in self.train_sizes:
+            data = make_features(size, seed=size)
+            # Sub-second fits need more repeats for a stable best time
+            repeats = 1 if size >= 1000000 else self.repeats if size >= 100000 else 5
+            elapsed = self.best_time(lambda: ThreatDetector(cache=False).train(data, n_jobs=1),
+                                     repeats=repeats)
+            self.record(f'train.{size}.seconds', elapsed, 's', 'lower', gate=repeats > 1)
+
+        print('persistence')
+        self.run_persistence(trained)
+
+        print('api')
+        self.run_api(trained, records)
+        return self.metrics
+
+    def run_persistence(self, detector):
+        directory = tempfile.mkdtemp(prefix='benchmark-')
+        try:
+            joblib_path = os.path.join(directory, 'model.joblib')
+            artifact_path = os.path.join(directory, 'artifact')
+            for kind, path, save in (('joblib', joblib_path, detector.save_model),
+                                     ('artifact', artifact_path, detector.save_artifact)):
+                # Millisecond disk timings depend on the page cache; sizes are exact
+                elapsed = self.best_time(lambda: save(path))
+                self.record(f'save.{kind}.seconds', elapsed, 's', 'lower', gate=False)
+                self.record(f'save.{kind}.bytes', _disk_size(path), 'bytes', 'lower')
+                elapsed = self.best_time(lambda: ThreatDetector(cache=False).load_model(path))
+                self.record(f'load.{kind}.seconds', elapsed, 's', 'lower', gate=False)
+        finally:
+            shutil.rmtree(directory, ignore_errors=True)
+
+    def run_api(self, detector, records):
+        from app.api import routes
+        from app.main import create_app
+        client = create_app().test_client()
+        routes._publish_detector(detector)
+        requests = records[:self.api_requests]
+        batch = records[:1000]
+        calls = max(1, self.api_requests // 100)
+
+        # Per-request INFO logging would dominate the measurement
+        disabled = logging.root.manager.disable
+        logging.disable(logging.INFO)
+        try:
+            client.post('/api/analyze', json=requests[0])
+            elapsed = self.best_time(lambda: [client.post('/api/analyze', json=record)
+                                              for record in requests])
+            self.record('api.analyze.requests_per_sec', len(requests) / elapsed, 'req/s', 'higher')
+
+            elapsed = self.best_time(lambda: [client.post('/api/analyze/batch',
+                                                          json={'records': batch})
+                                              for _ in range(calls)])
+            self.record('api.analyze_batch.rows_per_sec', len(batch) * calls / elapsed, 'rows/s',
+                        'higher')
+        finally:
+            logging.disable(disabled)
+
+
+def _disk_size(path):
+    if os.path.isfile(path):
+        return os.path.getsize(path)
+    return sum(os.path.getsize(os.path.join(root, name))
+               for root, _, names in os.walk(path) for name in names)
+
+
+def environment():
+    try:
+        commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True,
+                                text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    import sklearn
+    return {
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()),
+        'commit': commit,
+        'python': platform.python_version(),
+        'numpy': np.__version__,
+        'scikit_learn': sklearn.__version__,
+        'cpu_count': os.cpu_count(),
+        'machine': platform.machine()
+    }
+
+
+# Environment fields that change the work being measured. CPU speed and count
+# are left out: normalized timings absorb them
+COMPARABLE_FIELDS = ('python', 'numpy', 'scikit_learn', 'machine')
+
+
+def _comparable(field, value):
+    # Python patch releases do not change performance
+    if field == 'python' and value:
+        return '.'.join(value.split('.')[:2])
+    return value
+
+
+def environment_differences(current, baseline):
+    """Comparable environment fields that differ between two runs"""
+    baseline = baseline or {}
+    return {field: (baseline.get(field), current.get(field)) for field in COMPARABLE_FIELDS
+            if _comparable(field, baseline.get(field)) != _comparable(field, current.get(field))}
+
+
+def compare(metrics, baseline, tolerance):
+    """Gated metrics that moved the wrong way by more than tolerance (a fraction)"""
+    regressions = []
+    for name, current in metrics.items():
+        if not current.get('gate', True):
+            continue
+        previous = baseline.get('metrics', {}).get(name)
+        if not previous:
+            continue
+        # Timings and rates compare relative to each run's reference workload
+        key = 'normalized' if 'normalized' in current and 'normalized' in previous else 'value'
+        if previous[key] == 0:
+            continue
+        change = (current[key] - previous[key]) / previous[key]
+        worse = change > tolerance if current['better'] == 'lower' else change < -tolerance
+        if worse:
+            regressions.append({'metric': name, 'baseline': previous['value'],
+                                'current': current['value'], 'change': change})
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--output', default='benchmark-results.json')
+    parser.add_argument('--baseline', help='Stored results to compare against')
+    parser.add_argument('--tolerance', type=float, default=0.25,
+                        help='Allowed relative change before a metric counts as a regression')
+    parser.add_argument('--quick', action='store_true',
+                        help='Smaller sizes for CI (train at 10k/100k rows only)')
+    parser.add_argument('--iterations', type=int)
+    parser.add_argument('--repeats', type=int, default=3,
+                        help='Runs per throughput/timing measurement; the fastest is reported')
+    args = parser.parse_args()
+
+    if args.quick:
+        suite = Suite(iterations=args.iterations or 500, batch_sizes=[1, 10, 100, 1000],
+                      train_sizes=[10000, 100000], api_requests=200, repeats=args.repeats)
+    else:
+        suite = Suite(iterations=args.iterations or 2000, batch_sizes=[1, 10, 100, 1000, 10000],
+                      train_sizes=[10000, 100000, 1000000], api_requests=1000, repeats=args.repeats)
+
+    metrics = suite.run()
+    results = {'environment': environment(), 'quick': args.quick,
+               'reference_seconds': suite.reference, 'metrics': metrics}
+
+    status = 0
+    if args.baseline:
+        with open(args.baseline) as handle:
+            baseline = json.load(handle)
+        results['baseline'] = {'path': args.baseline, 'environment': baseline.get('environment')}
+        differences = environment_differences(results['environment'], baseline.get('environment'))
+        if baseline.get('quick') != args.quick:
+            differences['quick'] = (baseline.get('quick'), args.quick)
+        if differences:
+            results['baseline']['skipped'] = differences
+            print(f"Skipping comparison with {args.baseline}; environment differs: " +
+                  ', '.join(f"{field} {old} -> {new}" for field, (old, new) in differences.items()))
+        results['regressions'] = ([] if differences else
+                                  compare(results['metrics'], baseline, args.tolerance))
+        for regression in results['regressions']:
+            print(f"REGRESSION {regression['metric']}: {regression['baseline']:,.2f} -> "
+                  f"{regression['current']:,.2f} ({regression['change']:+.0%})")
+        if results['regressions']:
+            status = 2
+        elif not differences:
+            print(f"No regressions beyond {args.tolerance:.0%} against {args.baseline}")
+
+    with open(args.output, 'w') as handle:
+        json.dump(results, handle, indent=2)
+    print(f"Results written to {args.output}")
+    return status
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,124 @@
+import unittest
+import numpy as np
+from app.models.aggregation import FlowAggregator
+from app.models.features import FeatureExtractor
+from app.utils.flow_records import normalize_flows
+
+def flows(source, ports, packet_size=100, duration=0.5):
+    return [{'source_ip': source, 'port': port, 'packet_size': packet_size, 'duration': duration}
+            for port in ports]
+
+class TestFlowAggregator(unittest.TestCase):
+    def setUp(self):
+        self.aggregator = FlowAggregator(window=60, buckets=6, width=2 ** 12, bitmap_width=2 ** 10)
+    
+    def test_source_statistics(self):
+        """Test per-source rate, volume, duration and per-port counts"""
+        self.aggregator.observe(flows('10.0.0.1', [80] * 30 + [443] * 30), now=0)
+        result = self.aggregator.observe(flows('10.0.0.1', [80]), now=1)
+        
+        self.assertAlmostEqual(result['source_connection_rate'][0], 61 / 60)
+        self.assertAlmostEqual(result['source_byte_rate'][0], 6100 / 60)
+        self.assertAlmostEqual(result['source_mean_duration'][0], 0.5)
+        self.assertAlmostEqual(result['source_port_connection_rate'][0], 31 / 60)
+        self.assertLess(abs(result['source_distinct_ports'][0] - 2), 0.5)
+    
+    def test_distinct_ports_estimate(self):
+        """Test a port scan shows up as many distinct ports"""
+        result = self.aggregator.observe(flows('10.0.0.2', range(1000, 1300)), now=0)
+        self.assertLess(abs(result['source_distinct_ports'][-1] - 300) / 300, 0.15)
+        
+        other = self.aggregator.observe(flows('10.0.0.3', [80]), now=0)
+        self.assertLess(other['source_distinct_ports'][0], 3)
+    
+    def test_batch_does_not_see_later_flows(self):
+        """Test each flow of a batch sees the window as of itself, as if observed one by one"""
+        batch = flows('10.0.0.4', range(2000, 2050), packet_size=200) + flows('10.0.0.5', [80] * 3)
+        sequential = FlowAggregator(window=60, buckets=6, width=2 ** 12, bitmap_width=2 ** 10)
+        expected = [sequential.observe([record], now=0) for record in batch]
+        result = self.aggregator.observe(batch, now=0)
+        
+        self.assertAlmostEqual(result['source_connection_rate'][0] * 60, 1)
+        self.assertLess(result['source_distinct_ports'][0], 1.5)
+        for name, values in result.items():
+            np.testing.assert_allclose(values, [single[name][0] for single in expected],
+                                       err_msg=name)
+    
+    def test_flow_arrays_and_dicts_share_sources(self):
+        """Test packed and string addresses of one source count together; IPv6 is kept"""
+        self.aggregator.observe(normalize_flows(flows('10.0.0.6', [80] * 4)), now=0)
+        result = self.aggregator.observe(flows('10.0.0.6', [80]) + flows('2001:db8::6', [80] * 2),
+                                         now=0)
+        
+        np.testing.assert_allclose(result['source_connection_rate'] * 60, [5, 1, 2])
+        result = self.aggregator.observe(normalize_flows(flows('10.0.0.6', [80]) + [{'port': 80}]),
+                                         now=0)
+        np.testing.assert_allclose(result['source_connection_rate'] * 60, [6, 0])
+    
+    def test_window_expiry(self):
+        """Test buckets that leave the window stop counting"""
+        self.aggregator.observe(flows('10.0.0.1', [80] * 60), now=0)
+        self.aggregator.observe(flows('10.0.0.1', [80] * 60), now=30)
+        
+        result = self.aggregator.observe(flows('10.0.0.1', [80]), now=65)
+        self.assertAlmostEqual(result['source_connection_rate'][0] * 60, 61)
+        result = self.aggregator.observe(flows('10.0.0.1', [80]), now=500)
+        self.assertAlmostEqual(result['source_connection_rate'][0] * 60, 1)
+    
+    def test_constant_memory_under_spoofed_sources(self):
+        """Test a flood of unique sources does not grow state and leaves sources separable"""
+        before = self.aggregator.nbytes
+        rng = np.random.default_rng(0)
+        spoofed = [{'source_ip': f"{a}.{b}.{c}.{d}", 'port': 80}
+                   for a, b, c, d in rng.integers(1, 255, size=(20000, 4))]
+        self.aggregator.observe(spoofed, now=0)
+        
+        self.assertEqual(self.aggregator.nbytes, before)
+        result = self.aggregator.observe(flows('192.0.2.1', [22]), now=0)
+        # Count-min never undercounts and stays near the true count of 1
+        self.assertGreaterEqual(result['source_connection_rate'][0] * 60, 1)
+        self.assertLess(result['source_connection_rate'][0] * 60, 20)
+    
+    def test_enrich_and_missing_source(self):
+        """Test aggregates are added to copies of the records and sourceless flows get zeros"""
+        originals = flows('10.0.0.1', [80]) + [{'port': 80, 'packet_size': 1}]
+        records = self.aggregator.enrich(originals, now=0)
+        self.assertNotIn('source_connection_rate', originals[0])
+        
+        self.assertGreater(records[0]['source_connection_rate'], 0)
+        self.assertEqual(records[1]['source_connection_rate'], 0)
+        
+        matrix = FeatureExtractor(aggregates=True).transform(records)
+        self.assertEqual(matrix.shape, (2, 10))
+        self.assertEqual(matrix[0, 5], records[0]['source_connection_rate'])
+    
+    def test_default_and_unparseable_sources_are_missing(self):
+        """Test 0.0.0.0 and unparseable addresses share no bucket, on either input path"""
+        records = [{'source_ip': source, 'port': port}
+                   for port in range(100) for source in ('0.0.0.0', 'not-an-ip', None)]
+        result = self.aggregator.observe(records, now=0)
+        self.assertFalse(result['source_distinct_ports'].any())
+        self.assertEqual(self.aggregator.flows, 0)
+        
+        result = self.aggregator.observe(normalize_flows(records), now=0)
+        self.assertFalse(result['source_connection_rate'].any())
+        ipv6 = self.aggregator.observe(flows('2001:db8::1', [80, 81]), now=0)
+        self.assertAlmostEqual(ipv6['source_connection_rate'][1], 2 / 60)
+    
+    def test_flows_are_placed_by_their_timestamps(self):
+        """Test replayed flows fill the windows they happened in, not the current one"""
+        replay = [dict(record, timestamp=600 + index * 10)
+                  for index, record in enumerate(flows('10.0.0.6', range(3000, 3100)))]
+        result = self.aggregator.observe(replay, now=10000)
+        # Each flow only sees the flows of the last 60 seconds before it
+        self.assertLessEqual(result['source_connection_rate'].max() * 60, 7)
+        self.assertLess(result['source_distinct_ports'].max(), 10)
+        
+        dated = self.aggregator.observe(normalize_flows(flows('10.0.0.7', [80, 81])), now=0)
+        later = self.aggregator.observe([{'source_ip': '10.0.0.7', 'port': 82,
+                                          'timestamp': '1970-01-01T00:00:10'}], now=100)
+        self.assertAlmostEqual(dated['source_connection_rate'][1], 2 / 60)
+        self.assertAlmostEqual(later['source_connection_rate'][0], 3 / 60)
+
+if __name__ == '__main__':
+    unittest.main()
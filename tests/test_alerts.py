@@ -0,0 +1,125 @@
+import json
+import unittest
+from unittest import mock
+
+from app.api import routes
+from app.main import create_app
+from app.models.alerts import AlertSuppressor
+from app.utils.flow_records import normalize_flows
+
+HIGH = {'is_threat': True, 'confidence': 0.9, 'threat_level': 'high', 'recommendation': 'Block'}
+LOW = {'is_threat': True, 'confidence': 0.1, 'threat_level': 'low', 'recommendation': 'Monitor'}
+BENIGN = {'is_threat': False, 'confidence': 0.2, 'threat_level': 'low'}
+ATTACKER = {'source_ip': '203.0.113.7', 'port': 22, 'protocol': 'TCP', 'packet_size': 60}
+OTHER = {'source_ip': '198.51.100.2', 'port': 22, 'protocol': 'TCP', 'packet_size': 60}
+
+
+class TestAlertSuppressor(unittest.TestCase):
+    def test_burst_then_suppressed_per_source_and_level(self):
+        suppressor = AlertSuppressor(rate=0, burst=2, window=60)
+        results = suppressor.process([ATTACKER] * 4 + [OTHER, ATTACKER, ATTACKER],
+                                     [HIGH] * 4 + [HIGH, LOW, BENIGN], now=0)
+
+        self.assertEqual(results[0]['recommendation'], 'Block')
+        self.assertEqual(results[1]['incident']['count'], 2)
+        self.assertEqual(results[2], {'is_threat': True, 'threat_level': 'high', 'suppressed': True,
+                                      'incident_id': results[0]['incident']['id'], 'count': 3})
+        self.assertTrue(results[3]['suppressed'])
+        # Other sources and other levels have their own buckets; benign results pass untouched
+        self.assertNotIn('suppressed', results[4])
+        self.assertNotIn('suppressed', results[5])
+        self.assertIs(results[6], BENIGN)
+        self.assertEqual(suppressor.stats()['suppressed'], 2)
+        self.assertEqual(suppressor.incidents(1)[0]['count'], 4)
+
+    def test_tokens_refill_at_rate(self):
+        suppressor = AlertSuppressor(rate=1, burst=1, window=60)
+        outcomes = [suppressor.process([ATTACKER], [HIGH], now=now)[0].get('suppressed', False)
+                    for now in (0, 0.5, 1.0, 1.2)]
+        self.assertEqual(outcomes, [False, True, False, True])
+
+    def test_incidents_close_when_idle_or_a_window_old(self):
+        closed = []
+        suppressor = AlertSuppressor(rate=0, burst=1, window=10, on_close=closed.append)
+        suppressor.process([ATTACKER, OTHER], [HIGH, HIGH], now=0)
+        for now in range(1, 12):
+            suppressor.process([ATTACKER], [HIGH], now=now)
+
+        # OTHER went quiet; ATTACKER kept going and rolled into a new incident
+        self.assertEqual([(incident['source_ip'], incident['count']) for incident in closed],
+                         [('198.51.100.2', 1), ('203.0.113.7', 10)])
+        self.assertEqual(closed[1]['suppressed'], 9)
+        self.assertEqual(suppressor.incidents()[0]['first_seen'], 10)
+        suppressor.flush()
+        self.assertEqual(suppressor.stats()['open_incidents'], 0)
+
+    def test_map_is_bounded(self):
+        closed = []
+        suppressor = AlertSuppressor(max_incidents=3, on_close=closed.append)
+        records = [{'source_ip': f'10.0.0.{index}'} for index in range(5)]
+        suppressor.process(records, [HIGH] * 5, now=0)
+        self.assertEqual(suppressor.stats()['open_incidents'], 3)
+        self.assertEqual(suppressor.stats()['evicted'], 2)
+        self.assertEqual([incident['source_ip'] for incident in closed], ['10.0.0.0', '10.0.0.1'])
+
+    def test_short_circuit_confirmed_sources(self):
+        suppressor = AlertSuppressor(rate=0, burst=1, window=60, short_circuit_after=2)
+        suppressor.process([ATTACKER, OTHER], [HIGH, LOW], now=0)
+        self.assertEqual(suppressor.lookup([ATTACKER], now=1), [None])
+
+        suppressor.process([ATTACKER], [HIGH], now=1)
+        verdicts = suppressor.lookup([ATTACKER, OTHER, {'port': 22}], now=2)
+        self.assertEqual(verdicts[0], dict(HIGH, short_circuit=True))
+        self.assertEqual(verdicts[1:], [None, None])
+        self.assertEqual(suppressor.lookup([ATTACKER], now=61), [None])
+
+        suppressor = AlertSuppressor(short_circuit_after=1, short_circuit_levels=['medium', 'low'])
+        suppressor.process([OTHER], [LOW], now=0)
+        self.assertEqual(suppressor.lookup([OTHER], now=1)[0]['threat_level'], 'low')
+
+    def test_accepts_flow_arrays(self):
+        suppressor = AlertSuppressor(rate=0, burst=1)
+        results = suppressor.process(normalize_flows([ATTACKER, ATTACKER]), [HIGH, HIGH], now=0)
+        self.assertTrue(results[1]['suppressed'])
+        self.assertEqual(suppressor.incidents()[0]['source_ip'], '203.0.113.7')
+
+
+class TestAlertSuppressionAPI(unittest.TestCase):
+    def setUp(self):
+        self.app = create_app()
+        self.app.config['TESTING'] = True
+        self.client = self.app.test_client()
+        self.suppressor = AlertSuppressor(rate=0, burst=1, window=60, short_circuit_after=2)
+        patcher = mock.patch.object(routes, 'alert_suppressor', self.suppressor)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.addCleanup(self.suppressor.flush)
+
+    def test_batch_collapses_and_short_circuits(self):
+        record = dict(ATTACKER, port=3389, packet_size=9000)
+        detector = routes.threat_detector
+        with mock.patch.object(routes, '_record_detections') as record_detections:
+            with mock.patch.object(detector, 'predict_batch',
+                                   wraps=detector.predict_batch) as predict:
+                first = json.loads(self.client.post('/api/analyze/batch', json=[record] * 3).data)
+                second = json.loads(self.client.post('/api/analyze/batch', json=[record] * 2).data)
+
+        self.assertEqual(first['threat_count'], 3)
+        self.assertIn('recommendation', first['results'][0])
+        self.assertTrue(all(result['suppressed'] for result in first['results'][1:]))
+        # The second batch came from a confirmed source and was not scored
+        self.assertEqual(predict.call_count, 1)
+        self.assertEqual([result['count'] for result in second['results']], [4, 5])
+        self.assertEqual(record_detections.call_count, 2)
+
+        incidents = json.loads(self.client.get('/api/alerts/incidents').data)
+        self.assertEqual(incidents['incidents'][0]['count'], 5)
+        self.assertEqual(incidents['incidents'][0]['short_circuited'], 2)
+
+    def test_incidents_endpoint_disabled(self):
+        with mock.patch.object(routes, 'alert_suppressor', None):
+            self.assertEqual(self.client.get('/api/alerts/incidents').status_code, 404)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,91 @@
+import io
+import json
+import logging
+import os
+import tempfile
+import unittest
+from app.utils.analysis_log import AnalysisLogger
+
+THREAT = {'is_threat': True, 'confidence': 0.9, 'threat_level': 'high'}
+BENIGN = {'is_threat': False, 'confidence': 0.1, 'threat_level': 'low'}
+RECORD = {'source_ip': '10.0.0.1', 'destination_ip': '10.0.0.2', 'port': 3389, 'protocol': 'TCP'}
+
+class TestAnalysisLogger(unittest.TestCase):
+    def make_logger(self, name, **kwargs):
+        self.stream = io.StringIO()
+        logger = AnalysisLogger(stream=self.stream, logger=logging.getLogger(name), **kwargs)
+        logger.start()
+        self.addCleanup(logger.stop)
+        return logger
+    
+    def events(self):
+        return [json.loads(line) for line in self.stream.getvalue().splitlines()]
+    
+    def test_threats_logged_and_benign_sampled(self):
+        """Test every threat is logged and benign results follow the sample rate"""
+        logger = self.make_logger('test.analysis.sampling', benign_sample_rate=0.0)
+        logger.log_result(RECORD, THREAT)
+        for _ in range(100):
+            logger.log_result(RECORD, BENIGN)
+        logger.stop()
+        
+        events = self.events()
+        self.assertEqual(len(events), 1)
+        self.assertEqual(events[0]['event'], 'threat_analysis')
+        self.assertEqual(events[0]['source_ip'], '10.0.0.1')
+        self.assertEqual(events[0]['threat_level'], 'high')
+    
+    def test_batch_summary(self):
+        """Test a batch logs its threats and one summary event"""
+        logger = self.make_logger('test.analysis.batch', benign_sample_rate=1.0)
+        logger.log_batch('batch', [RECORD] * 3, [THREAT, BENIGN, BENIGN])
+        logger.stop()
+        
+        events = self.events()
+        self.assertEqual([event['event'] for event in events],
+                         ['threat_analysis', 'batch_analysis'])
+        self.assertEqual(events[1]['records'], 3)
+        self.assertEqual(events[1]['threats'], 1)
+    
+    def test_disabled_logger_and_full_queue(self):
+        """Test nothing is queued when disabled and overflow is dropped, not blocked on"""
+        logger = self.make_logger('test.analysis.disabled', benign_sample_rate=1.0, max_queue=1)
+        logger.logger.setLevel(logging.WARNING)
+        logger.log_result(RECORD, THREAT)
+        self.assertEqual(logger._queue.qsize(), 0)
+        
+        logger.logger.setLevel(logging.INFO)
+        logger.log_result(RECORD, THREAT)
+        logger._listener.stop()
+        for _ in range(5):
+            logger.log_result(RECORD, THREAT)
+        self.assertEqual(logger.dropped, 4)
+        logger._listener.start()
+
+    @unittest.skipUnless(hasattr(os, 'fork'), 'needs os.fork')
+    def test_listener_starts_after_fork(self):
+        """Test a logger started before a fork, as under preload_app, writes from the child"""
+        with tempfile.TemporaryFile('w+') as stream:
+            logger = AnalysisLogger(stream=stream, logger=logging.getLogger('test.analysis.fork'))
+            logger.start()
+            self.addCleanup(logger.stop)
+            self.assertIsNone(logger._listener._thread)
+            
+            pid = os.fork()
+            if pid == 0:
+                status = 1
+                try:
+                    logger.log_result(RECORD, THREAT)
+                    logger.stop()
+                    stream.flush()
+                    status = 0
+                finally:
+                    os._exit(status)
+            _, status = os.waitpid(pid, 0)
+            self.assertEqual(os.waitstatus_to_exitcode(status), 0)
+            stream.seek(0)
+            events = [json.loads(line) for line in stream.read().splitlines()]
+        self.assertEqual([event['event'] for event in events], ['threat_analysis'])
+
+if __name__ == '__main__':
+    unittest.main()
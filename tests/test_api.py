@@ -1,12 +1,30 @@
+import io
 import unittest
 import json
+import os
+import tempfile
+import time
+from unittest import mock
+import numpy as np
+from app.api import routes
+from app.models.aggregation import FlowAggregator
 from app.main import create_app
+from app.utils import serialization
+from app.utils.history_store import HistoryStore
 
 class TestAPI(unittest.TestCase):
     def setUp(self):
         self.app = create_app()
         self.app.config['TESTING'] = True
         self.client = self.app.test_client()
+        
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.history = HistoryStore(os.path.join(directory.name, 'history.db'), flush_interval=0.05)
+        self.addCleanup(self.history.close)
+        original = routes._history_store
+        routes._history_store = self.history
+        self.addCleanup(setattr, routes, '_history_store', original)
     
     def test_health_check(self):
         """Test health check endpoint"""
@@ -17,11 +35,19 @@ class TestAPI(unittest.TestCase):
     
     def test_metrics_endpoint(self):
         """Test metrics endpoint"""
+        self.client.post('/api/analyze',
+                         data=json.dumps({'packet_size': 512, 'port': 3389, 'protocol': 'TCP'}),
+                         content_type='application/json')
+        
         response = self.client.get('/metrics')
         self.assertEqual(response.status_code, 200)
-        data = json.loads(response.data)
-        self.assertIn('requests_total', data)
-        self.assertIn('threats_detected', data)
+        self.assertTrue(response.content_type.startswith('text/plain'))
+        body = response.data.decode()
+        self.assertIn('threat_api_requests_total{method="POST",route="/api/analyze",status="200"}',
+                      body)
+        self.assertIn('threats_detected_total{level="high"}', body)
+        self.assertIn('threat_detector_stage_duration_seconds_bucket', body)
+        self.assertIn('threat_api_requests_in_progress', body)
     
     def test_analyze_endpoint(self):
         """Test threat analysis endpoint"""
@@ -42,6 +68,55 @@ class TestAPI(unittest.TestCase):
         self.assertTrue(data['success'])
         self.assertIn('analysis', data)
     
+    def test_analyze_endpoint_lean(self):
+        """Test lean mode returns only the result fields"""
+        response = self.client.post('/api/analyze?mode=lean',
+                                    data=json.dumps({'packet_size': 512, 'port': 3389,
+                                                     'protocol': 'TCP'}),
+                                    content_type='application/json')
+        
+        self.assertEqual(response.status_code, 200)
+        data = json.loads(response.data)
+        self.assertNotIn('input_data', data)
+        self.assertTrue(data['is_threat'])
+        self.assertEqual(data['threat_level'], 'high')
+    
+    @unittest.skipIf(serialization.msgpack is None, 'msgpack is not installed')
+    def test_analyze_endpoint_msgpack(self):
+        """Test clients accepting MessagePack get a MessagePack body"""
+        response = self.client.post('/api/analyze/batch',
+                                    data=json.dumps({'records': [{'packet_size': 512, 'port': 3389,
+                                                                  'protocol': 'TCP'}]}),
+                                    content_type='application/json',
+                                    headers={'Accept': 'application/msgpack'})
+        
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.mimetype, 'application/msgpack')
+        data = serialization.msgpack.unpackb(response.data)
+        self.assertEqual(data['count'], 1)
+        self.assertTrue(data['results'][0]['is_threat'])
+    
+    def test_analyze_endpoint_coalesced(self):
+        """Test single-record analysis through the request coalescer"""
+        self.addCleanup(setattr, routes, 'analyze_coalescer', routes.analyze_coalescer)
+        routes.analyze_coalescer = routes.RequestCoalescer(routes._analyze_records)
+        
+        response = self.client.post('/api/analyze',
+                                    data=json.dumps({'packet_size': 512, 'port': 3389,
+                                                     'protocol': 'TCP'}),
+                                    content_type='application/json')
+        self.assertEqual(response.status_code, 200)
+        analysis = json.loads(response.data)['analysis']
+        self.assertTrue(analysis['is_threat'])
+        self.assertEqual(analysis['threat_level'], 'high')
+    
+    def test_analyze_endpoint_list_valued_extra_field(self):
+        """Test fields outside the feature set may hold lists"""
+        record = {'packet_size': 100, 'port': 22, 'protocol': 'TCP', 'flags': ['SYN']}
+        response = self.client.post('/api/analyze', json=record)
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(json.loads(response.data)['analysis']['is_threat'])
+    
     def test_analyze_endpoint_missing_data(self):
         """Test analysis endpoint with missing data"""
         response = self.client.post('/api/analyze',
@@ -50,6 +125,194 @@ class TestAPI(unittest.TestCase):
         
         self.assertEqual(response.status_code, 400)
     
+    def test_analyze_batch_endpoint(self):
+        """Test batch threat analysis endpoint"""
+        test_data = {
+            'records': [
+                {'packet_size': 1024, 'port': 80, 'protocol': 'TCP'},
+                {'packet_size': 512, 'port': 1433, 'protocol': 'TCP'}
+            ]
+        }
+        
+        response = self.client.post('/api/analyze/batch',
+                                   data=json.dumps(test_data),
+                                   content_type='application/json')
+        
+        self.assertEqual(response.status_code, 200)
+        data = json.loads(response.data)
+        self.assertTrue(data['success'])
+        self.assertEqual(data['count'], 2)
+        self.assertTrue(data['results'][1]['is_threat'])
+    
+    def test_analyze_batch_endpoint_invalid_record(self):
+        """Test batch analysis endpoint rejects records missing fields"""
+        test_data = {'records': [{'packet_size': 1024, 'port': 80, 'protocol': 'TCP'},
+                                 {'port': 22}]}
+        
+        response = self.client.post('/api/analyze/batch',
+                                   data=json.dumps(test_data),
+                                   content_type='application/json')
+        
+        self.assertEqual(response.status_code, 400)
+        data = json.loads(response.data)
+        self.assertEqual(data['invalid_records'], [1])
+    
+    def test_analyze_stream_endpoint(self):
+        """Test streaming NDJSON analysis endpoint"""
+        lines = [
+            json.dumps({'packet_size': 1024, 'port': 80, 'protocol': 'TCP'}),
+            'not json',
+            json.dumps({'packet_size': 512, 'port': 3389, 'protocol': 'TCP',
+                        'source_ip': '10.0.0.5'}),
+            json.dumps({'packet_size': 512, 'port': 443, 'protocol': 'TCP'})
+        ]
+        
+        response = self.client.post('/api/analyze/stream?chunk_size=2&threats_only=true',
+                                   data='\n'.join(lines) + '\n',
+                                   content_type='application/x-ndjson')
+        
+        self.assertEqual(response.status_code, 200)
+        results = [json.loads(line) for line in response.data.decode().splitlines()]
+        self.assertEqual(results[0], {'index': 1, 'error': results[0]['error']})
+        self.assertEqual(results[1]['index'], 2)
+        self.assertEqual(results[1]['source_ip'], '10.0.0.5')
+        self.assertTrue(results[1]['analysis']['is_threat'])
+        self.assertEqual(results[-1]['summary'], {'processed': 3, 'threats': 1, 'errors': 1})
+    
+    def test_batch_and_stream_score_flow_arrays(self):
+        """Test IPv4 batches are scored as compact flow arrays and IPv6 ones as dicts"""
+        records = [{'packet_size': 512, 'port': 22, 'protocol': 'TCP', 'source_ip': '10.0.0.1'},
+                   {'packet_size': 512, 'port': 443, 'protocol': 'TCP'}]
+        ipv6 = dict(records[0], source_ip='2001:db8::1')
+        detector = routes.threat_detector
+        with mock.patch.object(detector, 'predict_batch', wraps=detector.predict_batch) as predict:
+            batch = json.loads(self.client.post('/api/analyze/batch', json=records).data)
+            self.client.post('/api/analyze/batch', json=[ipv6])
+            response = self.client.post('/api/analyze/stream',
+                                        data='\n'.join(json.dumps(r) for r in records) + '\n',
+                                        content_type='application/x-ndjson')
+        
+        scored = [call.args[0] for call in predict.call_args_list]
+        self.assertEqual([isinstance(records, np.ndarray) for records in scored],
+                         [True, False, True])
+        self.assertEqual(batch['threat_count'], 1)
+        lines = [json.loads(line) for line in response.data.decode().splitlines()]
+        self.assertEqual([(line['source_ip'], line['port']) for line in lines[:2]],
+                         [('10.0.0.1', 22), ('0.0.0.0', 443)])
+    
+    def test_analyze_stream_rejects_bad_lines_without_aborting(self):
+        """Test non-string protocols and overlong lines become per-line errors"""
+        lines = [
+            json.dumps({'packet_size': 512, 'port': 22, 'protocol': 5}),
+            json.dumps({'packet_size': 512, 'port': 22, 'protocol': 'TCP', 'padding': 'x' * 200}),
+            json.dumps({'packet_size': 512, 'port': 443, 'protocol': 'TCP'})
+        ]
+        
+        with mock.patch.object(routes, 'STREAM_MAX_LINE_BYTES', 100):
+            response = self.client.post('/api/analyze/stream',
+                                        data='\n'.join(lines) + '\n',
+                                        content_type='application/x-ndjson')
+        
+        results = [json.loads(line) for line in response.data.decode().splitlines()]
+        self.assertEqual([result['index'] for result in results[:3]], [0, 1, 2])
+        self.assertEqual(results[1]['error'], 'Line too long')
+        self.assertIn('analysis', results[2])
+        self.assertEqual(results[-1]['summary'], {'processed': 1, 'threats': 0, 'errors': 2})
+    
+    def test_port_scan_detected_from_aggregates(self):
+        """Test many small requests from one source trip the port scan rule"""
+        self.addCleanup(setattr, routes, 'threat_detector', routes.threat_detector)
+        routes._publish_detector(routes.ThreatDetector())
+        records = [{'packet_size': 60, 'port': port, 'protocol': 'TCP',
+                    'source_ip': '198.51.100.77'}
+                   for port in range(2000, 2200)]
+        records.append({'packet_size': 60, 'port': 2000, 'protocol': 'TCP',
+                        'source_ip': '198.51.100.78'})
+        response = self.client.post('/api/analyze/batch',
+                                    data=json.dumps({'records': records}),
+                                    content_type='application/json')
+        
+        results = json.loads(response.data)['results']
+        # A flow only counts the ports its source touched up to and including it
+        self.assertNotIn('port_scan', results[0].get('matched_rules', []))
+        self.assertIn('port_scan', results[199]['matched_rules'])
+        self.assertFalse(results[-1]['is_threat'])
+    
+    def test_flows_without_source_are_not_aggregated(self):
+        """Test sourceless flows, which get the 0.0.0.0 default, never trip source rules"""
+        self.addCleanup(setattr, routes, 'threat_detector', routes.threat_detector)
+        routes._publish_detector(routes.ThreatDetector())
+        lines = [json.dumps({'packet_size': 512, 'port': 1024 + index, 'protocol': 'TCP'})
+                 for index in range(400)]
+        response = self.client.post('/api/analyze/stream?chunk_size=50',
+                                    data='\n'.join(lines) + '\n',
+                                    content_type='application/x-ndjson')
+        
+        results = [json.loads(line) for line in response.data.decode().splitlines()]
+        self.assertEqual(results[-1]['summary'], {'processed': 400, 'threats': 0, 'errors': 0})
+    
+    def test_aggregation_copies_records_and_follows_detector(self):
+        """Test aggregates never reach the echoed input and only run when the detector reads them"""
+        self.addCleanup(setattr, routes, 'threat_detector', routes.threat_detector)
+        aggregator = FlowAggregator()
+        record = {'packet_size': 512, 'port': 443, 'protocol': 'TCP', 'source_ip': '10.0.0.9'}
+        with mock.patch.object(routes, 'flow_aggregator', aggregator):
+            routes._publish_detector(routes.ThreatDetector())
+            data = json.loads(self.client.post('/api/analyze', json=record).data)
+            self.assertEqual(data['input_data'], record)
+            self.assertEqual(aggregator.flows, 1)
+            
+            rng = np.random.default_rng(0)
+            trained = routes.ThreatDetector(cache=False, rule_prefilter=False)
+            self.assertTrue(trained.train(rng.normal(100, 10, (200, 5))))
+            routes._publish_detector(trained)
+            self.client.post('/api/analyze/batch', json=[record] * 3)
+            self.assertEqual(aggregator.flows, 1)
+    
+    def test_history_is_off_without_a_path(self):
+        """Test no history database is opened unless HISTORY_DB_PATH is set"""
+        with mock.patch.object(routes, '_history_store', None):
+            with mock.patch.dict(os.environ, {}, clear=False):
+                os.environ.pop('HISTORY_DB_PATH', None)
+                self.assertIsNone(routes.get_history_store())
+                self.assertEqual(self.client.get('/api/threats/history').status_code, 404)
+    
+    def test_threat_history_endpoint(self):
+        """Test detections are recorded and served with filters and pagination"""
+        records = [{'packet_size': 512, 'port': port, 'protocol': 'TCP', 'source_ip': '10.0.0.1'}
+                   for port in (3389, 22, 80, 445)]
+        self.client.post('/api/analyze/batch',
+                         data=json.dumps({'records': records}),
+                         content_type='application/json')
+        self.assertTrue(self.history.flush())
+        
+        response = self.client.get('/api/threats/history?limit=2')
+        self.assertEqual(response.status_code, 200)
+        data = json.loads(response.data)
+        self.assertEqual(data['total_count'], 3)
+        self.assertEqual(data['counts'], {'high': 3})
+        self.assertEqual([threat['destination_port'] for threat in data['threats']], [445, 22])
+        self.assertEqual(data['threats'][0]['action_taken'], 'blocked')
+        
+        response = self.client.get(f"/api/threats/history?limit=2&cursor={data['next_cursor']}")
+        data = json.loads(response.data)
+        self.assertEqual([threat['destination_port'] for threat in data['threats']], [3389])
+        self.assertIsNone(data['next_cursor'])
+        self.assertNotIn('counts', data)
+        
+        with mock.patch.object(self.history, 'counts', wraps=self.history.counts) as counts:
+            response = self.client.get('/api/threats/history?limit=1&cursor=1&counts=true')
+            self.assertEqual(json.loads(response.data)['total_count'], 3)
+            response = self.client.get('/api/threats/history?counts=false')
+            self.assertNotIn('total_count', json.loads(response.data))
+        self.assertEqual(counts.call_count, 1)
+        
+        response = self.client.get('/api/threats/history?destination_port=22&source_ip=10.0.0.1')
+        self.assertEqual(json.loads(response.data)['total_count'], 1)
+        
+        response = self.client.get('/api/threats/history?start=not-a-date')
+        self.assertEqual(response.status_code, 400)
+    
     def test_status_endpoint(self):
         """Test status endpoint"""
         response = self.client.get('/api/status')
@@ -57,5 +320,89 @@ class TestAPI(unittest.TestCase):
         data = json.loads(response.data)
         self.assertEqual(data['status'], 'operational')
 
+    def test_train_endpoint_runs_in_background(self):
+        """Test training returns a job id and swaps in the trained model"""
+        original_detector = routes.threat_detector
+        self.addCleanup(setattr, routes, 'threat_detector', original_detector)
+        training_data = [[500 + i, 10, 80, 1, 0.5] for i in range(50)]
+        
+        response = self.client.post('/api/train',
+                                   data=json.dumps({'training_data': training_data}),
+                                   content_type='application/json')
+        
+        self.assertEqual(response.status_code, 202)
+        job_id = json.loads(response.data)['job_id']
+        
+        deadline = time.monotonic() + 60
+        while time.monotonic() < deadline:
+            job = json.loads(self.client.get(f'/api/train/{job_id}').data)['job']
+            if job['status'] not in ('queued', 'running'):
+                break
+            time.sleep(0.1)
+        
+        self.assertEqual(job['status'], 'completed')
+        self.assertEqual(job['progress'], 1.0)
+        self.assertIsNot(routes.threat_detector, original_detector)
+        self.assertTrue(routes.threat_detector.is_trained)
+        self.assertFalse(original_detector.is_trained)
+    
+    def test_train_endpoint_binary_upload(self):
+        """Test a .npy upload trains with subsampling and reports its stats"""
+        self.addCleanup(setattr, routes, 'threat_detector', routes.threat_detector)
+        rng = np.random.default_rng(0)
+        matrix = np.column_stack([rng.normal(512, 100, 5000), rng.poisson(10, 5000),
+                                  rng.choice([80, 443], 5000), rng.choice([1, 2], 5000),
+                                  rng.exponential(0.5, 5000)])
+        body = io.BytesIO()
+        np.save(body, matrix)
+        
+        response = self.client.post('/api/train?wait=true&subsample=1000&max_samples=128&n_jobs=2',
+                                    data=body.getvalue(), content_type='application/x-npy')
+        
+        self.assertEqual(response.status_code, 200)
+        stats = json.loads(response.data)['job']['stats']
+        self.assertEqual(stats['total_rows'], 5000)
+        self.assertEqual(stats['rows'], 1000)
+        self.assertEqual(stats['max_samples'], 128)
+        self.assertGreater(stats['peak_rss_bytes'], 0)
+        self.assertTrue(routes.threat_detector.is_trained)
+    
+    def test_train_endpoint_rejects_bad_sources(self):
+        """Test wrong-shaped uploads and paths outside TRAINING_DATA_DIR are refused"""
+        body = io.BytesIO()
+        np.save(body, np.zeros((10, 3)))
+        response = self.client.post('/api/train', data=body.getvalue(),
+                                    content_type='application/x-npy')
+        self.assertEqual(response.status_code, 400)
+        
+        with tempfile.TemporaryDirectory() as directory, \
+                mock.patch.dict(os.environ, {'TRAINING_DATA_DIR': directory}):
+            response = self.client.post('/api/train', json={'path': '../../etc/passwd.npy'})
+            self.assertEqual(response.status_code, 403)
+            response = self.client.post('/api/train', json={'path': 'missing.npy'})
+            self.assertEqual(response.status_code, 404)
+    
+    def test_train_upload_size_limits(self):
+        """Test uploads over TRAINING_MAX_UPLOAD_BYTES or MAX_CONTENT_LENGTH get 413"""
+        body = io.BytesIO()
+        np.save(body, np.zeros((100, 5)))
+        with mock.patch.object(routes, 'TRAINING_MAX_UPLOAD_BYTES', 1000):
+            response = self.client.post('/api/train', data=body.getvalue(),
+                                        content_type='application/x-npy')
+            self.assertEqual(response.status_code, 413)
+        
+        self.app.config['MAX_CONTENT_LENGTH'] = 1000
+        self.addCleanup(self.app.config.pop, 'MAX_CONTENT_LENGTH')
+        with mock.patch.object(routes.training_manager, 'submit') as submit:
+            response = self.client.post('/api/train', data=body.getvalue(),
+                                        content_type='application/x-npy')
+        self.assertEqual(response.status_code, 413)
+        submit.assert_not_called()
+    
+    def test_train_job_unknown(self):
+        """Test polling an unknown training job"""
+        response = self.client.get('/api/train/missing')
+        self.assertEqual(response.status_code, 404)
+
 if __name__ == '__main__':
     unittest.main()
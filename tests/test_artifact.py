@@ -0,0 +1,102 @@
+import json
+import os
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+import numpy as np
+from app.api import routes
+from app.models import artifact
+from app.models.threat_detector import ThreatDetector
+
+class TestModelArtifact(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmpdir, ignore_errors=True)
+        self.path = os.path.join(self.tmpdir, 'model')
+        
+        rng = np.random.default_rng(3)
+        self.training_data = np.column_stack([
+            rng.normal(512, 100, 1000),
+            rng.poisson(10, 1000),
+            rng.choice([80, 443, 22], 1000),
+            rng.choice([1, 2, 5], 1000),
+            rng.exponential(0.5, 1000)
+        ])
+        self.probe = np.vstack([self.training_data[:200], rng.normal(3000, 1500, (50, 5))])
+        self.detector = ThreatDetector()
+        self.detector.train(self.training_data)
+    
+    def test_round_trip_matches_sklearn(self):
+        """Test artifact scores match the fitted IsolationForest"""
+        self.assertTrue(self.detector.save_artifact(self.path))
+        
+        loaded = ThreatDetector()
+        self.assertTrue(loaded.load_model(self.path))
+        self.assertTrue(loaded.is_trained)
+        self.assertIsInstance(loaded.model.node_threshold, np.memmap)
+        
+        expected = self.detector.model.decision_function(self.detector.scaler.transform(self.probe))
+        actual = loaded.model.decision_function(loaded.scaler.transform(self.probe))
+        np.testing.assert_allclose(actual, expected, rtol=0, atol=1e-12)
+        
+        records = [{'packet_size': 9000, 'frequency': 500, 'port': 3389, 'protocol': 'ICMP',
+                    'duration': 20}]
+        self.assertEqual(loaded.predict_batch(records), self.detector.predict_batch(records))
+    
+    def test_engine_scores_from_mapped_layout(self):
+        """Test a loaded detector compiles once, over the memory-mapped layout"""
+        self.detector.save_artifact(self.path)
+        loaded = ThreatDetector(compiled=True)
+        self.assertTrue(loaded.load_model(self.path))
+        
+        engine = loaded._get_engine()
+        for array in (engine._children, engine._split_feature, engine._threshold):
+            self.assertIsInstance(array, np.memmap)
+        self.assertIsNone(loaded.model._engine)
+        
+        expected = self.detector.model.decision_function(self.detector.scaler.transform(self.probe))
+        np.testing.assert_allclose(engine.decision_function(self.probe), expected,
+                                   rtol=0, atol=1e-6)
+        
+        # A different scaler falls back to compiling its own layout
+        self.assertIsNone(loaded.model.layout_for(self.detector.scaler.fit(self.probe)))
+    
+    def test_checksum_mismatch_is_rejected(self):
+        """Test a corrupted array file fails checksum verification"""
+        self.detector.save_artifact(self.path)
+        with open(os.path.join(self.path, 'node_threshold.npy'), 'r+b') as handle:
+            handle.seek(-8, os.SEEK_END)
+            handle.write(b'\xff' * 8)
+        
+        with self.assertRaises(artifact.ArtifactError):
+            artifact.load_artifact(self.path)
+        self.assertFalse(ThreatDetector().load_model(self.path))
+    
+    def test_unsupported_version_is_rejected(self):
+        """Test artifacts from an unknown format version are rejected"""
+        self.detector.save_artifact(self.path)
+        header_path = os.path.join(self.path, artifact.HEADER_FILE)
+        with open(header_path) as handle:
+            header = json.load(handle)
+        header['version'] = artifact.ARTIFACT_VERSION + 1
+        with open(header_path, 'w') as handle:
+            json.dump(header, handle)
+        
+        with self.assertRaises(artifact.ArtifactError):
+            artifact.load_artifact(self.path)
+    
+    def test_preload_from_model_path(self):
+        """Test workers preload MODEL_PATH and refuse to start untrained when required"""
+        self.detector.save_artifact(self.path)
+        with mock.patch.dict(os.environ, {'MODEL_PATH': self.path,
+                                          'REQUIRE_TRAINED_MODEL': 'true'}):
+            self.assertTrue(routes.load_initial_detector().is_trained)
+        
+        missing = os.path.join(self.tmpdir, 'missing')
+        with mock.patch.dict(os.environ, {'MODEL_PATH': missing, 'REQUIRE_TRAINED_MODEL': 'true'}):
+            with self.assertRaises(RuntimeError):
+                routes.load_initial_detector()
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,112 @@
+import json
+import os
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+import pandas as pd
+from app.models.bulk_scoring import BulkScorer, read_chunks
+from app.models.threat_detector import ThreatDetector
+from app.utils.data_processor import NetworkDataProcessor
+from app.utils.traffic_generator import TrafficGenerator
+
+class TestBulkScoring(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmpdir, ignore_errors=True)
+        self.model_path = os.path.join(self.tmpdir, 'model')
+        self.detector = ThreatDetector(cache=False)
+        self.detector.train(TrafficGenerator(seed=0, attack_rates={}).generate(2000))
+        self.detector.save_artifact(self.model_path)
+        
+        self.flows = TrafficGenerator(seed=1).generate(2500).drop(columns='label')
+        self.csv_path = os.path.join(self.tmpdir, 'flows.csv.gz')
+        self.flows.iloc[:1500].to_csv(self.csv_path, index=False)
+        self.jsonl_path = os.path.join(self.tmpdir, 'flows.jsonl')
+        self.flows.iloc[1500:].to_json(self.jsonl_path, orient='records', lines=True)
+        self.output = os.path.join(self.tmpdir, 'scored.csv')
+    
+    def expected(self):
+        flows = NetworkDataProcessor.process_network_frame(self.flows)
+        return [result['is_threat'] for result in self.detector.predict_batch(flows)]
+    
+    def test_scores_match_in_process_prediction(self):
+        """Test chunked multiprocess scoring keeps input order and verdicts"""
+        summary = BulkScorer(self.model_path, self.output, workers=2, chunk_size=400).run(
+            [self.csv_path, self.jsonl_path])
+        
+        self.assertEqual(summary['rows'], 2500)
+        self.assertEqual(summary['chunks'], 4 + 3)
+        scored = pd.read_csv(self.output)
+        self.assertEqual(list(scored['source_ip']), list(self.flows['source_ip']))
+        self.assertEqual(list(scored['is_threat']), self.expected())
+        self.assertEqual(summary['threats'], int(scored['is_threat'].sum()))
+    
+    def test_resume_from_checkpoint(self):
+        """Test an interrupted run resumes without duplicating or losing rows"""
+        scorer = BulkScorer(self.model_path, self.output, workers=1, chunk_size=500)
+        scorer.run([self.csv_path, self.jsonl_path])
+        with open(scorer.checkpoint_path) as handle:
+            complete = json.load(handle)
+        
+        # Rewind the checkpoint to mid-run and leave a torn write behind it
+        with open(self.output, 'rb') as handle:
+            lines = handle.read().split(b'\n')
+        offset = len(b'\n'.join(lines[:1 + 2 * 500])) + 1
+        with open(self.output, 'r+b') as handle:
+            handle.truncate(offset)
+            handle.seek(offset)
+            handle.write(b'partial,row')
+        with open(scorer.checkpoint_path, 'w') as handle:
+            json.dump(dict(complete, chunks=2, rows=1000, threats=0, offset=offset, file=0,
+                           file_rows=1000), handle)
+        
+        summary = scorer.run([self.csv_path, self.jsonl_path])
+        self.assertEqual(summary['resumed_chunks'], 2)
+        self.assertEqual(summary['rows'], 2500)
+        scored = pd.read_csv(self.output)
+        self.assertEqual(list(scored['destination_ip']), list(self.flows['destination_ip']))
+        self.assertEqual(list(scored['is_threat']), self.expected())
+    
+    def test_resume_does_not_reread_finished_files(self):
+        """Test a resumed run starts at the checkpointed file and row"""
+        scorer = BulkScorer(self.model_path, self.output, workers=1, chunk_size=400)
+        scorer.run([self.csv_path])
+        with open(scorer.checkpoint_path) as handle:
+            after_csv = json.load(handle)
+        self.assertEqual((after_csv['file'], after_csv['file_rows']), (0, 1500))
+        
+        scorer.run([self.csv_path, self.jsonl_path], resume=False)
+        with open(scorer.checkpoint_path, 'w') as handle:
+            json.dump(dict(after_csv, inputs=[os.path.abspath(self.csv_path),
+                                              os.path.abspath(self.jsonl_path)],
+                           file=1, file_rows=0), handle)
+        with mock.patch('app.models.bulk_scoring.pd.read_csv', side_effect=AssertionError):
+            summary = scorer.run([self.csv_path, self.jsonl_path])
+        self.assertEqual(summary['rows'], 2500)
+        self.assertEqual(len(pd.read_csv(self.output)), 2500)
+    
+    def test_checkpoint_for_other_job_is_rejected(self):
+        """Test a checkpoint from different inputs is not silently reused"""
+        scorer = BulkScorer(self.model_path, self.output, workers=1, chunk_size=1000)
+        scorer.run([self.csv_path])
+        with self.assertRaises(ValueError):
+            scorer.run([self.jsonl_path])
+        self.assertEqual(scorer.run([self.jsonl_path], resume=False)['rows'], 1000)
+    
+    def test_read_chunks(self):
+        """Test inputs are read in bounded chunks and unknown types are rejected"""
+        sizes = [len(chunk) for chunk in read_chunks(self.csv_path, 600)]
+        self.assertEqual(sizes, [600, 600, 300])
+        # Resuming skips raw rows: 1500 CSV rows, then 1000 JSONL rows
+        for path, skip, start, sizes in ((self.csv_path, 700, 700, [400, 400]),
+                                         (self.jsonl_path, 300, 1800, [400, 300])):
+            chunks = list(read_chunks(path, 400, skip_rows=skip))
+            self.assertEqual([len(chunk) for chunk in chunks], sizes)
+            self.assertEqual(list(chunks[0]['source_ip']),
+                             list(self.flows['source_ip'][start:start + 400]))
+        with self.assertRaises(ValueError):
+            list(read_chunks(os.path.join(self.tmpdir, 'flows.xml'), 100))
+
+if __name__ == '__main__':
+    unittest.main()
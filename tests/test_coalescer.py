@@ -0,0 +1,51 @@
+import unittest
+import threading
+import time
+from app.utils.coalescer import RequestCoalescer
+
+class TestRequestCoalescer(unittest.TestCase):
+    def setUp(self):
+        self.batches = []
+    
+    def score(self, records):
+        self.batches.append(len(records))
+        time.sleep(0.01)
+        return [{'value': record['value'] * 2} for record in records]
+    
+    def test_concurrent_requests_are_batched(self):
+        """Test concurrent callers share batches and each get their own result"""
+        coalescer = RequestCoalescer(self.score, max_batch=16, max_delay=0.005)
+        results = {}
+        
+        def call(value):
+            results[value] = coalescer.submit({'value': value})['value']
+        
+        threads = [threading.Thread(target=call, args=(value,)) for value in range(40)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        
+        self.assertEqual(results, {value: value * 2 for value in range(40)})
+        self.assertEqual(sum(self.batches), 40)
+        self.assertLess(len(self.batches), 40)
+        self.assertLessEqual(max(self.batches), 16)
+    
+    def test_idle_request_skips_deadline(self):
+        """Test a lone request is flushed without waiting for the deadline"""
+        coalescer = RequestCoalescer(self.score, max_batch=16, max_delay=1.0)
+        start = time.perf_counter()
+        self.assertEqual(coalescer.submit({'value': 3}), {'value': 6})
+        self.assertLess(time.perf_counter() - start, 0.5)
+    
+    def test_errors_reach_every_caller(self):
+        """Test a failing batch raises in the submitting thread"""
+        def fail(records):
+            raise RuntimeError('boom')
+        
+        coalescer = RequestCoalescer(fail)
+        with self.assertRaises(RuntimeError):
+            coalescer.submit({'value': 1})
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,73 @@
+import unittest
+import numpy as np
+from app.models.compiled_forest import CompiledForest
+from app.models.threat_detector import ThreatDetector
+
+class TestCompiledForest(unittest.TestCase):
+    def setUp(self):
+        rng = np.random.default_rng(7)
+        self.training_data = np.column_stack([
+            rng.normal(512, 150, 3000),
+            rng.poisson(12, 3000),
+            rng.choice([80, 443, 53, 22], 3000),
+            rng.choice([1, 2, 4, 5], 3000),
+            rng.exponential(0.8, 3000)
+        ])
+        self.probe = np.vstack([
+            self.training_data[:1000],
+            np.column_stack([
+                rng.normal(4000, 2000, 200),
+                rng.poisson(500, 200),
+                rng.integers(1, 65535, 200),
+                rng.integers(0, 6, 200),
+                rng.exponential(30, 200)
+            ])
+        ])
+        self.detector = ThreatDetector(compiled=False)
+        self.detector.train(self.training_data)
+    
+    def test_matches_decision_function(self):
+        """Test compiled scores match IsolationForest.decision_function"""
+        engine = CompiledForest.compile(self.detector.scaler, self.detector.model)
+        expected = self.detector.model.decision_function(self.detector.scaler.transform(self.probe))
+        
+        np.testing.assert_allclose(engine.decision_function(self.probe), expected,
+                                   rtol=0, atol=1e-6)
+        scaled = self.detector.scaler.transform(self.probe)
+        np.testing.assert_array_equal(engine.predict(self.probe),
+                                      self.detector.model.predict(scaled))
+    
+    def test_single_row_matches(self):
+        """Test single-row scoring matches the batch path"""
+        engine = CompiledForest.compile(self.detector.scaler, self.detector.model)
+        batch_scores = engine.decision_function(self.probe[:20])
+        for row, batch_score in zip(self.probe[:20], batch_scores):
+            self.assertAlmostEqual(engine.decision_function(row.reshape(1, -1))[0], batch_score,
+                                   places=12)
+    
+    def test_detector_uses_engine(self):
+        """Test the compiled detector gives the same verdicts as the sklearn path"""
+        compiled = ThreatDetector(compiled=True)
+        compiled.train(self.training_data)
+        records = [
+            {'packet_size': 500, 'frequency': 11, 'port': 443, 'protocol': 'HTTPS',
+             'duration': 0.4},
+            {'packet_size': 9000, 'frequency': 800, 'port': 31337, 'protocol': 'ICMP',
+             'duration': 60}
+        ]
+        
+        for compiled_result, reference in zip(compiled.predict_batch(records),
+                                              self.detector.predict_batch(records)):
+            self.assertEqual(compiled_result['is_threat'], reference['is_threat'])
+            self.assertAlmostEqual(compiled_result['confidence'], reference['confidence'], places=6)
+    
+    def test_engine_recompiles_after_model_change(self):
+        """Test the engine follows scaler/model swaps"""
+        detector = ThreatDetector(compiled=True)
+        detector.train(self.training_data)
+        first_engine = detector._get_engine()
+        detector.train(self.training_data[:1500])
+        self.assertIsNot(detector._get_engine(), first_engine)
+
+if __name__ == '__main__':
+    unittest.main()
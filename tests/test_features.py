@@ -0,0 +1,71 @@
+import unittest
+import numpy as np
+import pandas as pd
+from app.models.features import FeatureExtractor, FEATURE_COLUMNS, encode_protocol
+
+class TestFeatureExtractor(unittest.TestCase):
+    def setUp(self):
+        self.extractor = FeatureExtractor()
+        self.records = [
+            {'packet_size': 1024, 'frequency': 50, 'port': 443, 'protocol': 'https',
+             'duration': 0.5},
+            {'packet_size': '64', 'port': 53, 'protocol': 'UDP'},
+            {'packet_size': 1500, 'frequency': 3, 'port': 22, 'protocol': None, 'duration': 2.0},
+            {'packet_size': 40, 'frequency': 1, 'protocol': 'GRE'}
+        ]
+    
+    def test_record_list_matches_single_records(self):
+        """Test batch extraction matches per-record extraction"""
+        matrix = self.extractor.transform(self.records)
+        self.assertEqual(matrix.shape, (4, len(FEATURE_COLUMNS)))
+        self.assertEqual(matrix.dtype, np.float64)
+        
+        for row, record in zip(matrix, self.records):
+            np.testing.assert_array_equal(row, self.extractor.transform_record(record)[0])
+    
+    def test_defaults_and_protocol_encoding(self):
+        """Test missing fields are filled and protocols are encoded"""
+        matrix = self.extractor.transform(self.records)
+        np.testing.assert_array_equal(matrix[:, 3], [5, 2, 1, 0])
+        self.assertEqual(matrix[1, 1], 0)
+        self.assertEqual(matrix[3, 2], 80)
+        self.assertEqual(matrix[1, 0], 64)
+    
+    def test_dataframe_and_column_inputs(self):
+        """Test DataFrame and dict-of-arrays inputs produce the same matrix"""
+        expected = self.extractor.transform(self.records)
+        frame = pd.DataFrame.from_records(self.records)
+        np.testing.assert_array_equal(self.extractor.transform(frame), expected)
+        
+        columns = {
+            'packet_size': np.array([1024, 64, 1500, 40]),
+            'frequency': np.array([50, 0, 3, 1]),
+            'port': np.array([443, 53, 22, 80]),
+            'protocol': np.array(['https', 'UDP', None, 'GRE'], dtype=object),
+            'duration': np.array([0.5, 0.0, 2.0, 0.0])
+        }
+        np.testing.assert_array_equal(self.extractor.transform(columns), expected)
+    
+    def test_list_valued_extra_field_is_one_record(self):
+        """Test only feature fields decide between a record and a dict of columns"""
+        record = {'packet_size': 100, 'port': 22, 'protocol': 'TCP', 'flags': ['SYN', 'ACK']}
+        matrix = self.extractor.transform(record)
+        np.testing.assert_array_equal(matrix, [[100, 0, 22, 1, 0]])
+        with self.assertRaises(ValueError):
+            self.extractor.transform({'packet_size': [1, 2], 'port': [22]})
+    
+    def test_feature_matrix_passthrough(self):
+        """Test pre-built feature matrices are validated and passed through"""
+        matrix = self.extractor.transform([[1, 2, 3, 4, 5]])
+        self.assertEqual(matrix.shape, (1, 5))
+        with self.assertRaises(ValueError):
+            self.extractor.transform(np.zeros((2, 3)))
+    
+    def test_encode_protocol(self):
+        """Test scalar protocol encoding"""
+        self.assertEqual(encode_protocol(' tcp '), 1)
+        self.assertEqual(encode_protocol(None), 1)
+        self.assertEqual(encode_protocol('unknown'), 0)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,107 @@
+import unittest
+
+import numpy as np
+import pandas as pd
+
+from app.models.aggregation import FlowAggregator
+from app.models.features import AGGREGATE_COLUMNS, FeatureExtractor
+from app.models.rules import RuleEngine
+from app.utils.data_processor import NetworkDataProcessor
+from app.utils.flow_records import (FLOW_DTYPE, FlowRecord, as_records, epoch_seconds,
+                                    normalize_flows, pack_ipv4, unpack_ipv4)
+from app.utils.ip_intel import IPReputation, PrefixTable
+
+RECORDS = [
+    {'timestamp': '2024-01-01T00:00:00Z', 'source_ip': '203.0.113.7', 'destination_ip': '10.0.0.1',
+     'port': 22, 'protocol': 'tcp', 'packet_size': 60, 'frequency': 40, 'duration': 0.01},
+    {'timestamp': 1704067201.5, 'source_ip': '198.51.100.2', 'destination_ip': '10.0.0.2',
+     'port': '443', 'protocol': 'HTTPS', 'packet_size': 1400, 'frequency': 2, 'duration': 1.5},
+    {'source_ip': '2001:db8::1', 'port': 'bad', 'protocol': 'GRE', 'packet_size': -5}
+]
+
+
+class TestFlowRecords(unittest.TestCase):
+    def test_dtype_is_compact(self):
+        self.assertEqual(FLOW_DTYPE.itemsize, 31)
+
+    def test_pack_and_unpack_ipv4(self):
+        packed = pack_ipv4(['10.0.0.1', None, 'not-an-ip', '2001:db8::1', '10.0.0.1'])
+        self.assertEqual(packed.dtype, np.uint32)
+        self.assertEqual(packed.tolist(), [0x0A000001, 0, 0, 0, 0x0A000001])
+        self.assertEqual(unpack_ipv4(packed).tolist(), ['10.0.0.1', None, None, None, '10.0.0.1'])
+
+    def test_epoch_seconds(self):
+        seconds = epoch_seconds(['2024-01-01T00:00:00Z', '2024-01-01T01:00:00', 5, None, 'soon'],
+                                now=7.0)
+        self.assertEqual(seconds.tolist(), [1704067200.0, 1704070800.0, 5.0, 7.0, 7.0])
+
+    def test_normalize_matches_process_network_log(self):
+        flows = NetworkDataProcessor.process_network_batch(RECORDS)
+        self.assertEqual(flows.dtype, FLOW_DTYPE)
+        self.assertEqual(flows['timestamp'][:2].tolist(), [1704067200.0, 1704067201.5])
+        self.assertEqual(flows['port'].tolist(), [22, 443, 80])
+        self.assertEqual(flows['protocol'].tolist(), [1, 5, 0])
+        self.assertEqual(flows['packet_size'].tolist(), [60, 1400, 0])
+        self.assertEqual(flows['frequency'].tolist(), [40, 2, 1])
+        # IPv6 does not fit the packed column
+        self.assertEqual(flows['source_ip'][2], 0)
+
+        record = FlowRecord(flows, 0)
+        expected = NetworkDataProcessor.process_network_log(RECORDS[0])
+        for field in ('source_ip', 'destination_ip', 'port', 'protocol', 'packet_size',
+                      'frequency'):
+            self.assertEqual(record[field], expected[field])
+        self.assertEqual(record.get('source_connection_rate', 0), 0)
+        self.assertEqual(dict(record)['port'], 22)
+        self.assertIsNone(FlowRecord(flows, 2).get('destination_ip'))
+
+    def test_normalize_accepts_frames_and_empty_batches(self):
+        frame_flows = normalize_flows(pd.DataFrame(RECORDS[:2]))
+        self.assertEqual(frame_flows.tobytes(), normalize_flows(RECORDS[:2]).tobytes())
+        self.assertEqual(len(normalize_flows([])), 0)
+
+    def test_ipv4_only_declines_other_addresses(self):
+        self.assertIsNone(normalize_flows(RECORDS, ipv4_only=True))
+        self.assertIsNone(normalize_flows([{'source_ip': 'not-an-ip'}], ipv4_only=True))
+        flows = normalize_flows(RECORDS[:2] + [{'source_ip': '0.0.0.0'}], ipv4_only=True)
+        self.assertEqual(flows['source_ip'][2], 0)
+
+    def test_record_views_write_through(self):
+        flows = normalize_flows(RECORDS, aggregates=True)
+        flows[0]['port'] = 2222
+        views = list(as_records(flows))
+        self.assertEqual(views[0]['port'], 2222)
+        self.assertIs(as_records(RECORDS), RECORDS)
+
+    def test_features_match_dict_path(self):
+        reputation = IPReputation(blocklist=PrefixTable(['203.0.113.0/24']))
+        extractor = FeatureExtractor(reputation=reputation)
+        flows = normalize_flows(RECORDS[:2])
+        processed = [NetworkDataProcessor.process_network_log(record) for record in RECORDS[:2]]
+        # Durations are float32 in the flow array
+        np.testing.assert_allclose(extractor.transform(flows), extractor.transform(processed),
+                                   rtol=1e-6)
+        self.assertEqual(extractor.transform(flows)[:, 5].tolist(), [1, 0])
+
+    def test_rules_read_packed_addresses(self):
+        engine = RuleEngine({'rules': [{'name': 'ssh_from_scanner', 'ports': [22],
+                                        'source_cidrs': ['203.0.113.0/24'],
+                                        'threat_level': 'high'}]})
+        evaluation = engine.evaluate_batch(normalize_flows(RECORDS))
+        self.assertEqual(evaluation.is_threat.tolist(), [True, False, False])
+
+    def test_aggregator_shares_cells_with_dicts_and_fills_columns(self):
+        aggregator = FlowAggregator(window=60, buckets=6)
+        aggregator.observe([dict(RECORDS[0])], now=100.0)
+        flows = aggregator.enrich(normalize_flows(RECORDS, aggregates=True), now=100.0)
+        self.assertEqual(flows['source_connection_rate'][0], np.float32(2 / 60))
+        self.assertEqual(flows['source_connection_rate'][2], 0)
+
+        extractor = FeatureExtractor(aggregates=True)
+        features = extractor.transform(flows)
+        np.testing.assert_allclose(features[:, -len(AGGREGATE_COLUMNS)],
+                                   flows['source_connection_rate'])
+
+
+if __name__ == '__main__':
+    unittest.main()
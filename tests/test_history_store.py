@@ -0,0 +1,69 @@
+import unittest
+import os
+import tempfile
+import time
+from app.utils.history_store import HistoryStore, to_epoch
+
+class TestHistoryStore(unittest.TestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.store = HistoryStore(os.path.join(directory.name, 'history.db'),
+                                  retention_days=1, flush_interval=0.05)
+        self.addCleanup(self.store.close)
+        self.now = int(time.time())
+    
+    def record(self, count, timestamp, **fields):
+        entries = [dict({'timestamp': timestamp + index, 'threat_level': 'high',
+                         'source_ip': '10.0.0.1', 'destination_port': 22}, **fields)
+                   for index in range(count)]
+        self.assertEqual(self.store.record(entries), count)
+        self.assertTrue(self.store.flush())
+    
+    def test_query_filters_and_counts(self):
+        """Test time-range and field filters apply to both pages and counts"""
+        self.record(5, self.now - 1000)
+        self.record(3, self.now - 500, threat_level='medium', source_ip='10.0.0.2',
+                    destination_port=3389)
+        
+        threats, _ = self.store.query(start=self.now - 600)
+        self.assertEqual(len(threats), 3)
+        self.assertTrue(all(threat['threat_level'] == 'medium' for threat in threats))
+        self.assertEqual(threats[0]['action_taken'], 'investigating')
+        
+        self.assertEqual(self.store.counts(), {'high': 5, 'medium': 3})
+        self.assertEqual(self.store.counts(end=self.now - 997), {'high': 3})
+        self.assertEqual(self.store.counts(source_ip='10.0.0.2', destination_port=3389),
+                         {'medium': 3})
+        self.assertEqual(self.store.counts(threat_level='low'), {})
+    
+    def test_cursor_pagination(self):
+        """Test cursors walk every row newest first without overlap"""
+        self.record(25, self.now - 1000)
+        
+        seen, cursor = [], None
+        while True:
+            threats, cursor = self.store.query(cursor=cursor, limit=10)
+            seen.extend(threat['id'] for threat in threats)
+            if cursor is None:
+                break
+        
+        self.assertEqual(len(seen), 25)
+        self.assertEqual(seen, sorted(seen, reverse=True))
+    
+    def test_retention(self):
+        """Test rows older than the retention window are deleted"""
+        self.record(4, self.now - 1000)
+        self.record(2, self.now + 86000)
+        
+        self.assertEqual(self.store.apply_retention(now=self.now + 86400), 4)
+        self.assertEqual(self.store.counts(), {'high': 2})
+    
+    def test_to_epoch(self):
+        """Test ISO timestamps and epoch seconds both parse"""
+        self.assertEqual(to_epoch('1970-01-01T00:01:00Z'), 60)
+        self.assertEqual(to_epoch('60'), 60)
+        self.assertIsNone(to_epoch(''))
+
+if __name__ == '__main__':
+    unittest.main()
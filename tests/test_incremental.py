@@ -0,0 +1,181 @@
+import shutil
+import tempfile
+import unittest
+import numpy as np
+from app.models.artifact import PackedForest
+from app.models.incremental import IncrementalLearner, ReservoirSample
+from app.models.threat_detector import ThreatDetector
+
+def make_traffic(rng, n, packet_mean=512):
+    return np.column_stack([
+        rng.normal(packet_mean, 50, n),
+        rng.poisson(10, n),
+        rng.choice([80, 443], n),
+        rng.choice([1, 2], n),
+        rng.exponential(0.5, n)
+    ])
+
+def _tree_arrays(packed, first, last):
+    """Node arrays of trees [first, last) of a packed forest, renumbered from 0"""
+    roots = np.asarray(packed.tree_roots)
+    start = roots[first]
+    end = roots[last] if last < len(roots) else len(packed.node_feature)
+    renumber = lambda children: np.where(children >= 0, children - start, -1)  # noqa: E731
+    return {
+        'node_feature': np.asarray(packed.node_feature[start:end]),
+        'node_threshold': np.asarray(packed.node_threshold[start:end]),
+        'node_left': renumber(np.asarray(packed.node_left[start:end])),
+        'node_right': renumber(np.asarray(packed.node_right[start:end])),
+        'node_value': np.asarray(packed.node_value[start:end]),
+        'tree_roots': roots[first:last] - start
+    }
+
+def _tail_trees(packed, count):
+    return _tree_arrays(packed, packed.n_trees - count, packed.n_trees)
+
+def _head_trees(packed, count):
+    return _tree_arrays(packed, 0, count)
+
+class TestReservoirSample(unittest.TestCase):
+    def test_reservoir_is_bounded(self):
+        """Test the reservoir never grows past its capacity"""
+        reservoir = ReservoirSample(100, 5, random_state=0)
+        for start in range(0, 10000, 500):
+            reservoir.add(np.full((500, 5), start, dtype=float), now=0)
+        
+        self.assertEqual(len(reservoir), 100)
+        self.assertEqual(reservoir.seen, 10000)
+        # A uniform sample over 20 equal batches should not be dominated by one
+        _, counts = np.unique(reservoir.sample()[:, 0], return_counts=True)
+        self.assertLess(counts.max(), 30)
+    
+    def test_reservoir_expiry(self):
+        """Test rows older than max_age are dropped"""
+        reservoir = ReservoirSample(100, 5, max_age=60, random_state=0)
+        reservoir.add(np.zeros((50, 5)), now=0)
+        reservoir.add(np.ones((20, 5)), now=100)
+        
+        self.assertEqual(len(reservoir), 20)
+        self.assertTrue((reservoir.sample() == 1).all())
+
+class TestIncrementalLearner(unittest.TestCase):
+    def setUp(self):
+        self.rng = np.random.default_rng(0)
+        self.published = []
+    
+    def test_initial_fit_when_untrained(self):
+        """Test the first refresh fits a model from the sample"""
+        learner = IncrementalLearner(ThreatDetector(), self.published.append, refresh_every=300,
+                                     min_samples=300, background=False, random_state=0)
+        self.assertFalse(learner.observe(make_traffic(self.rng, 200)))
+        self.assertTrue(learner.observe(make_traffic(self.rng, 200)))
+        
+        self.assertEqual(len(self.published), 1)
+        self.assertTrue(self.published[0].is_trained)
+        self.assertEqual(learner.pending, 0)
+    
+    def test_refresh_replaces_fraction_of_trees(self):
+        """Test a refresh swaps only the oldest fraction of trees"""
+        detector = ThreatDetector()
+        detector.train(make_traffic(self.rng, 1000))
+        learner = IncrementalLearner(detector, self.published.append, refresh_every=500,
+                                     refresh_fraction=0.25, min_samples=100,
+                                     background=False, random_state=0)
+        
+        learner.observe(make_traffic(self.rng, 500, packet_mean=900))
+        
+        updated = self.published[-1]
+        self.assertIsNot(updated, detector)
+        self.assertEqual(len(updated.model.estimators_), len(detector.model.estimators_))
+        old_trees = detector.model.estimators_
+        new_trees = updated.model.estimators_
+        n_replaced = len(old_trees) // 4
+        for old_tree, new_tree in zip(old_trees[n_replaced:], new_trees[:-n_replaced]):
+            np.testing.assert_array_equal(old_tree.tree_.feature, new_tree.tree_.feature)
+        # The original detector keeps serving unchanged until the swap
+        self.assertIs(detector.model.estimators_, old_trees)
+        self.assertFalse(np.allclose(updated.scaler.mean_, detector.scaler.mean_))
+        
+        # Shifted traffic should now look more normal to the updated model
+        shifted = make_traffic(self.rng, 200, packet_mean=900)
+        old_scores = detector.model.decision_function(detector.scaler.transform(shifted))
+        new_scores = updated.model.decision_function(updated.scaler.transform(shifted))
+        self.assertGreater(new_scores.mean(), old_scores.mean())
+    
+    def test_rescaled_trees_route_rows_identically(self):
+        """Test kept trees send raw rows to the same leaves after a scaler update"""
+        detector = ThreatDetector()
+        detector.train(make_traffic(self.rng, 1000))
+        learner = IncrementalLearner(detector, self.published.append, background=False)
+        learner.observe(make_traffic(self.rng, 500, packet_mean=700))
+        
+        rows = make_traffic(self.rng, 100)
+        tree = detector.model.estimators_[0]
+        rescaled = learner._rescale_tree(tree, detector.model.estimators_features_[0],
+                                         detector.scaler, learner.scaler)
+        old_leaves = tree.apply(detector.scaler.transform(rows).astype(np.float32))
+        new_leaves = rescaled.apply(learner.scaler.transform(rows).astype(np.float32))
+        self.assertGreater((old_leaves == new_leaves).mean(), 0.95)
+    
+    def test_refresh_of_replaced_detector_is_dropped(self):
+        """Test a refresh that overlaps a rebase does not publish trees of the old model"""
+        detector = ThreatDetector()
+        detector.train(make_traffic(self.rng, 1000))
+        retrained = ThreatDetector()
+        retrained.train(make_traffic(self.rng, 1000))
+        learner = IncrementalLearner(detector, self.published.append, refresh_every=500,
+                                     min_samples=100, background=False, random_state=0)
+        replace_trees = learner._replace_trees
+        
+        def rebased_meanwhile(*args):
+            learner.rebase(retrained)
+            return replace_trees(*args)
+        
+        learner._replace_trees = rebased_meanwhile
+        learner.observe(make_traffic(self.rng, 500))
+        self.assertEqual(self.published, [])
+        self.assertIs(learner.detector, retrained)
+        self.assertEqual(learner.refresh_count, 0)
+    
+    def test_refresh_replaces_trees_of_packed_forest(self):
+        """Test a detector loaded from an artifact is refreshed, not refit from the sample"""
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory, ignore_errors=True)
+        trained = ThreatDetector()
+        trained.train(make_traffic(self.rng, 1000))
+        trained.save_artifact(directory)
+        detector = ThreatDetector()
+        detector.load_model(directory)
+        learner = IncrementalLearner(detector, self.published.append, refresh_every=500,
+                                     refresh_fraction=0.25, min_samples=100,
+                                     background=False, random_state=0)
+        
+        learner.observe(make_traffic(self.rng, 500, packet_mean=900))
+        
+        updated = self.published[-1]
+        self.assertIsInstance(updated.model, PackedForest)
+        self.assertEqual(updated.model.n_trees, detector.model.n_trees)
+        self.assertEqual(updated.model.contamination, 0.1)
+        # Kept trees still route raw rows as before the scaler moved
+        rows = make_traffic(self.rng, 200)
+        n_kept = detector.model.n_trees - detector.model.n_trees // 4
+        old_kept = PackedForest(_tail_trees(detector.model, n_kept), 256, 0.0, 5)
+        new_kept = PackedForest(_head_trees(updated.model, n_kept), 256, 0.0, 5)
+        np.testing.assert_allclose(old_kept.score_samples(detector.scaler.transform(rows)),
+                                   new_kept.score_samples(updated.scaler.transform(rows)),
+                                   rtol=1e-6)
+        
+        shifted = make_traffic(self.rng, 200, packet_mean=900)
+        old_scores = detector.model.decision_function(detector.scaler.transform(shifted))
+        new_scores = updated.model.decision_function(updated.scaler.transform(shifted))
+        self.assertGreater(new_scores.mean(), old_scores.mean())
+    
+    def test_threats_are_excluded_from_sample(self):
+        """Test flagged traffic does not enter the baseline sample"""
+        learner = IncrementalLearner(ThreatDetector(), self.published.append, background=False)
+        learner.observe(make_traffic(self.rng, 4), [{'is_threat': True}, {'is_threat': False},
+                                                    {'is_threat': True}, {'is_threat': False}])
+        self.assertEqual(len(learner.reservoir), 2)
+
+if __name__ == '__main__':
+    unittest.main()
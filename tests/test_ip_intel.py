@@ -0,0 +1,102 @@
+import unittest
+import os
+import tempfile
+import numpy as np
+from app.models.features import FeatureExtractor
+from app.models.rules import RuleEngine
+from app.utils.ip_intel import ALLOWLISTED, BLOCKLISTED, UNKNOWN, IPReputation, PrefixTable
+
+class TestPrefixTable(unittest.TestCase):
+    def test_longest_prefix_match(self):
+        """Test nested prefixes resolve to the most specific one"""
+        table = PrefixTable([('10.0.0.0/8', 'corp'), ('10.1.0.0/16', 'lab'),
+                             ('10.1.2.0/24', 'dmz'), ('192.0.2.7', 'host')])
+        
+        self.assertEqual(table.match('10.9.9.9')[1], 'corp')
+        self.assertEqual(table.match('10.1.9.9')[1], 'lab')
+        self.assertEqual(table.match('10.1.2.3')[1], 'dmz')
+        # Addresses after a nested block fall back to its parent
+        self.assertEqual(table.match('10.1.3.0')[1], 'lab')
+        self.assertEqual(table.match('10.2.0.0')[1], 'corp')
+        self.assertEqual(table.match('192.0.2.7')[1], 'host')
+        self.assertIsNone(table.match('192.0.2.8'))
+        self.assertIsNone(table.match('11.0.0.0'))
+    
+    def test_ipv6_and_invalid_addresses(self):
+        """Test IPv6 prefixes and unparseable addresses in one batch"""
+        table = PrefixTable(['2001:db8::/32', '2001:db8:ff::/48', '255.255.255.255/32',
+                             'ffff::/16'])
+        addresses = ['2001:db8::1', '2001:db8:ff::1', '2001:db9::1', 'ffff:ffff::1',
+                     '255.255.255.255', 'not-an-ip', None, '999.1.1.1']
+        
+        self.assertEqual(table.lookup(addresses).tolist(), [0, 1, -1, 3, 2, -1, -1, -1])
+    
+    def test_batch_matches_brute_force(self):
+        """Test vectorized lookups agree with a linear scan over random prefixes"""
+        import ipaddress
+        rng = np.random.default_rng(0)
+        prefixes = [str(ipaddress.ip_network((int(address), int(length)), strict=False))
+                    for address, length in zip(rng.integers(0, 2 ** 32, 500),
+                                               rng.integers(8, 33, 500))]
+        table = PrefixTable(prefixes)
+        addresses = [str(ipaddress.ip_address(int(value)))
+                     for value in rng.integers(0, 2 ** 32, 2000)]
+        addresses += [str(table.networks[index].network_address) for index in range(0, 500, 5)]
+        
+        found = table.lookup(addresses)
+        for address, owner in zip(addresses, found):
+            address = ipaddress.ip_address(address)
+            covering = [network for network in table.networks if address in network]
+            if covering:
+                self.assertEqual(table.networks[owner].prefixlen,
+                                 max(n.prefixlen for n in covering))
+            else:
+                self.assertEqual(owner, -1)
+    
+    def test_from_file(self):
+        """Test list files with labels, comments and invalid lines"""
+        with tempfile.NamedTemporaryFile('w', suffix='.txt', delete=False) as handle:
+            handle.write('# feed\n203.0.113.0/24 scanner\n\nbogus\n198.51.100.1  # single host\n')
+        self.addCleanup(os.remove, handle.name)
+        
+        table = PrefixTable.from_file(handle.name)
+        self.assertEqual(len(table), 2)
+        self.assertEqual(table.match('203.0.113.50')[1], 'scanner')
+        self.assertTrue(table.contains(['198.51.100.1'])[0])
+
+class TestIPReputation(unittest.TestCase):
+    def setUp(self):
+        self.reputation = IPReputation(PrefixTable(['203.0.113.0/24']),
+                                       PrefixTable(['203.0.113.10']))
+    
+    def test_allowlist_wins(self):
+        """Test allowlisted addresses override the blocklist"""
+        codes = self.reputation.reputation(['203.0.113.1', '203.0.113.10', '10.0.0.1'])
+        self.assertEqual(codes.tolist(), [BLOCKLISTED, ALLOWLISTED, UNKNOWN])
+    
+    def test_reputation_features(self):
+        """Test reputation columns are appended to the feature matrix"""
+        extractor = FeatureExtractor(reputation=self.reputation)
+        records = [{'packet_size': 1, 'source_ip': '203.0.113.1', 'destination_ip': '10.0.0.1'},
+                   {'packet_size': 2, 'source_ip': '10.0.0.2', 'destination_ip': '203.0.113.10'}]
+        
+        matrix = extractor.transform(records)
+        self.assertEqual(matrix.shape, (2, 7))
+        self.assertEqual(matrix[:, 5:].tolist(), [[1, 0], [0, -1]])
+        np.testing.assert_array_equal(extractor.transform(records[0]), matrix[:1])
+    
+    def test_reputation_rule(self):
+        """Test rules can match on endpoint reputation"""
+        engine = RuleEngine({'rules': [{'name': 'blocked', 'source_reputation': ['blocklisted'],
+                                        'threat_level': 'high', 'verdict': 'malicious'}]},
+                            reputation=self.reputation)
+        evaluation = engine.evaluate_batch([{'source_ip': '203.0.113.1'},
+                                            {'source_ip': '203.0.113.10'}])
+        
+        self.assertEqual(evaluation.is_threat.tolist(), [True, False])
+        self.assertEqual(evaluation.verdicts.tolist(), [1, 0])
+        self.assertEqual(engine.evaluate({'source_ip': '203.0.113.1'}).verdicts, [1])
+        self.assertEqual(engine.evaluate({'source_ip': '203.0.113.10'}).verdicts, [0])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -56,5 +56,43 @@ class TestThreatDetector(unittest.TestCase):
         self.assertEqual(self.detector._calculate_threat_level(0.5), 'medium')
         self.assertEqual(self.detector._calculate_threat_level(0.2), 'low')
 
+    def test_predict_batch_untrained(self):
+        """Test batch prediction falls back to rule-based detection"""
+        records = [
+            {'port': 1433, 'packet_size': 512, 'frequency': 10},
+            {'port': 80, 'packet_size': 512, 'frequency': 10}
+        ]
+        
+        results = self.detector.predict_batch(records)
+        self.assertEqual(len(results), 2)
+        self.assertTrue(results[0]['is_threat'])
+        self.assertFalse(results[1]['is_threat'])
+    
+    def test_predict_batch_matches_single(self):
+        """Test batch prediction matches single-record prediction"""
+        rng = np.random.default_rng(0)
+        training_data = np.column_stack([
+            rng.normal(512, 100, 200),
+            rng.poisson(10, 200),
+            rng.choice([80, 443], 200),
+            rng.choice([1, 2], 200),
+            rng.exponential(0.5, 200)
+        ])
+        self.assertTrue(self.detector.train(training_data))
+        
+        records = [
+            {'packet_size': 500, 'frequency': 9, 'port': 80, 'protocol': 'TCP', 'duration': 0.4},
+            {'packet_size': 9000, 'frequency': 900, 'port': 3389, 'protocol': 'ICMP',
+             'duration': 30}
+        ]
+        
+        batch_results = self.detector.predict_batch(records)
+        for record, batch_result in zip(records, batch_results):
+            single_result = self.detector.predict_threat(record)
+            self.assertEqual(batch_result['is_threat'], single_result['is_threat'])
+            self.assertAlmostEqual(batch_result['confidence'], single_result['confidence'])
+            self.assertEqual(batch_result['threat_level'], single_result['threat_level'])
+        self.assertTrue(batch_results[1]['is_threat'])
+
 if __name__ == '__main__':
     unittest.main()
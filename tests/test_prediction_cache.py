@@ -0,0 +1,109 @@
+import os
+import unittest
+import pickle
+from unittest import mock
+import numpy as np
+from app.models.prediction_cache import PredictionCache, parse_quantization
+from app.models.threat_detector import ThreatDetector
+
+def make_training(seed=0, n=500):
+    rng = np.random.default_rng(seed)
+    return np.column_stack([
+        rng.normal(512, 50, n), rng.poisson(10, n), rng.choice([80, 443], n),
+        rng.choice([1, 2], n), rng.exponential(0.5, n)
+    ])
+
+class TestPredictionCache(unittest.TestCase):
+    def test_lru_eviction(self):
+        """Test the least recently used entry is evicted at capacity"""
+        cache = PredictionCache(max_entries=2)
+        version = object()
+        rows = np.eye(3)
+        keys = cache.keys(rows)
+        cache.store(keys[:2], [0.1, 0.2], version)
+        cache.lookup(rows[:1], version)
+        cache.store(keys[2:], [0.3], version)
+        
+        scores, pending = cache.lookup(rows, version)
+        self.assertEqual(list(pending.values()), [[1]])
+        self.assertEqual(scores[[0, 2]].tolist(), [0.1, 0.3])
+        self.assertEqual(cache.stats()['evictions'], 1)
+    
+    def test_memory_limit(self):
+        """Test max_bytes caps the number of entries"""
+        cache = PredictionCache(max_entries=10 ** 6, max_bytes=10 * (40 + 200))
+        rows = np.arange(100, dtype=float).reshape(20, 5)
+        cache.store(cache.keys(rows), np.zeros(20), object())
+        self.assertEqual(len(cache), 10)
+    
+    def test_version_mismatch_misses(self):
+        """Test entries written under another model version are not served"""
+        cache = PredictionCache()
+        rows = np.ones((1, 5))
+        cache.store(cache.keys(rows), [0.5], object())
+        _, pending = cache.lookup(rows, object())
+        self.assertEqual(len(pending), 1)
+    
+    def test_quantization(self):
+        """Test quantized columns share keys within a step"""
+        columns = ['packet_size', 'frequency', 'port_number', 'protocol_type',
+                   'connection_duration']
+        quantization = parse_quantization('packet_size=8, connection_duration=0.1')
+        cache = PredictionCache(quantization=quantization, columns=columns)
+        keys = cache.keys([[512, 10, 80, 1, 0.52], [514, 10, 80, 1, 0.48], [530, 10, 80, 1, 0.5]])
+        self.assertEqual(keys[0], keys[1])
+        self.assertNotEqual(keys[0], keys[2])
+        with self.assertRaises(ValueError):
+            PredictionCache(quantization={'bogus': 1}, columns=columns)
+    
+    def test_pickle_drops_entries(self):
+        """Test pickled caches keep their settings but not their entries"""
+        cache = PredictionCache(max_entries=7)
+        cache.store(cache.keys(np.ones((1, 5))), [0.5], object())
+        restored = pickle.loads(pickle.dumps(cache))
+        self.assertEqual((restored.max_entries, len(restored)), (7, 0))
+
+class TestDetectorCache(unittest.TestCase):
+    def setUp(self):
+        self.detector = ThreatDetector(cache=PredictionCache())
+        self.detector.train(make_training())
+        self.scored = []
+        original = self.detector.decision_scores
+        def counting(features):
+            self.scored.append(len(features))
+            return original(features)
+        self.detector.decision_scores = counting
+    
+    def test_batch_scores_only_distinct_misses(self):
+        """Test repeated rows are scored once and served from cache afterwards"""
+        rows = make_training(seed=1, n=20)
+        batch = np.vstack([rows, rows[:5]])
+        first = self.detector._score_matrix(batch)
+        second = self.detector._score_matrix(batch)
+        
+        self.assertEqual(self.scored, [20])
+        self.assertEqual(first, second)
+        self.assertEqual(self.detector.cache.stats()['hits'], 25)
+        uncached = ThreatDetector(cache=False)
+        uncached.scaler, uncached.model = self.detector.scaler, self.detector.model
+        uncached.is_trained = True
+        self.assertEqual(uncached._score_matrix(batch), first)
+    
+    def test_retrain_invalidates(self):
+        """Test training a new model stops serving the old model's scores"""
+        rows = make_training(seed=1, n=10)
+        self.detector._score_matrix(rows)
+        self.detector.train(make_training(seed=2))
+        self.detector._score_matrix(rows)
+        self.assertEqual(self.scored, [10, 10])
+
+    def test_off_unless_configured(self):
+        """Test the default cache is only built when PREDICTION_CACHE_ENTRIES is set"""
+        with mock.patch.dict(os.environ):
+            os.environ.pop('PREDICTION_CACHE_ENTRIES', None)
+            self.assertIsNone(ThreatDetector().cache)
+            os.environ['PREDICTION_CACHE_ENTRIES'] = '50'
+            self.assertEqual(ThreatDetector().cache.max_entries, 50)
+
+if __name__ == '__main__':
+    unittest.main()
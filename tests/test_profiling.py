@@ -0,0 +1,146 @@
+import json
+import os
+import tempfile
+import time
+import unittest
+from unittest import mock
+
+from app.main import create_app
+from app.utils.metrics import request_spans, stage_timer
+from app.utils.profiling import ProfileSession, profiler
+
+RECORD = {'packet_size': 512, 'port': 443, 'protocol': 'TCP'}
+
+
+def _busy(seconds):
+    end = time.perf_counter() + seconds
+    while time.perf_counter() < end:
+        pass
+
+
+class TestProfileSession(unittest.TestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.output_dir = directory.name
+
+    def test_rejects_bad_options(self):
+        with self.assertRaises(ValueError):
+            ProfileSession(mode='perf', output_dir=self.output_dir)
+        with self.assertRaises(ValueError):
+            ProfileSession(sample_rate=0, output_dir=self.output_dir)
+        with self.assertRaises(ValueError):
+            ProfileSession(duration=None, max_requests=None, output_dir=self.output_dir)
+
+    def test_cprofile_session_writes_stats_and_spans(self):
+        session = ProfileSession(mode='cprofile', duration=None, max_requests=2,
+                                 output_dir=self.output_dir).start()
+        for _ in range(2):
+            token = session.begin_request()
+            with stage_timer('scoring'):
+                _busy(0.002)
+            session.end_request(token, '/api/analyze')
+        self.assertEqual(session.expired(), 'requests')
+        self.assertIsNone(session.begin_request())
+        self.assertIsNone(request_spans.get())
+
+        files = session.stop()
+        names = {os.path.basename(path) for path in files}
+        self.assertEqual(names, {'profile.prof', 'profile.txt', 'spans.folded', 'summary.json'})
+        with open(os.path.join(session.output_path, 'summary.json')) as handle:
+            summary = json.load(handle)
+        self.assertEqual(summary['profiled_requests'], 2)
+        self.assertEqual(summary['pid'], os.getpid())
+        self.assertEqual(summary['stages']['scoring']['count'], 2)
+        self.assertGreaterEqual(summary['stages']['scoring']['p50_ms'], 2)
+        with open(os.path.join(session.output_path, 'spans.folded')) as handle:
+            lines = handle.read().splitlines()
+        self.assertTrue(lines[0].startswith('/api/analyze;scoring '))
+        self.assertEqual(session.stop(), files)
+
+    def test_sampling_session_collects_folded_stacks(self):
+        session = ProfileSession(mode='sampling', duration=5, interval=0.001,
+                                 output_dir=self.output_dir).start()
+        token = session.begin_request()
+        _busy(0.1)
+        session.end_request(token, '/api/analyze')
+        session.stop()
+
+        self.assertGreater(session.summary()['stack_samples'], 0)
+        with open(os.path.join(session.output_path, 'stacks.folded')) as handle:
+            stack, count = handle.readline().rsplit(' ', 1)
+        self.assertIn('_busy (test_profiling.py', stack)
+        self.assertGreater(int(count), 0)
+
+    def test_unsampled_requests_are_not_profiled(self):
+        session = ProfileSession(mode='cprofile', sample_rate=0.5, output_dir=self.output_dir)
+        with mock.patch('app.utils.profiling.random.random', return_value=0.9):
+            self.assertIsNone(session.begin_request())
+        self.assertEqual(session.profiled, 0)
+        session.stop()
+
+
+class TestProfilingAPI(unittest.TestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.addCleanup(profiler.stop)
+        patcher = mock.patch.object(profiler, 'output_dir', directory.name)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.app = create_app()
+        self.app.config['TESTING'] = True
+        self.client = self.app.test_client()
+
+    def test_admin_token_required(self):
+        with mock.patch.dict(os.environ, {}, clear=False):
+            os.environ.pop('ADMIN_TOKEN', None)
+            self.assertEqual(self.client.get('/api/admin/profile').status_code, 404)
+        with mock.patch.dict(os.environ, {'ADMIN_TOKEN': 'secret'}):
+            self.assertEqual(self.client.get('/api/admin/profile').status_code, 403)
+            response = self.client.get('/api/admin/profile', headers={'X-Admin-Token': 'wrong'})
+            self.assertEqual(response.status_code, 403)
+
+    def test_profile_n_requests(self):
+        headers = {'X-Admin-Token': 'secret'}
+        with mock.patch.dict(os.environ, {'ADMIN_TOKEN': 'secret'}):
+            response = self.client.post('/api/admin/profile', headers=headers,
+                                        json={'mode': 'cprofile', 'requests': 2})
+            self.assertEqual(response.status_code, 202)
+            self.assertEqual(self.client.post('/api/admin/profile', headers=headers,
+                                              json={'requests': 1}).status_code, 409)
+
+            for _ in range(3):
+                self.client.post('/api/analyze', json=RECORD)
+            for _ in range(100):
+                if profiler.session is None:
+                    break
+                time.sleep(0.01)
+            self.assertTrue(profiler.last_session.wait(5))
+
+            response = self.client.get('/api/admin/profile', headers=headers)
+            session = json.loads(response.data)['session']
+            self.assertFalse(session['active'])
+            self.assertEqual(session['stopped_reason'], 'requests')
+            self.assertEqual(session['profiled_requests'], 2)
+            for stage in ('request', 'parse', 'validate', 'serialization'):
+                self.assertIn(stage, session['stages'])
+            self.assertTrue(all(os.path.exists(path) for path in session['files']))
+            self.assertEqual(self.client.delete('/api/admin/profile', headers=headers).status_code,
+                             409)
+
+    def test_profile_stop_writes_files(self):
+        headers = {'X-Admin-Token': 'secret'}
+        with mock.patch.dict(os.environ, {'ADMIN_TOKEN': 'secret'}):
+            self.assertEqual(self.client.post('/api/admin/profile', headers=headers,
+                                              json={'mode': 'fast'}).status_code, 400)
+            self.client.post('/api/admin/profile', headers=headers, json={'duration': 60})
+            self.client.post('/api/analyze', json=RECORD)
+            response = self.client.delete('/api/admin/profile', headers=headers)
+            session = json.loads(response.data)['session']
+            self.assertEqual(session['stopped_reason'], 'stopped')
+            self.assertIn('summary.json', [os.path.basename(path) for path in session['files']])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,210 @@
+import os
+import shutil
+import tempfile
+import unittest
+import numpy as np
+from app.api import routes
+from app.main import create_app
+from app.models.registry import ModelRegistry, RegistryError, RegistryWatcher
+from app.models.shadow import ShadowScorer
+from app.models.threat_detector import ThreatDetector
+from app.utils.flow_records import normalize_flows
+
+def trained_detector(seed):
+    rng = np.random.default_rng(seed)
+    detector = ThreatDetector(cache=False)
+    detector.train(np.column_stack([
+        rng.normal(512, 100, 500),
+        rng.poisson(10, 500),
+        rng.choice([80, 443, 22], 500),
+        rng.choice([1, 2, 5], 500),
+        rng.exponential(0.5, 500)
+    ]))
+    return detector
+
+RECORDS = [{'packet_size': size, 'port': port, 'protocol': 'TCP', 'frequency': 10, 'duration': 0.5}
+           for size, port in [(512, 80), (520, 443), (60000, 3389), (5, 1433)]]
+
+class TestModelRegistry(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmpdir, ignore_errors=True)
+        self.registry = ModelRegistry(self.tmpdir, keep=3)
+    
+    def test_publish_activate_and_rollback(self):
+        """Test versions are numbered, activated and rolled back in order"""
+        first = self.registry.publish(trained_detector(0), activate=True)
+        second = self.registry.publish(trained_detector(1), activate=True)
+        self.assertEqual((first, second), ('v0001', 'v0002'))
+        self.assertEqual(self.registry.current_version(), 'v0002')
+        
+        self.assertEqual(self.registry.rollback(), 'v0001')
+        self.assertEqual(self.registry.current_version(), 'v0001')
+        with self.assertRaises(RegistryError):
+            self.registry.rollback()
+        with self.assertRaises(RegistryError):
+            self.registry.activate('v0099')
+    
+    def test_load_matches_published_model(self):
+        """Test a loaded version scores like the detector that was published"""
+        detector = trained_detector(0)
+        version = self.registry.publish(detector)
+        loaded = self.registry.load(version)
+        self.assertEqual(loaded.registry_version, version)
+        self.assertEqual([r['is_threat'] for r in loaded.predict_batch(RECORDS)],
+                         [r['is_threat'] for r in detector.predict_batch(RECORDS)])
+    
+    def test_prune_keeps_referenced_versions(self):
+        """Test old versions are pruned unless current, in history or shadowed"""
+        self.registry.publish(trained_detector(0), activate=True)
+        for seed in range(1, 5):
+            self.registry.publish(trained_detector(seed))
+        self.assertEqual(self.registry.versions(), ['v0001', 'v0003', 'v0004', 'v0005'])
+
+class TestRegistryWatcher(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmpdir, ignore_errors=True)
+        self.registry = ModelRegistry(self.tmpdir)
+        self.served, self.shadows = [], []
+        self.watcher = RegistryWatcher(self.registry, self.served.append,
+                                       lambda *args: self.shadows.append(args))
+    
+    def test_follows_pointer_changes(self):
+        """Test activation and shadow changes are loaded once each"""
+        first = self.registry.publish(trained_detector(0), activate=True)
+        self.watcher.check()
+        self.watcher.check()
+        self.assertEqual([d.registry_version for d in self.served], [first])
+        
+        second = self.registry.publish(trained_detector(1))
+        self.registry.set_shadow(second, 0.5)
+        self.watcher.check()
+        self.assertEqual(self.shadows[-1][1:], (second, 0.5))
+        self.registry.set_shadow(None)
+        self.watcher.check()
+        self.assertEqual(self.shadows[-1], (None, None, 0.0))
+    
+    def test_failed_load_keeps_serving(self):
+        """Test a corrupt version is not published and not retried every poll"""
+        version = self.registry.publish(trained_detector(0), activate=True)
+        os.remove(os.path.join(self.registry.path(version), 'node_left.npy'))
+        self.watcher.check()
+        self.watcher.check()
+        self.assertEqual(self.served, [])
+        self.assertFalse(self.watcher.wait_for(version, timeout=0.1))
+
+    @unittest.skipUnless(hasattr(os, 'fork'), 'needs os.fork')
+    def test_restarts_in_forked_worker(self):
+        """Test a watcher started before a fork, as under preload_app, runs in the child"""
+        first = self.registry.publish(trained_detector(0), activate=True)
+        second = self.registry.publish(trained_detector(1))
+        watcher = RegistryWatcher(self.registry, lambda detector: None, lambda *args: None,
+                                  poll_interval=60)
+        watcher.start()
+        self.addCleanup(watcher.stop)
+        self.assertTrue(watcher.wait_for(first, timeout=10))
+        
+        pid = os.fork()
+        if pid == 0:
+            status = 1
+            try:
+                watcher.start()
+                self.registry.activate(second)
+                watcher.refresh()
+                status = 0 if watcher.wait_for(second, timeout=10) else 2
+            finally:
+                os._exit(status)
+        _, status = os.waitpid(pid, 0)
+        self.assertEqual(os.waitstatus_to_exitcode(status), 0)
+        # The parent's own thread is untouched
+        self.assertTrue(watcher._thread.is_alive())
+
+class TestShadowScorer(unittest.TestCase):
+    def test_agreement_statistics(self):
+        """Test the candidate scores sampled traffic off the request path"""
+        primary = trained_detector(0)
+        scorer = ShadowScorer(primary, 'v0001', sample_rate=1.0).start()
+        results = primary.predict_batch(RECORDS)
+        scorer.offer(RECORDS, results)
+        flipped = [dict(result, is_threat=not result['is_threat']) for result in results]
+        scorer.offer(RECORDS[:1], flipped[:1])
+        scorer.stop()
+        
+        stats = scorer.stats()
+        self.assertEqual(stats['scored'], 5)
+        self.assertAlmostEqual(stats['agreement'], 4 / 5)
+        self.assertEqual(stats['primary_only_threats'] + stats['shadow_only_threats'], 1)
+        self.assertIsNotNone(stats['batch_latency_ms'])
+    
+    def test_accepts_flow_arrays(self):
+        """Test flow arrays are sampled as dicts for the candidate"""
+        primary = trained_detector(0)
+        scorer = ShadowScorer(primary, sample_rate=1.0).start()
+        flows = normalize_flows(RECORDS)
+        scorer.offer(flows, primary.predict_batch(flows))
+        scorer.stop()
+        self.assertEqual(scorer.stats()['scored'], len(RECORDS))
+        self.assertEqual(scorer.stats()['agreement'], 1.0)
+    
+    def test_full_queue_drops(self):
+        """Test offers never block when the candidate falls behind"""
+        scorer = ShadowScorer(trained_detector(0), sample_rate=1.0, max_queue=1)
+        for _ in range(3):
+            scorer.offer(RECORDS, [{'is_threat': False}] * len(RECORDS))
+        self.assertEqual(scorer.stats()['dropped'], 2 * len(RECORDS))
+
+class TestRegistryAPI(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmpdir, ignore_errors=True)
+        self.registry = ModelRegistry(self.tmpdir)
+        self.first = self.registry.publish(trained_detector(0), activate=True)
+        self.second = self.registry.publish(trained_detector(1))
+        
+        for name in ('model_registry', 'registry_watcher', 'threat_detector', 'shadow_scorer'):
+            self.addCleanup(setattr, routes, name, getattr(routes, name))
+        self.addCleanup(routes._set_shadow, None, None, 0.0)
+        routes.model_registry = self.registry
+        routes.registry_watcher = RegistryWatcher(self.registry, routes._serve_detector,
+                                                  routes._set_shadow, poll_interval=60)
+        routes.registry_watcher.start()
+        self.addCleanup(routes.registry_watcher.stop)
+        self.assertTrue(routes.registry_watcher.wait_for(self.first, timeout=10))
+        self.client = create_app().test_client()
+    
+    def test_activate_and_rollback(self):
+        """Test switching versions through the API without a restart"""
+        response = self.client.post(f'/api/models/{self.second}/activate?wait=true')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.client.get('/api/status').get_json()['model_version'], self.second)
+        
+        response = self.client.post('/api/models/rollback?wait=true')
+        self.assertEqual(response.get_json()['version'], self.first)
+        self.assertEqual(routes.threat_detector.registry_version, self.first)
+        
+        models = self.client.get('/api/models').get_json()
+        self.assertEqual([model['version'] for model in models['models']],
+                         [self.first, self.second])
+        self.assertEqual(self.client.post('/api/models/v0042/activate').status_code, 404)
+    
+    def test_shadow_scoring(self):
+        """Test a shadow candidate sees live traffic and reports agreement"""
+        response = self.client.put('/api/models/shadow',
+                                   json={'version': self.second, 'sample_rate': 1.0})
+        self.assertEqual(response.status_code, 200)
+        routes.registry_watcher.check()
+        self.assertEqual(routes.shadow_scorer.version, self.second)
+        
+        self.client.post('/api/analyze/batch', json={'records': RECORDS})
+        routes.shadow_scorer.stop()
+        stats = self.client.get('/api/models/shadow').get_json()['stats']
+        self.assertEqual(stats['scored'], len(RECORDS))
+        self.assertIsNotNone(stats['agreement'])
+        
+        self.client.delete('/api/models/shadow')
+        routes.registry_watcher.check()
+        self.assertIsNone(routes.shadow_scorer)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,175 @@
+import json
+import os
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+import numpy as np
+from app.models.rules import RuleConfigError, RuleEngine, RuleEngineLoader, get_rule_loader
+from app.models.threat_detector import ThreatDetector
+
+RULES = {
+    'threat_threshold': 1.0,
+    'rules': [
+        {'name': 'admin_ports', 'ports': [22], 'port_ranges': [[3380, 3390]],
+         'weight': 1.0, 'threat_level': 'high'},
+        {'name': 'icmp_flood', 'protocols': ['ICMP'], 'thresholds': {'frequency': {'gte': 100}},
+         'weight': 0.5, 'threat_level': 'medium'},
+        {'name': 'big_icmp', 'protocols': ['ICMP'], 'thresholds': {'packet_size': {'gt': 1000}},
+         'weight': 0.5, 'threat_level': 'low'},
+        {'name': 'blocklist', 'source_cidrs': ['203.0.113.0/24', '2001:db8::/32'],
+         'weight': 1.0, 'threat_level': 'high', 'verdict': 'malicious'},
+        {'name': 'scanner_allowlist', 'source_cidrs': ['10.10.0.0/16'], 'ports': [22],
+         'weight': 0.0, 'verdict': 'benign'}
+    ]
+}
+
+class TestRuleEngine(unittest.TestCase):
+    def setUp(self):
+        self.engine = RuleEngine(RULES)
+        self.records = [
+            {'port': 3385, 'protocol': 'TCP', 'packet_size': 100, 'source_ip': '192.0.2.1'},
+            {'port': 80, 'protocol': 'icmp', 'packet_size': 1200, 'frequency': 150,
+             'source_ip': '192.0.2.1'},
+            {'port': 80, 'protocol': 'ICMP', 'packet_size': 1200, 'frequency': 5,
+             'source_ip': '192.0.2.1'},
+            {'port': 443, 'protocol': 'TCP', 'packet_size': 100, 'source_ip': '2001:db8::7'},
+            {'port': 22, 'protocol': 'TCP', 'packet_size': 100, 'source_ip': '10.10.3.4'},
+            {'port': 443, 'protocol': 'TCP', 'packet_size': 100, 'source_ip': 'not-an-ip'}
+        ]
+    
+    def test_batch_evaluation(self):
+        """Test weights, levels and verdicts over a batch"""
+        evaluation = self.engine.evaluate_batch(self.records)
+        
+        np.testing.assert_array_equal(evaluation.is_threat, [True, True, False, True, True, False])
+        self.assertEqual(list(evaluation.threat_levels),
+                         ['high', 'medium', 'low', 'high', 'high', 'low'])
+        np.testing.assert_array_equal(evaluation.verdicts, [0, 0, 0, 1, -1, 0])
+        self.assertEqual(evaluation.matched_rules(1), ['icmp_flood', 'big_icmp'])
+    
+    def test_batch_matches_single_record(self):
+        """Test vectorized evaluation agrees with one-at-a-time evaluation"""
+        evaluation = self.engine.evaluate_batch(self.records)
+        for index, record in enumerate(self.records):
+            single = self.engine.evaluate(record)
+            self.assertEqual(single.is_threat[0], evaluation.is_threat[index])
+            self.assertEqual(single.threat_levels[0], evaluation.threat_levels[index])
+    
+    def test_record_path_matches_batch_for_aggregates_and_reputation(self):
+        """Test scalar evaluation of aggregate thresholds and unloaded reputation lists"""
+        engine = RuleEngine({'rules': [
+            {'name': 'scan', 'thresholds': {'source_distinct_ports': {'gt': 10}}},
+            {'name': 'quiet', 'thresholds': {'source_connection_rate': {'lt': 1}}, 'weight': 0.5},
+            {'name': 'blocked', 'source_reputation': ['blocklisted'], 'verdict': 'malicious'}
+        ]})
+        self.assertFalse(engine.reputation_loaded)
+        self.assertEqual([rule.name for rule in engine.record_rules], ['scan', 'quiet'])
+        records = [{'port': 80}, {'port': 80, 'source_distinct_ports': 50},
+                   {'port': 80, 'source_connection_rate': 'x', 'source_ip': '203.0.113.1'}]
+        evaluation = engine.evaluate_batch(records)
+        for index, record in enumerate(records):
+            single = engine.evaluate(record)
+            self.assertEqual(single.matched_rules(0), evaluation.matched_rules(index))
+            self.assertEqual(single.is_threat[0], evaluation.is_threat[index])
+            self.assertEqual(single.verdicts[0], evaluation.verdicts[index])
+    
+    def test_invalid_rules_are_rejected(self):
+        """Test malformed rules fail to compile"""
+        with self.assertRaises(RuleConfigError):
+            RuleEngine({'rules': [{'name': 'bad', 'threat_level': 'severe'}]})
+        with self.assertRaises(RuleConfigError):
+            RuleEngine({'rules': [{'name': 'bad', 'thresholds': {'bytes': {'gt': 1}}}]})
+        with self.assertRaises(RuleConfigError):
+            RuleEngine({'rules': [{'name': 'bad', 'source_cidrs': ['300.0.0.0/8']}]})
+    
+    def test_malformed_values_are_rejected(self):
+        """Test well-formed JSON with bad values fails as RuleConfigError"""
+        for config in ({'rules': [{'ports': [70000]}]}, {'rules': [{'ports': [-1]}]},
+                       {'rules': [{'ports': 22}]}, {'rules': [{'weight': 'heavy'}]},
+                       {'rules': [{'port_ranges': [[1]]}]},
+                       {'rules': [{'port_ranges': [[90, 80]]}]},
+                       {'rules': [{'protocols': 'TCP', 'thresholds': {'port': {'gt': 'x'}}}]},
+                       {'rules': ['x']}, {'rules': 5}, {'threat_threshold': 'high'}, ['x']):
+            with self.subTest(config=config):
+                with self.assertRaises(RuleConfigError):
+                    RuleEngine(config)
+    
+    def test_default_rules_match_legacy_behavior(self):
+        """Test the bundled rule file reproduces the original hard-coded checks"""
+        detector = ThreatDetector()
+        self.assertEqual(detector._simple_threat_detection({'port': 445})['threat_level'], 'high')
+        medium = detector._simple_threat_detection({'port': 80, 'packet_size': 1600})
+        self.assertEqual(medium['threat_level'], 'medium')
+        frequent = detector._simple_threat_detection({'port': 80, 'frequency': 5000})
+        self.assertTrue(frequent['is_threat'])
+        self.assertEqual(frequent['threat_level'], 'low')
+        self.assertEqual(frequent['confidence'], 0.75)
+
+class TestRuleEngineLoader(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmpdir, ignore_errors=True)
+        self.path = os.path.join(self.tmpdir, 'rules.json')
+        self.write_rules({'rules': [{'name': 'ssh', 'ports': [22], 'threat_level': 'high'}]})
+    
+    def write_rules(self, config, mtime=None):
+        with open(self.path, 'w') as handle:
+            json.dump(config, handle)
+        if mtime is not None:
+            os.utime(self.path, (mtime, mtime))
+    
+    def test_hot_reload(self):
+        """Test rule changes are picked up without a restart and bad edits are ignored"""
+        loader = RuleEngineLoader(self.path, check_interval=0)
+        self.assertTrue(loader.current().evaluate({'port': 22}).is_threat[0])
+        
+        self.write_rules({'rules': [{'name': 'telnet', 'ports': [23], 'threat_level': 'high'}]},
+                         mtime=1000)
+        self.assertFalse(loader.current().evaluate({'port': 22}).is_threat[0])
+        self.assertTrue(loader.current().evaluate({'port': 23}).is_threat[0])
+        
+        with open(self.path, 'w') as handle:
+            handle.write('{not json')
+        os.utime(self.path, (2000, 2000))
+        self.assertTrue(loader.current().evaluate({'port': 23}).is_threat[0])
+        
+        invalid = [{'rules': [{'ports': [70000]}]}, {'rules': [{'weight': 'heavy'}]},
+                   {'rules': [{'port_ranges': [[1]]}]}, {'rules': ['x']}]
+        for mtime, config in enumerate(invalid, 3000):
+            self.write_rules(config, mtime=mtime)
+            self.assertTrue(loader.current().evaluate({'port': 23}).is_threat[0])
+    
+    def test_malformed_rules_at_startup(self):
+        """Test a bad rule file at startup leaves an empty rule set, not a failing detector"""
+        self.write_rules({'rules': [{'name': 'bad', 'ports': [70000], 'threat_level': 'high'}]})
+        loader = RuleEngineLoader(self.path, check_interval=0)
+        self.assertEqual(loader.current().rules, [])
+        result = ThreatDetector(rules=loader).predict_threat({'port': 22})
+        self.assertFalse(result['is_threat'])
+    
+    def test_prefilter_skips_model_for_verdicts(self):
+        """Test flows with a rule verdict bypass model scoring"""
+        self.write_rules({'rules': [
+            {'name': 'blocked', 'ports': [4444], 'threat_level': 'high', 'verdict': 'malicious'},
+            {'name': 'health_checks', 'ports': [8080], 'weight': 0, 'verdict': 'benign'}
+        ]})
+        detector = ThreatDetector(rules=get_rule_loader(self.path), rule_prefilter=True)
+        rng = np.random.default_rng(0)
+        detector.train(np.column_stack([rng.normal(512, 50, 300), rng.poisson(10, 300),
+                                        rng.choice([80, 443], 300), np.ones(300),
+                                        rng.exponential(0.5, 300)]))
+        
+        records = [{'port': 4444, 'packet_size': 500}, {'port': 8080, 'packet_size': 99999},
+                   {'port': 80, 'packet_size': 500}]
+        with mock.patch.object(detector, '_score_matrix', wraps=detector._score_matrix) as score:
+            results = detector.predict_batch(records)
+        
+        self.assertEqual(score.call_args[0][0].shape[0], 1)
+        self.assertTrue(results[0]['is_threat'])
+        self.assertEqual(results[0]['matched_rules'], ['blocked'])
+        self.assertFalse(results[1]['is_threat'])
+        self.assertNotIn('matched_rules', results[2])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,69 @@
+import os
+import shutil
+import tempfile
+import unittest
+import numpy as np
+from app.models.features import FeatureExtractor
+from app.utils.traffic_generator import LABEL_CODES, TrafficGenerator, ip_strings
+
+class TestTrafficGenerator(unittest.TestCase):
+    def test_ip_strings(self):
+        """Test integer addresses format as dotted quads"""
+        addresses = np.array([0xC0A80101, 0x0A000001, 0xFFFFFFFF, 0], dtype=np.uint32)
+        self.assertEqual(list(ip_strings(addresses)),
+                         ['192.168.1.1', '10.0.0.1', '255.255.255.255', '0.0.0.0'])
+    
+    def test_seeded_generators_are_reproducible(self):
+        """Test equal seeds give equal data and generators do not share state"""
+        first = TrafficGenerator(seed=3).generate(5000)
+        second = TrafficGenerator(seed=3).generate(5000)
+        self.assertTrue(first.equals(second))
+        self.assertFalse(first.equals(TrafficGenerator(seed=4).generate(5000)))
+    
+    def test_attack_injection(self):
+        """Test attack scenarios appear at roughly their configured rates"""
+        generator = TrafficGenerator(seed=0, attack_rates={'port_scan': 0.05, 'syn_flood': 0.05},
+                                     burst_lengths={'port_scan': 100, 'syn_flood': 100})
+        frame = generator.generate(200000)
+        shares = frame['label'].value_counts(normalize=True)
+        self.assertAlmostEqual(shares['port_scan'], 0.05, delta=0.015)
+        self.assertAlmostEqual(shares['syn_flood'], 0.05, delta=0.015)
+        self.assertEqual(shares['exfiltration'], 0)
+        
+        scans = frame[frame['label'] == 'port_scan']
+        self.assertGreater(scans['port'].nunique(), 50)
+        self.assertLess(scans['packet_size'].max(), 65)
+        floods = frame[frame['label'] == 'syn_flood']
+        self.assertGreater(floods['frequency'].mean(), 500)
+    
+    def test_chunks_continue_the_stream(self):
+        """Test chunks cover the requested rows with increasing timestamps"""
+        chunks = list(TrafficGenerator(seed=1).iter_chunks(25000, chunk_size=10000))
+        self.assertEqual([len(chunk) for chunk in chunks], [10000, 10000, 5000])
+        self.assertLess(chunks[0]['timestamp'].iloc[-1], chunks[1]['timestamp'].iloc[0])
+    
+    def test_write_npy(self):
+        """Test the streamed feature matrix matches in-memory extraction"""
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory, ignore_errors=True)
+        path = os.path.join(directory, 'traffic.npy')
+        _, labels_path = TrafficGenerator(seed=5).write_npy(path, 2500, chunk_size=1000)
+        
+        expected = TrafficGenerator(seed=5)
+        frames = list(expected.iter_chunks(2500, chunk_size=1000))
+        matrix = np.load(path)
+        self.assertEqual(matrix.shape, (2500, FeatureExtractor().n_features))
+        np.testing.assert_array_equal(matrix[:1000], FeatureExtractor().transform(frames[0]))
+        labels = np.load(labels_path)
+        self.assertEqual(int((labels == LABEL_CODES['normal']).sum()),
+                         sum(int((frame['label'] == 'normal').sum()) for frame in frames))
+    
+    def test_rejects_unknown_scenarios(self):
+        """Test unknown attack names and impossible rates are rejected"""
+        with self.assertRaises(ValueError):
+            TrafficGenerator(attack_rates={'ddos': 0.1})
+        with self.assertRaises(ValueError):
+            TrafficGenerator(attack_rates={'port_scan': 0.6, 'syn_flood': 0.5})
+
+if __name__ == '__main__':
+    unittest.main()
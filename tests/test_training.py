@@ -0,0 +1,40 @@
+import os
+import shutil
+import tempfile
+import unittest
+from app.models.training import TrainingJobManager
+
+TRAINING_DATA = [[500 + i, 10, 80, 1, 0.5] for i in range(50)]
+
+class TestTrainingJobManager(unittest.TestCase):
+    def setUp(self):
+        self.state_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.state_dir, ignore_errors=True)
+        self.published = []
+        self.manager = TrainingJobManager(self.published.append, state_dir=self.state_dir)
+        self.addCleanup(self.manager.shutdown)
+    
+    def test_pool_is_not_forked(self):
+        """Test the pool starts clean processes rather than forking a threaded worker"""
+        self.assertIn(self.manager.start_method, ('forkserver', 'spawn'))
+    
+    def test_job_state_visible_to_other_workers(self):
+        """Test a job submitted in one worker can be polled from another"""
+        job = self.manager.submit(TRAINING_DATA)
+        other_worker = TrainingJobManager(lambda detector: None, state_dir=self.state_dir)
+        self.assertIn(other_worker.get(job.job_id).status, ('queued', 'running', 'completed'))
+        
+        finished = other_worker.wait(job.job_id, timeout=60)
+        self.assertEqual(finished.status, 'completed')
+        self.assertEqual(finished.progress, 1.0)
+        self.assertEqual(finished.stats['total_rows'], 50)
+        self.assertEqual(len(self.published), 1)
+        self.assertEqual(os.listdir(self.state_dir), [f'{job.job_id}.json'])
+    
+    def test_unknown_and_malformed_ids(self):
+        """Test ids that are not job ids never become file paths"""
+        self.assertIsNone(self.manager.get('0' * 32))
+        self.assertIsNone(self.manager.get('../registry'))
+
+if __name__ == '__main__':
+    unittest.main()
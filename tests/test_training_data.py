@@ -0,0 +1,90 @@
+import io
+import os
+import shutil
+import tempfile
+import unittest
+import numpy as np
+import pandas as pd
+from app.models.features import FeatureExtractor
+from app.models.training_data import (TrainingFile, load_matrix, resolve_server_path, spool_upload,
+                                      stratified_quotas, validate_matrix)
+
+class TestTrainingData(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmpdir, ignore_errors=True)
+        self.extractor = FeatureExtractor()
+        rng = np.random.default_rng(0)
+        # Protocol 5 is a rare stratum: 1% of rows
+        protocols = np.where(np.arange(20000) % 100 == 0, 5, 1)
+        self.matrix = np.column_stack([rng.normal(512, 100, 20000), rng.poisson(10, 20000),
+                                       rng.choice([80, 443], 20000), protocols,
+                                       rng.exponential(0.5, 20000)])
+        self.path = os.path.join(self.tmpdir, 'train.npy')
+        np.save(self.path, self.matrix)
+    
+    def test_npy_is_memory_mapped(self):
+        """Test a .npy file is validated and used without loading it"""
+        X, total = load_matrix(TrainingFile(self.path), self.extractor)
+        self.assertIsInstance(X, np.memmap)
+        self.assertEqual(total, 20000)
+        np.testing.assert_array_equal(X[:5], self.matrix[:5])
+    
+    def test_validate_matrix(self):
+        """Test shape, dtype and non-finite values are rejected"""
+        with self.assertRaises(ValueError):
+            validate_matrix(np.zeros((10, 4)), 5)
+        with self.assertRaises(ValueError):
+            validate_matrix(np.array([['a'] * 5]), 5)
+        bad = self.matrix.copy()
+        bad[7, 2] = np.nan
+        with self.assertRaises(ValueError):
+            validate_matrix(bad, 5)
+        validate_matrix(bad, 5, check_finite=False)
+    
+    def test_reservoir_subsample(self):
+        """Test reservoir subsampling over chunks returns a bounded uniform sample"""
+        X, total = load_matrix(TrainingFile(self.path), self.extractor, subsample=1000,
+                               random_state=1, chunk_rows=3000)
+        self.assertEqual(X.shape, (1000, 5))
+        self.assertEqual(total, 20000)
+        self.assertAlmostEqual(X[:, 0].mean(), self.matrix[:, 0].mean(), delta=15)
+    
+    def test_stratified_subsample_keeps_rare_strata(self):
+        """Test stratified subsampling keeps each protocol's share"""
+        X, total = load_matrix(TrainingFile(self.path), self.extractor, subsample=1000,
+                               method='stratified', random_state=1, chunk_rows=3000)
+        self.assertEqual(total, 20000)
+        self.assertEqual(int((X[:, 3] == 5).sum()), 10)
+        self.assertEqual(int((X[:, 3] == 1).sum()), 990)
+    
+    def test_stratified_quotas_stay_within_subsample(self):
+        """Test quotas add up to the subsample even with many rare strata"""
+        counts = pd.Series([10000.0] + [1.0] * 30 + [3.0] * 5)
+        quotas = stratified_quotas(counts, 40)
+        self.assertEqual(quotas.sum(), 40)
+        self.assertTrue((quotas >= 1).all())
+        self.assertTrue((quotas <= counts).all())
+        
+        quotas = stratified_quotas(pd.Series([10000.0] + [1.0] * 50), 20)
+        self.assertEqual(quotas.sum(), 20)
+        self.assertEqual(quotas[0], 1)
+    
+    def test_spool_upload_and_server_paths(self):
+        """Test uploads are spooled to disk and server paths stay under the root"""
+        body = io.BytesIO()
+        np.save(body, self.matrix[:10])
+        body.seek(0)
+        source = spool_upload(body, 'npy', directory=self.tmpdir, block_size=64)
+        np.testing.assert_array_equal(np.load(source.path), self.matrix[:10])
+        source.cleanup()
+        self.assertFalse(os.path.exists(source.path))
+        
+        self.assertEqual(resolve_server_path('train.npy', self.tmpdir), os.path.realpath(self.path))
+        with self.assertRaises(PermissionError):
+            resolve_server_path('../train.npy', self.tmpdir)
+        with self.assertRaises(PermissionError):
+            resolve_server_path('train.npy', None)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,4 +1,5 @@
 import unittest
+import pandas as pd
 from app.utils.data_processor import NetworkDataProcessor
 
 class TestNetworkDataProcessor(unittest.TestCase):
@@ -41,6 +42,22 @@ class TestNetworkDataProcessor(unittest.TestCase):
         self.assertEqual(processed['protocol'], 'TCP')
         self.assertEqual(processed['packet_size'], 1024)
     
+    def test_process_network_frame(self):
+        """Test columnar log processing matches per-record processing"""
+        logs = pd.DataFrame([
+            {'source_ip': '192.168.1.1', 'port': '80', 'protocol': 'tcp', 'packet_size': '1024'},
+            {'source_ip': None, 'port': 'bad', 'protocol': None, 'duration': 1.5}
+        ])
+        
+        processed = NetworkDataProcessor.process_network_frame(logs)
+        
+        self.assertEqual(list(processed['port']), [80, 80])
+        self.assertEqual(list(processed['protocol']), ['TCP', 'UNKNOWN'])
+        self.assertEqual(list(processed['packet_size']), [1024, 0])
+        self.assertEqual(list(processed['frequency']), [1, 1])
+        self.assertEqual(list(processed['source_ip']), ['192.168.1.1', '0.0.0.0'])
+        self.assertEqual(processed['duration'][1], 1.5)
+    
     def test_generate_sample_data(self):
         """Test sample data generation"""
         sample_data = NetworkDataProcessor.generate_sample_data(10)